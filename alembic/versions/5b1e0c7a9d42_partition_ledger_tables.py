@@ -0,0 +1,141 @@
+"""partition journal entries, portfolio ledgers and wallet transactions by month
+
+Revision ID: 5b1e0c7a9d42
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+Converts a database whose ledger tables were created unpartitioned. A database built from scratch by the
+app's create_all already has the partitioned tables: stamp it with `alembic stamp head` instead of upgrading.
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e0c7a9d42'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+# table -> (foreign keys, indexes) recreated on the partitioned table
+tables = {
+    "journalentry": (
+        [("accountId", "account"), ("journalId", "journal")],
+        ['CREATE INDEX "ix_journalentry_accountId" ON journalentry ("accountId")', 'CREATE INDEX "ix_journalentry_journalId" ON journalentry ("journalId")'],
+    ),
+    "portfolioledger": (
+        [("portfolioId", "portfolio"), ("transactionId", "portfoliotransaction")],
+        ['CREATE INDEX "ix_portfolioledger_portfolioId" ON portfolioledger ("portfolioId")'],
+    ),
+    "wallettransaction": (
+        [("walletId", "wallet"), ("journalId", "journal")],
+        ['CREATE INDEX ix_wallettransaction_unsettled ON wallettransaction (id) WHERE NOT settled'],
+    ),
+}
+
+# foreign keys on id alone that a partitioned parent cannot satisfy: dropped with the legacy tables, restored on downgrade
+dependants = [
+    ("depositledger", "id", "portfolioledger"),
+    ("variableledger", "id", "portfolioledger"),
+    ("portfolio_wallet_transaction_association", "walletTransactionId", "wallettransaction"),
+    ("portfolioincomepayout", "walletTransactionId", "wallettransaction"),
+]
+
+
+def month_start(date: datetime) -> datetime:
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(date: datetime, months: int) -> datetime:
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    connection = op.get_bind()
+    current = month_start(datetime.now())
+
+    for table, (foreign_keys, indexes) in tables.items():
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_legacy')
+        op.execute(f'ALTER INDEX {table}_pkey RENAME TO {table}_legacy_pkey')
+        if table == "journalentry":
+            # the partition key has to exist when the table is created: entries take their journal's date
+            op.execute('CREATE TABLE journalentry (LIKE journalentry_legacy INCLUDING DEFAULTS, date TIMESTAMP WITHOUT TIME ZONE NOT NULL) PARTITION BY RANGE (date)')
+            first = connection.execute(sa.text('SELECT min(journal.date) FROM journalentry_legacy JOIN journal ON journal.id = journalentry_legacy."journalId"')).scalar()
+        else:
+            op.execute(f'CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (date)')
+            first = connection.execute(sa.text(f'SELECT min(date) FROM {table}_legacy')).scalar()
+        op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, date)')
+
+        month = month_start(first) if first else current
+        while month <= add_months(current, MONTHS_AHEAD):
+            op.execute(f"CREATE TABLE {table}_{month:%Y_%m} PARTITION OF {table} FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+            month = add_months(month, 1)
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+        if table == "journalentry":
+            op.execute('INSERT INTO journalentry (id, "accountId", "journalId", amount, side, description, date) SELECT e.id, e."accountId", e."journalId", e.amount, e.side, e.description, journal.date FROM journalentry_legacy e JOIN journal ON journal.id = e."journalId"')
+        else:
+            op.execute(f'INSERT INTO {table} SELECT * FROM {table}_legacy')
+
+        # keep the id sequence when the legacy table goes
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        op.execute(f'DROP TABLE {table}_legacy CASCADE')
+
+        for column, referenced in foreign_keys:
+            op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY ("{column}") REFERENCES {referenced} (id)')
+        for index in indexes:
+            op.execute(index)
+
+    op.create_index('ix_portfolio_wallet_transaction_association_walletTransactionId', 'portfolio_wallet_transaction_association', ['walletTransactionId'])
+
+    # the app's create_all adds missing tables at startup, so a server started on this code may have made it already
+    if sa.inspect(connection).has_table('archivedpartition'):
+        return
+    op.create_table(
+        'archivedpartition',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tableName', sa.String(), nullable=False),
+        sa.Column('partitionName', sa.String(), nullable=False),
+        sa.Column('rangeStart', sa.DateTime(), nullable=False),
+        sa.Column('rangeEnd', sa.DateTime(), nullable=False),
+        sa.Column('objectName', sa.String(), nullable=True),
+        sa.Column('rows', sa.BigInteger(), nullable=False),
+        sa.Column('bytes', sa.BigInteger(), nullable=False),
+        sa.Column('archivedAt', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('partitionName'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('archivedpartition')
+    op.drop_index('ix_portfolio_wallet_transaction_association_walletTransactionId', table_name='portfolio_wallet_transaction_association')
+
+    for table, (foreign_keys, indexes) in tables.items():
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_partitioned')
+        op.execute(f'ALTER INDEX {table}_pkey RENAME TO {table}_partitioned_pkey')
+        op.execute(f'CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS)')
+        if table == "journalentry":
+            op.execute('ALTER TABLE journalentry DROP COLUMN date')
+            op.execute('INSERT INTO journalentry (id, "accountId", "journalId", amount, side, description) SELECT id, "accountId", "journalId", amount, side, description FROM journalentry_partitioned')
+        else:
+            op.execute(f'INSERT INTO {table} SELECT * FROM {table}_partitioned')
+        op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        op.execute(f'DROP TABLE {table}_partitioned CASCADE')
+
+        for column, referenced in foreign_keys:
+            op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY ("{column}") REFERENCES {referenced} (id)')
+        for index in indexes:
+            op.execute(index)
+
+    for table, column, referenced in dependants:
+        op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY ("{column}") REFERENCES {referenced} (id)')
@@ -0,0 +1,29 @@
+"""add the bank reference to wallet transactions
+
+Revision ID: 8c3f2a6d1e57
+Revises: 5b1e0c7a9d42
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3f2a6d1e57'
+down_revision: Union[str, Sequence[str], None] = '5b1e0c7a9d42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # added to the partitioned parent, so every partition gets the column and the index
+    op.add_column('wallettransaction', sa.Column('reference', sa.String(), nullable=True))
+    op.create_index('ix_wallettransaction_reference', 'wallettransaction', ['reference'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_wallettransaction_reference', table_name='wallettransaction')
+    op.drop_column('wallettransaction', 'reference')
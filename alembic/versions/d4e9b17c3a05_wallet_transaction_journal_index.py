@@ -0,0 +1,26 @@
+"""index wallet transactions by journal for the integrity checker
+
+Revision ID: d4e9b17c3a05
+Revises: 8c3f2a6d1e57
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e9b17c3a05'
+down_revision: Union[str, Sequence[str], None] = '8c3f2a6d1e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_wallettransaction_journalId', 'wallettransaction', ['journalId'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_wallettransaction_journalId', table_name='wallettransaction')
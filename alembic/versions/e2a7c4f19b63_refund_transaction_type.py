@@ -0,0 +1,28 @@
+"""add the refund transaction type for purchase funds given back to wallets
+
+Revision ID: e2a7c4f19b63
+Revises: d4e9b17c3a05
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a7c4f19b63'
+down_revision: Union[str, Sequence[str], None] = 'd4e9b17c3a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # enum values are stored by name
+    op.execute("ALTER TYPE transactiontype ADD VALUE IF NOT EXISTS 'REFUND'")
+
+
+def downgrade() -> None:
+    # Postgres cannot drop a value from an enum type; the unused label is left in place
+    pass
@@ -0,0 +1,85 @@
+"""
+Concurrency benchmark for the request path: the sync Session dependency against the AsyncSession one.
+
+Two in-process routes run the same slow query, pg_sleep standing in for a heavy aggregate, one through
+database.db and one through database.AsyncDb. Requests are fired concurrently over an ASGI transport, so
+they share one event loop as they would on one uvicorn worker: the sync route blocks that loop for every
+query and serialises the requests, the async route overlaps them up to the async engine's pool size.
+
+Needs the database configured in .env. Usage, from the repository root:
+
+    python -m benchmarks.concurrency --requests 200 --concurrency 50 --delay 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import text
+from database import db, AsyncDb, engine, async_engine
+
+slow_query = text("SELECT pg_sleep(:delay)")
+
+def getApp(delay: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def syncQuery(db: db):
+        db.execute(slow_query, {"delay": delay})
+        return {"ok": True}
+
+    @app.get("/async")
+    async def asyncQuery(db: AsyncDb):
+        await db.execute(slow_query, {"delay": delay})
+        return {"ok": True}
+
+    return app
+
+async def runRequests(client: httpx.AsyncClient, path: str, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "seconds": elapsed,
+        "throughput": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+    }
+
+async def main(requests: int, concurrency: int, delay: float):
+    transport = httpx.ASGITransport(app=getApp(delay))
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # warm both pools so connection setup is not timed
+        await client.get("/sync")
+        await client.get("/async")
+        results = {path: await runRequests(client, path, requests, concurrency) for path in ["/sync", "/async"]}
+    await async_engine.dispose()
+    engine.dispose()
+
+    print(f"{requests} requests, {concurrency} concurrent, {delay * 1000:.0f} ms query, async pool {async_engine.pool.size()} + overflow")
+    print(f"{'route':<8}{'req/s':>10}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for path, result in results.items():
+        print(f"{path:<8}{result['throughput']:>10.1f}{result['seconds']:>10.2f}{result['p50'] * 1000:>10.1f}{result['p95'] * 1000:>10.1f}{result['max'] * 1000:>10.1f}")
+    print(f"speedup: {results['/async']['throughput'] / results['/sync']['throughput']:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sync and async database sessions under concurrent requests")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds each query sleeps in the database")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
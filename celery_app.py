@@ -1,15 +1,30 @@
 import asyncio
 import json
+import uuid
 import celery
+from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown, task_postrun
 from utils.brevo import sendOtpEmail
 from utils.anchor import createAnchorCustomer, getAnchorCustomer, validateAnchoTier2Kyc, validateAnchorTier3Kyc, uploadAnchorCustomerDocument, createAnchorDepositAccount, anchor_api_server_error_codes, anchor_api_client_error_codes, anchor_api_success_codes
 from utils.minio import download_s3_object, download_s3_object_for_requests
+from utils.execution import bookPurchaseTransaction, executeVenueTransactions, groupTransactionsByVenue
+from utils.netting import netDealingWindow, getNettedVenues, getWindowEnd
+from utils.settlement import runSettlement
+from utils.contribution import runContributionShard
+from utils.income import runIncomePayouts
+from utils.deposit import accrueDepositInterest, processMaturities
+from utils.distribution import processDistribution, getDueDistributions
+from utils.ledger import checkpointAccountBalances, rebuildAccountBalances, closePeriod
+from utils.partition import ensurePartitions, archivePartitions, getMonthStart, addMonths
+from utils.wallet import rebuildWalletBalances
+from utils.reconciliation import runReconciliation
+from utils.integrity import runIntegrityCheck, checkJournalRange, getJournalRanges
 import schemas
 from datetime import datetime, timedelta
 from typing import Optional
 from sqlalchemy import select, update
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from database import WorkerSession, engine
 import model
 from config import settings
 import logging
@@ -94,6 +109,79 @@ celery_app.conf.update(
         'execute_NGX_transaction_task': {'queue': 'transaction_queue'},
         'execute_alpaca_transaction_task': {'queue': 'transaction_queue'},
         'execute_mutual_fund_transaction_task': {'queue': 'transaction_queue'},
+        'execute_transaction_batch_task': {'queue': 'transaction_queue'},
+        'execute_venue_transactions_task': {'queue': 'transaction_queue'},
+        'net_dealing_window_task': {'queue': 'transaction_queue'},
+        'settle_transactions_task': {'queue': 'transaction_queue'},
+        'schedule_contributions_task': {'queue': 'transaction_queue'},
+        'run_contribution_shard_task': {'queue': 'transaction_queue'},
+        'pay_portfolio_income_task': {'queue': 'transaction_queue'},
+        'accrue_deposit_interest_task': {'queue': 'transaction_queue'},
+        'process_deposit_maturities_task': {'queue': 'transaction_queue'},
+        'process_distribution_task': {'queue': 'transaction_queue'},
+        'process_due_distributions_task': {'queue': 'transaction_queue'},
+        'checkpoint_account_balances_task': {'queue': 'transaction_queue'},
+        'rebuild_account_balances_task': {'queue': 'transaction_queue'},
+        'maintain_partitions_task': {'queue': 'transaction_queue'},
+        'archive_partitions_task': {'queue': 'transaction_queue'},
+        'rebuild_wallet_balances_task': {'queue': 'transaction_queue'},
+        'reconcile_statement_task': {'queue': 'transaction_queue'},
+        'close_period_task': {'queue': 'transaction_queue'},
+        'check_integrity_task': {'queue': 'transaction_queue'},
+        'revalidate_journals_task': {'queue': 'transaction_queue'},
+        'check_journal_range_task': {'queue': 'transaction_queue'},
+    },
+
+    # Periodic tasks
+    beat_schedule={
+        'net-dealing-window': {
+            'task': 'net_dealing_window_task',
+            'schedule': timedelta(minutes=settings.DEALING_WINDOW_MINUTES),
+        },
+        'end-of-day-settlement': {
+            'task': 'settle_transactions_task',
+            'schedule': crontab(hour=22, minute=30),  # 23:30 Lagos
+        },
+        'recurring-contributions': {
+            'task': 'schedule_contributions_task',
+            'schedule': crontab(minute=0),
+        },
+        'income-payouts': {
+            'task': 'pay_portfolio_income_task',
+            'schedule': crontab(hour=6, minute=0),  # 07:00 Lagos
+        },
+        'deposit-interest-accrual': {
+            'task': 'accrue_deposit_interest_task',
+            'schedule': crontab(hour=22, minute=0),  # 23:00 Lagos
+        },
+        'deposit-maturities': {
+            'task': 'process_deposit_maturities_task',
+            'schedule': crontab(hour=22, minute=15),  # 23:15 Lagos, after the accrual
+        },
+        'variable-distributions': {
+            'task': 'process_due_distributions_task',
+            'schedule': crontab(minute=30),  # hourly, pays declared distributions once due
+        },
+        'account-balance-checkpoints': {
+            'task': 'checkpoint_account_balances_task',
+            'schedule': crontab(hour=23, minute=5),  # 00:05 Lagos
+        },
+        'partition-maintenance': {
+            'task': 'maintain_partitions_task',
+            'schedule': crontab(hour=1, minute=0),
+        },
+        'partition-archival': {
+            'task': 'archive_partitions_task',
+            'schedule': crontab(day_of_month=2, hour=2, minute=0),
+        },
+        'ledger-integrity': {
+            'task': 'check_integrity_task',
+            'schedule': crontab(minute=45),  # hourly, new journals only
+        },
+        'period-close': {
+            'task': 'close_period_task',
+            'schedule': crontab(day_of_month=settings.PERIOD_CLOSE_DAY, hour=0, minute=30),  # closes the previous month
+        },
     },
     
     # Define durable queues for persistence
@@ -142,8 +230,43 @@ celery_app.conf.update(
     result_expires=3600,  # Results expire after 1 hour
 )
 
+# Per worker process state: one event loop and one session registry, created at fork
+worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+@worker_process_init.connect
+def initWorkerProcess(**kwargs):
+    global worker_loop
+    # connections inherited from the parent process must not be shared after fork
+    engine.dispose(close=False)
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+    logger.info("Worker process initialised with persistent event loop")
+
+@worker_process_shutdown.connect
+def shutdownWorkerProcess(**kwargs):
+    global worker_loop
+    WorkerSession.remove()
+    if worker_loop is not None and not worker_loop.is_closed():
+        worker_loop.close()
+    worker_loop = None
+    engine.dispose()
+
+@task_postrun.connect
+def releaseTaskSession(**kwargs):
+    # return the task's connection to the process pool
+    WorkerSession.remove()
+
+def runAsync(coroutine):
+    """
+    Run a coroutine on the worker's persistent event loop.
+    Falls back to a throwaway loop outside a worker process (eager mode, scripts).
+    """
+    if worker_loop is None or worker_loop.is_closed():
+        return asyncio.run(coroutine)
+    return worker_loop.run_until_complete(coroutine)
+
 async def linkAnchorAccount(anchor_customer_id: str, user_id: int):
-    db = SessionLocal()
+    db = WorkerSession()
     try:
         user = db.get(model.User, user_id)
         if not user:
@@ -182,7 +305,7 @@ def sendOtpTask(self, otp: str, email: str, type: str):
     """
     try:
         logger.info(f"Attempting to send OTP to {email} (attempt {self.request.retries + 1})")
-        response = asyncio.run(sendOtpEmail(otp=otp, email=email, otpType=schemas.OtpType(type)))
+        response = runAsync(sendOtpEmail(otp=otp, email=email, otpType=schemas.OtpType(type)))
         
         if response not in [200, 201]:
             raise Exception(f"OTP sending failed with status code: {response}")
@@ -200,7 +323,7 @@ def sendOtpTask(self, otp: str, email: str, type: str):
         raise self.retry(exc=exc, countdown=300, max_retries=3)
 
 def anchorAccountCreationError(userId: int, status: str, response_data: dict):
-    db = SessionLocal()
+    db = WorkerSession()
 
     anchorAccountCreationResponse = model.AnchorAccountCreationResponse(user_id=userId, status=status, response_data=json.dumps(response_data))
     db.add(anchorAccountCreationResponse)
@@ -225,7 +348,7 @@ def validateAnchorTier2KycTask(self, anchor_customer_id: str, mode: str):
     Results stored in RabbitMQ
     """
     logger.info(f"Attempting to validate KYC for {anchor_customer_id} (attempt {self.request.retries + 1})")
-    kyc =asyncio.run(validateAnchoTier2Kyc(anchor_customer_id=anchor_customer_id, mode=mode))
+    kyc =runAsync(validateAnchoTier2Kyc(anchor_customer_id=anchor_customer_id, mode=mode))
     if kyc.status_code in anchor_api_success_codes:
         logger.info(f"KYC validated successfully for {anchor_customer_id}")
         return {
@@ -256,7 +379,7 @@ def validateAnchorTier3KycTask(self, anchor_customer_id: str, mode: str):
     Results stored in RabbitMQ
     """
     logger.info(f"Attempting to validate KYC for {anchor_customer_id} (attempt {self.request.retries + 1})")
-    kyc =asyncio.run(validateAnchorTier3Kyc(anchor_customer_id=anchor_customer_id, mode=mode))
+    kyc =runAsync(validateAnchorTier3Kyc(anchor_customer_id=anchor_customer_id, mode=mode))
     if kyc.status_code in anchor_api_success_codes:
         logger.info(f"KYC validated successfully for {anchor_customer_id}")
         return {
@@ -283,15 +406,15 @@ def uploadAnchorKycDocumentTask(self, anchor_customer_id: str, document_id: str,
     Results stored in RabbitMQ
     """
 
-    db = SessionLocal()
+    db = WorkerSession()
     user = db.execute(select(model.User).where(model.User.email == email)).scalar_one_or_none()
     if user is None:
         raise Exception(f"User not found for email: {email}")
 
     logger.info(f"Attempting to upload KYC file for {anchor_customer_id} (attempt {self.request.retries + 1})")
-    s3_file_data = asyncio.run(download_s3_object_for_requests(bucket_name="user", object_name=f"{user.id}/kyc/{schemas.UserDocumentType.FRONT_ID.value}"))
+    s3_file_data = runAsync(download_s3_object_for_requests(bucket_name="user", object_name=f"{user.id}/kyc/{schemas.UserDocumentType.FRONT_ID.value}"))
     file_data = { "fileData": s3_file_data }
-    upload_request = asyncio.run(uploadAnchorCustomerDocument(anchor_customer_id=anchor_customer_id, document_id=document_id, file_data=file_data, mode=mode))
+    upload_request = runAsync(uploadAnchorCustomerDocument(anchor_customer_id=anchor_customer_id, document_id=document_id, file_data=file_data, mode=mode))
     if upload_request.status_code in anchor_api_success_codes:
         logger.info(f"KYC file uploaded successfully for {anchor_customer_id}")
         return {
@@ -323,7 +446,7 @@ def createAnchorDepositAccountTask(self, anchor_customer_id: str, email: str, mo
     """
     logger.info(f"Attempting to verify KYC for anchor_customer_id: {anchor_customer_id} (attempt {self.request.retries + 1})")
 
-    db = SessionLocal()
+    db = WorkerSession()
     user = db.execute(select(model.User).where(model.User.email == email)).scalar_one_or_none()
     if user is None:
         raise Exception(f"User not found for email: {email}")
@@ -341,7 +464,7 @@ def createAnchorDepositAccountTask(self, anchor_customer_id: str, email: str, mo
     
     # create anchor deposit account
     logger.info(f"Attempting to create Anchor deposit account for {anchor_customer_id} (attempt {self.request.retries + 1})")
-    status_code = asyncio.run(createAnchorDepositAccount(anchor_customer_id=anchor_customer_id, mode=schemas.AnchorMode(mode)))
+    status_code = runAsync(createAnchorDepositAccount(anchor_customer_id=anchor_customer_id, mode=schemas.AnchorMode(mode)))
     if status_code.get('code') in [200, 201]:
         logger.info(f"Anchor deposit account created successfully for {anchor_customer_id}")
         return {
@@ -381,7 +504,7 @@ def linkAnchorAccountTask(self, **kwargs):
     try:
         logger.info(f"Attempting to link Anchor account for anchor_customer_id: {anchor_customer_id} (attempt {self.request.retries + 1})")
 
-        db = SessionLocal()
+        db = WorkerSession()
         user = db.execute(select(model.User).where(model.User.email == email)).scalar_one_or_none()
         if user is None:
             raise Exception(f"User not found for email: {email}")
@@ -483,7 +606,7 @@ def notifyTaskCompletion(task_name: str, task_id: str, status: str, result=None,
     return payload
 
 async def executePurchaseTransaction(transaction_id: int):
-    db = SessionLocal()
+    db = WorkerSession()
     
     transaction = db.execute(select(model.PortfolioTransaction).where(model.PortfolioTransaction.id == transaction_id)).scalar_one_or_none()
     if transaction is None:
@@ -497,70 +620,7 @@ async def executePurchaseTransaction(transaction_id: int):
         raise Exception(f"Invalid transaction category: {transaction.category} for transaction_id: {transaction_id}")
     
     try:
-        # create transaction journal
-        transaction_journal = model.Journal(date=datetime.now())
-
-        # credit portfolio for consideration
-        portfolio_entry = model.JournalEntry(
-            accountId=57 if transaction.product.currency == schemas.Currency.USD else 12,
-            amount=transaction.amount,
-            side=schemas.EntrySide.CREDIT,
-            description=f"{transaction.product.title} transaction"
-        )
-
-        # debit asset holding for consideration
-        asset_holding_entry = model.JournalEntry(
-            accountId=transaction.product.productGroup.assetAccountId,
-            amount=transaction.amount,
-            side=schemas.EntrySide.DEBIT,
-            description=f"{transaction.product.title} transaction"
-        )
-        transaction_journal.entries.append(portfolio_entry)
-        transaction_journal.entries.append(asset_holding_entry)
-
-        if transaction.category == "deposittransaction":
-            portfolio_deposit = model.PortfolioDeposit(
-            transaction=transaction,
-            effectiveDate=datetime.now(),
-            maturityDate=transaction.date + timedelta(days=transaction.tenor),
-            matured=False,
-            closed=False,
-            closedDate=None,
-            isActive=False
-        )
-            portfolio_deposit.journal = transaction_journal
-            db.add(portfolio_deposit)
-        
-        # create deposit ledger
-            deposit_ledger = model.DepositLedger(
-            portfolioDeposit=portfolio_deposit,
-            side=schemas.UserLedgerSide.IN,
-            amount=transaction.amount,
-            date=datetime.now(),
-            account=schemas.PortfolioAccount.ASSET,
-            transactionId=transaction.id,
-            portfolioId=transaction.portfolio.id,
-        )
-            db.add(deposit_ledger)
-    
-        if transaction.category == "variabletransaction":
-            variable_ledger = model.VariableLedger(
-            variableId=transaction.product.id,
-            side=schemas.UserLedgerSide.IN,
-            amount=transaction.amount,
-            account=schemas.PortfolioAccount.ASSET,
-            transactionId=transaction.id,
-            price=transaction.price,
-            units=transaction.units,
-            date=datetime.now(),
-            portfolioId=transaction.portfolio.id,
-        )
-            db.add(variable_ledger)
-
-        db.add(transaction_journal)
-        transactionDB = db.execute(select(model.PortfolioTransaction).where(model.PortfolioTransaction.id == transaction_id)).scalar_one_or_none()
-        transactionDB.status = schemas.TransactionStatus.COMPLETED
-        db.add(transactionDB)
+        bookPurchaseTransaction(db, transaction)
         db.commit()
         return transaction
     except Exception as e:
@@ -569,6 +629,582 @@ async def executePurchaseTransaction(transaction_id: int):
     finally:
         db.close()
 
+@celery_app.task(
+    bind=True,
+    name='execute_transaction_batch_task',
+    base=CallbackTask,
+)
+def executeTransactionBatchTask(self, batch_id: str):
+    """
+    Execute a transaction batch
+    Groups the batch by venue and fans out one subtask per venue
+    """
+    db = WorkerSession()
+    try:
+        batch = db.get(model.TransactionBatch, uuid.UUID(batch_id))
+        if batch is None:
+            raise Exception(f"Transaction batch not found for batch_id: {batch_id}")
+        if batch.executed:
+            logger.info(f"Transaction batch {batch_id} already executed")
+            return {'status': 'skipped', 'batch_id': batch_id}
+
+        # netted venues are dealt per dealing window by net_dealing_window_task
+        netted_venues = getNettedVenues()
+        venues = {venue: transaction_ids for venue, transaction_ids in groupTransactionsByVenue(batch.portfolio_transactions).items() if venue not in netted_venues}
+        if venues:
+            celery.group(
+                executeVenueTransactionsTask.s(batch_id=batch_id, venue=venue.value, transaction_ids=transaction_ids)
+                for venue, transaction_ids in venues.items()
+            ).apply_async()
+
+        batch.executed = True
+        batch.executedAt = datetime.now()
+        db.add(batch)
+        db.commit()
+
+        logger.info(f"Transaction batch {batch_id} dispatched to {len(venues)} venue(s)")
+        return {
+            'status': 'success',
+            'batch_id': batch_id,
+            'venues': {venue.value: len(transaction_ids) for venue, transaction_ids in venues.items()},
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to execute transaction batch {batch_id}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='execute_venue_transactions_task',
+    base=CallbackTask,
+)
+def executeVenueTransactionsTask(self, batch_id: str, venue: str, transaction_ids: list[int]):
+    """
+    Execute the transactions of a batch routed to a single venue
+    All journals and ledgers are posted in one database transaction
+    """
+    db = WorkerSession()
+    try:
+        outcomes = executeVenueTransactions(db, schemas.TransactionVenue(venue), transaction_ids)
+        failed = [outcome for outcome in outcomes if outcome['status'] == schemas.TransactionStatus.FAILED.value]
+        logger.info(f"Batch {batch_id} {venue}: {len(outcomes) - len(failed)} executed, {len(failed)} failed")
+        return {
+            'status': 'success' if not failed else 'partial',
+            'batch_id': batch_id,
+            'venue': venue,
+            'outcomes': outcomes,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to execute {venue} transactions for batch {batch_id}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='net_dealing_window_task',
+    base=CallbackTask,
+)
+def netDealingWindowTask(self, window_end: Optional[str] = None):
+    """
+    Net pending orders across users for every netted venue and deal the residual per product
+    """
+    window = datetime.fromisoformat(window_end) if window_end else getWindowEnd(datetime.now())
+    db = WorkerSession()
+    try:
+        venues = {}
+        for venue in getNettedVenues():
+            venues[venue.value] = netDealingWindow(db, venue, window)
+        logger.info(f"Dealing window {window.isoformat()} netted: " + ", ".join(f"{venue} {len(results)} product(s)" for venue, results in venues.items()))
+        return {
+            'status': 'success',
+            'window_end': window.isoformat(),
+            'venues': venues,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to net dealing window {window.isoformat()}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='settle_transactions_task',
+    base=CallbackTask,
+)
+def settleTransactionsTask(self, value_date: Optional[str] = None):
+    """
+    End of day settlement of wallet and portfolio transactions
+    Safe to re-run: each stream resumes after its last settled chunk
+    """
+    date = datetime.fromisoformat(value_date) if value_date else datetime.now()
+    db = WorkerSession()
+    try:
+        results = runSettlement(db, date)
+        logger.info(f"Settlement {date.date()}: " + ", ".join(f"{result['stream']} {result.get('settled', 'failed')}" for result in results))
+        return {
+            'status': 'success' if not any('error' in result for result in results) else 'partial',
+            'value_date': date.date().isoformat(),
+            'streams': results,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to settle transactions for {date.date()}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='schedule_contributions_task',
+    base=CallbackTask,
+)
+def scheduleContributionsTask(self, as_of: Optional[str] = None):
+    """
+    Fan out one contribution task per shard of due plans
+    """
+    as_of = as_of or datetime.now().isoformat()
+    celery.group(
+        runContributionShardTask.s(shard=shard, shards=settings.CONTRIBUTION_SHARDS, as_of=as_of)
+        for shard in range(settings.CONTRIBUTION_SHARDS)
+    ).apply_async()
+    return {
+        'status': 'success',
+        'as_of': as_of,
+        'shards': settings.CONTRIBUTION_SHARDS,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+@celery_app.task(
+    bind=True,
+    name='run_contribution_shard_task',
+    base=CallbackTask,
+)
+def runContributionShardTask(self, shard: int, shards: int, as_of: str):
+    """
+    Book the due recurring contributions of one shard
+    """
+    db = WorkerSession()
+    try:
+        result = runContributionShard(db, shard, shards, datetime.fromisoformat(as_of))
+        logger.info(f"Contribution shard {shard}/{shards}: {result['orders']} orders from {result['plans']} plans")
+        return {
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to run contribution shard {shard}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='pay_portfolio_income_task',
+    base=CallbackTask,
+)
+def payPortfolioIncomeTask(self, as_of: Optional[str] = None):
+    """
+    Pay out due portfolio incomes
+    Re-runs are cheap: each (income, period) is paid at most once
+    """
+    date = datetime.fromisoformat(as_of) if as_of else datetime.now()
+    db = WorkerSession()
+    try:
+        result = runIncomePayouts(db, date)
+        logger.info(f"Income payouts {date.date()}: {result['paid']} paid of {result['incomes']} due")
+        return {
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to pay portfolio incomes for {date.date()}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='accrue_deposit_interest_task',
+    base=CallbackTask,
+)
+def accrueDepositInterestTask(self, accrual_date: Optional[str] = None):
+    """
+    Nightly interest and withholding tax accrual for open portfolio deposits
+    """
+    date = datetime.fromisoformat(accrual_date) if accrual_date else datetime.now()
+    db = WorkerSession()
+    try:
+        result = accrueDepositInterest(db, date)
+        logger.info(f"Interest accrual {date.date()}: {result['accrued']} of {result['deposits']} deposits accrued")
+        return {
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to accrue deposit interest for {date.date()}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='process_deposit_maturities_task',
+    base=CallbackTask,
+)
+def processDepositMaturitiesTask(self, as_of: Optional[str] = None):
+    """
+    Pay out or roll over deposits maturing today
+    """
+    date = datetime.fromisoformat(as_of) if as_of else datetime.now()
+    db = WorkerSession()
+    try:
+        result = processMaturities(db, date)
+        logger.info(f"Deposit maturities {date.date()}: {result['paid']} paid, {result['rolled']} rolled over of {result['deposits']}")
+        return {
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to process deposit maturities for {date.date()}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='process_distribution_task',
+    base=CallbackTask,
+)
+def processDistributionTask(self, distribution_id: int):
+    """
+    Pay a declared variable distribution to all holders in one batch
+    """
+    db = WorkerSession()
+    try:
+        result = processDistribution(db, distribution_id)
+        db.commit()
+        logger.info(f"Distribution {distribution_id}: {result['holders']} holders")
+        return {
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to process distribution {distribution_id}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='process_due_distributions_task',
+    base=CallbackTask,
+)
+def processDueDistributionsTask(self):
+    """
+    Fan out one distribution task per declared distribution that has come due
+    """
+    db = WorkerSession()
+    try:
+        distribution_ids = getDueDistributions(db, datetime.now())
+    finally:
+        db.close()
+    celery.group(processDistributionTask.s(distribution_id=distribution_id) for distribution_id in distribution_ids).apply_async()
+    return {
+        'status': 'success',
+        'distributions': len(distribution_ids),
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+@celery_app.task(
+    bind=True,
+    name='checkpoint_account_balances_task',
+    base=CallbackTask,
+)
+def checkpointAccountBalancesTask(self, date: Optional[str] = None):
+    """
+    Checkpoint every account's totals for the day that just closed
+    """
+    db = WorkerSession()
+    try:
+        day = datetime.fromisoformat(date) if date else datetime.now() - timedelta(days=1)
+        accounts = checkpointAccountBalances(db, day)
+        db.commit()
+        logger.info(f"Checkpointed {accounts} account balances for {day.date()}")
+        return {
+            'status': 'success',
+            'accounts': accounts,
+            'date': day.date().isoformat(),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to checkpoint account balances: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='rebuild_account_balances_task',
+    base=CallbackTask,
+)
+def rebuildAccountBalancesTask(self):
+    """
+    Recompute running account totals from the journal, to seed or repair them
+    """
+    db = WorkerSession()
+    try:
+        accounts = rebuildAccountBalances(db)
+        db.commit()
+        return {
+            'status': 'success',
+            'accounts': accounts,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to rebuild account balances: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='maintain_partitions_task',
+    base=CallbackTask,
+)
+def maintainPartitionsTask(self):
+    """
+    Create upcoming monthly partitions and re-home rows parked in default partitions
+    """
+    db = WorkerSession()
+    try:
+        created = ensurePartitions(db)
+        db.commit()
+        if created:
+            logger.info(f"Created partitions: {', '.join(created)}")
+        return {
+            'status': 'success',
+            'created': created,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to maintain partitions: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='archive_partitions_task',
+    base=CallbackTask,
+)
+def archivePartitionsTask(self):
+    """
+    Export closed partitions to Parquet in MinIO, then detach and drop them
+    """
+    db = WorkerSession()
+    try:
+        archived = archivePartitions(db)
+        return {
+            'status': 'success',
+            'archived': archived,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to archive partitions: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='rebuild_wallet_balances_task',
+    base=CallbackTask,
+)
+def rebuildWalletBalancesTask(self):
+    """
+    Recompute wallet balance rows from the wallet transactions, to seed or repair them
+    """
+    db = WorkerSession()
+    try:
+        wallets = rebuildWalletBalances(db)
+        db.commit()
+        return {
+            'status': 'success',
+            'wallets': wallets,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to rebuild wallet balances: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='reconcile_statement_task',
+    base=CallbackTask,
+)
+def reconcileStatementTask(self, run_id: int):
+    """
+    Reconcile a wallet group's bank statement against its wallet transactions and journals
+    """
+    db = WorkerSession()
+    try:
+        run = db.get(model.ReconciliationRun, run_id)
+        if run is None:
+            raise Exception(f"Reconciliation run not found for run_id: {run_id}")
+        if run.status != schemas.TransactionStatus.PENDING:
+            logger.info(f"Reconciliation run {run_id} already {run.status.value}")
+            return {'status': 'skipped', 'run_id': run_id}
+
+        counts = runReconciliation(db, run)
+        logger.info(f"Reconciliation run {run_id}: {counts['matched']} of {counts['lines']} lines matched, {counts['breaks']} breaks")
+        return {
+            'status': 'success',
+            'run_id': run_id,
+            **counts,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to reconcile run {run_id}: {str(e)}")
+        # breaks committed before the failure stay with the failed run
+        db.execute(update(model.ReconciliationRun).where(model.ReconciliationRun.id == run_id).values(status=schemas.TransactionStatus.FAILED, error=str(e)))
+        db.commit()
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='close_period_task',
+    base=CallbackTask,
+)
+def closePeriodTask(self, start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Close an accounting period and snapshot its account balances; the previous calendar month by default
+    """
+    db = WorkerSession()
+    try:
+        period_end = datetime.fromisoformat(end) if end else getMonthStart(datetime.now())
+        period_start = datetime.fromisoformat(start) if start else addMonths(period_end, -1)
+        period = closePeriod(db, period_start, period_end)
+        db.commit()
+        logger.info(f"Closed accounting period {period.id}: {period_start} to {period_end}")
+        return {
+            'status': 'success',
+            'period_id': period.id,
+            'start': period_start.isoformat(),
+            'end': period_end.isoformat(),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to close accounting period: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='check_integrity_task',
+    base=CallbackTask,
+)
+def checkIntegrityTask(self):
+    """
+    Validate the journals posted since the last run against double entry and their sub-ledgers
+    """
+    db = WorkerSession()
+    try:
+        totals = runIntegrityCheck(db)
+        if totals["unbalanced"] or totals["wallet"] or totals["portfolioLedger"]:
+            logger.error(f"Integrity violations found: {totals}")
+        return {
+            'status': 'success',
+            **totals,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to check ledger integrity: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='revalidate_journals_task',
+    base=CallbackTask,
+)
+def revalidateJournalsTask(self):
+    """
+    Revalidate the full journal history, one subtask per chunk of journal ids, run in parallel
+    """
+    db = WorkerSession()
+    try:
+        ranges = getJournalRanges(db)
+        if ranges:
+            celery.group(checkJournalRangeTask.s(low=low, high=high) for low, high in ranges).apply_async()
+        logger.info(f"Journal revalidation dispatched in {len(ranges)} chunk(s)")
+        return {
+            'status': 'success',
+            'chunks': len(ranges),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    finally:
+        db.close()
+
+@celery_app.task(
+    bind=True,
+    name='check_journal_range_task',
+    base=CallbackTask,
+)
+def checkJournalRangeTask(self, low: int, high: int):
+    """
+    Validate the journals with ids in (low, high]; leaves the incremental high-water mark alone
+    """
+    db = WorkerSession()
+    try:
+        counts = checkJournalRange(db, low, high)
+        db.commit()
+        return {
+            'status': 'success',
+            'low': low,
+            'high': high,
+            **counts,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to check journals {low} to {high}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
 @celery_app.task(
         bind=True,
         name='book_portfolio_deposit_task',
@@ -579,7 +1215,7 @@ def bookPortfolioDepositTask(self, deposit_transaction_id: int):
     Book portfolio deposit task
     """
     try:
-        result = asyncio.run(executePurchaseTransaction(deposit_transaction_id))
+        result = runAsync(executePurchaseTransaction(deposit_transaction_id))
         return result
     except Exception as e:
         logger.error(f"Failed to book portfolio deposit for deposit_transaction_id: {deposit_transaction_id}: {str(e)}")
@@ -595,7 +1231,7 @@ def executeNGXTransactionTask(self, portfolio_transaction_id: int):
     """
     try:
         # call NGX API to execute transaction
-        result = asyncio.run(executePurchaseTransaction(portfolio_transaction_id))
+        result = runAsync(executePurchaseTransaction(portfolio_transaction_id))
         return result
     except Exception as e:
         logger.error(f"Failed to execute NGX transaction for portfolio_transaction_id: {portfolio_transaction_id}: {str(e)}")
@@ -611,7 +1247,7 @@ def executeAlpacaTransactionTask(self, portfolio_transaction_id: int):
     """
     try:
         # call alpaca API to execute transaction
-        result = asyncio.run(executePurchaseTransaction(portfolio_transaction_id))
+        result = runAsync(executePurchaseTransaction(portfolio_transaction_id))
         return result
     except Exception as e:
         logger.error(f"Failed to execute Alpaca transaction for portfolio_transaction_id: {portfolio_transaction_id}: {str(e)}")
@@ -626,7 +1262,7 @@ def executeMutualFundTransactionTask(self, portfolio_transaction_id: int):
     Execute mutual fund transaction task
     """
     try:
-        result = asyncio.run(executePurchaseTransaction(portfolio_transaction_id))
+        result = runAsync(executePurchaseTransaction(portfolio_transaction_id))
         return result
     except Exception as e:
         logger.error(f"Failed to execute mutual fund transaction for portfolio_transaction_id: {portfolio_transaction_id}: {str(e)}")
@@ -31,12 +31,46 @@ class Settings(BaseSettings):
     RABBITMQ_URL: str
     REDIS_URL: str
     DB_DRIVER: str
+    ASYNC_DB_DRIVER: str = "postgresql+asyncpg" # driver of the request path's async engine
+    REPLICA_HOSTS: list[str] = [] # read replicas as host or host:port; reads use the primary when empty
+    REPLICA_POOL_SIZE: int = 5 # connections kept per replica engine
+    REPLICA_MAX_OVERFLOW: int = 10
+    REPLICA_LAG_SECONDS: int = 10 # a user's reads stay on the primary this long after their own write
     POLYGON_API_KEY: str
     TIINGO_API_KEY: str
     FINHUB_API_KEY: str
     TWELVEDATA_API_KEY: str
     PREMBLY_API_KEY_SANDBOX: str
     PREMBLY_API_KEY_LIVE: str
+    OUTBOX_BATCH_SIZE: int = 500
+    OUTBOX_POLL_SECONDS: float = 1.0
+    DEALING_WINDOW_MINUTES: int = 15
+    NETTED_VENUES: list[str] = ["us_equity", "ngx_equity", "ng_mutual_fund"]
+    SALE_RESERVATION_MINUTES: int = 30
+    SETTLEMENT_CHUNK_SIZE: int = 5000
+    CONTRIBUTION_SHARDS: int = 8
+    CONTRIBUTION_CHUNK_SIZE: int = 500
+    INCOME_CHUNK_SIZE: int = 500
+    ACCRUAL_CHUNK_SIZE: int = 10000
+    MATURITY_CHUNK_SIZE: int = 1000
+    WITHHOLDING_TAX_BPS: int = 1000
+    WITHHOLDING_TAX_ACCOUNT_ID: int = 16
+    TRIAL_BALANCE_CACHE_SECONDS: int = 60
+    PRINCIPAL_CACHE_SECONDS: int = 30 # how long an authenticated user's columns are served from redis
+    PARTITION_MONTHS_AHEAD: int = 3
+    ARCHIVE_AFTER_MONTHS: int = 24
+    ARCHIVE_TABLES: list[str] = ["journalentry"]
+    ARCHIVE_BUCKET: str = "ledger-archive"
+    ARCHIVE_BATCH_SIZE: int = 50000
+    EXPORT_CHUNK_SIZE: int = 5000
+    INTEGRITY_CHUNK_SIZE: int = 50000 # journals per check
+    INTEGRITY_LOOKBACK_IDS: int = 1000 # journals re-checked behind the high-water mark, for ids that committed late
+    PERIOD_CLOSE_DAY: int = 5 # day of the month the previous month is closed
+    RECONCILIATION_WINDOW_DAYS: int = 2
+    RECONCILIATION_CHUNK_SIZE: int = 10000
+    RECONCILIATION_BUCKET: str = "reconciliation"
+    RECONCILIATION_STATEMENT_URL: Optional[str] = None # local stand-in for the Anchor statement API
+    SETTLEMENT_DAYS: dict[str, int] = {"us_equity": 1, "ngx_equity": 2, "ng_mutual_fund": 1, "ng_deposit": 0, "wallet": 0}
     
 
 settings = Settings(
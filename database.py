@@ -1,11 +1,16 @@
 import os
+import random
 from dotenv import load_dotenv
 from pathlib import Path
 from sqlalchemy import URL, create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from typing import Annotated, Optional, Union
-from fastapi import Depends
+from fastapi import Depends, Request
 from model import Base
+import utils.ledger  # registers the account balance listener on every Session
+from utils.replica import getRequestUser, hasRecentWrite  # registers the recent write listeners on every Session
+import utils.principal  # registers the principal cache listeners on every Session
 from config import settings
 
 
@@ -27,13 +32,40 @@ db_url = URL.create(
     database=database,
 )
 
-engine = create_engine(db_url, pool_recycle=3600)
+engine = create_engine(db_url, pool_recycle=3600, pool_pre_ping=True)
 
-async def get_session():
+# request path: the same database through an async driver, so a slow query yields the event loop instead of blocking it
+async_engine = create_async_engine(db_url.set(drivername=settings.ASYNC_DB_DRIVER), pool_recycle=3600, pool_pre_ping=True)
+
+def getReplicaUrl(replica: str) -> URL:
+    replica_host, _, replica_port = replica.partition(":")
+    return db_url.set(host=replica_host, port=int(replica_port) if replica_port else port)
+
+# read replicas, each with its own pool: sync engines for streamed exports, async engines for request reads
+replica_engines = [
+    create_engine(getReplicaUrl(replica), pool_size=settings.REPLICA_POOL_SIZE, max_overflow=settings.REPLICA_MAX_OVERFLOW, pool_recycle=3600, pool_pre_ping=True)
+    for replica in settings.REPLICA_HOSTS
+]
+async_replica_engines = [
+    create_async_engine(getReplicaUrl(replica).set(drivername=settings.ASYNC_DB_DRIVER), pool_size=settings.REPLICA_POOL_SIZE, max_overflow=settings.REPLICA_MAX_OVERFLOW, pool_recycle=3600, pool_pre_ping=True)
+    for replica in settings.REPLICA_HOSTS
+]
+
+def usePrimary(request: Request) -> bool:
+    """
+    Reads go to the primary when there are no replicas, or when the caller wrote within REPLICA_LAG_SECONDS
+    and a replica may not show it yet
+    """
+    return not settings.REPLICA_HOSTS or hasRecentWrite(getRequestUser(request))
+
+async def get_session(request: Request):
     with Session(engine) as session:
+        session.info["user"] = getRequestUser(request)
         yield session
 
 async def create_db_and_tables():
+    # create_all only adds missing tables and never alters existing ones; those changes are alembic migrations.
+    # A database built from scratch here is already at the head revision: run `alembic stamp head` once on it.
     try:
         Base.metadata.create_all(engine)
         # SQLModel.metadata.create_all(engine)
@@ -42,4 +74,38 @@ async def create_db_and_tables():
 
 db = Annotated[Session, Depends(get_session)]
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# attributes stay loaded after commit: an expired attribute would need a lazy load, which an AsyncSession cannot do implicitly
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+async def get_async_session(request: Request):
+    async with AsyncSessionLocal() as session:
+        # a commit through this session keeps the user's reads on the primary for a while
+        session.info["user"] = getRequestUser(request)
+        yield session
+
+AsyncDb = Annotated[AsyncSession, Depends(get_async_session)]
+
+async def get_read_session(request: Request):
+    bind = async_engine if usePrimary(request) else random.choice(async_replica_engines)
+    async with AsyncSessionLocal(bind=bind) as session:
+        yield session
+
+# read-only endpoints that tolerate replica lag; never write through it
+ReadDb = Annotated[AsyncSession, Depends(get_read_session)]
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+ReplicaSessionLocals = [sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) for replica_engine in replica_engines]
+
+async def get_read_sessionmaker(request: Request) -> sessionmaker:
+    """
+    Session factory for reads that outlive the request, such as streamed exports, routed like ReadDb
+    """
+    if usePrimary(request):
+        return SessionLocal
+    return random.choice(ReplicaSessionLocals)
+
+ReadSessionMaker = Annotated[sessionmaker, Depends(get_read_sessionmaker)]
+
+# Celery workers: one session per task on the process-wide connection pool
+WorkerSession = scoped_session(SessionLocal)
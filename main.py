@@ -9,7 +9,7 @@ from typing import Annotated
 from router.v1 import v1
 import os
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from database import create_db_and_tables, db
+from database import create_db_and_tables, db, async_engine, async_replica_engines
 from sqlalchemy import select, func
 from utils.minio import upload_file
 import schemas
@@ -26,6 +26,8 @@ async def lifespan(app: FastAPI):
         logger.error(f"Error creating database and tables: {e}")
         raise
     yield
+    for request_engine in [async_engine] + async_replica_engines:
+        await request_engine.dispose()
 
 app = FastAPI(root_path="/", lifespan=lifespan)
 
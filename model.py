@@ -15,10 +15,13 @@ from sqlalchemy import (
     Index,
     text,
     Numeric,
-    BigInteger
+    BigInteger,
+    DDL,
+    event,
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, registry
-from sqlalchemy.dialects.postgresql import UUID, ENUM
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, registry, column_property
+from sqlalchemy.dialects.postgresql import UUID, ENUM, JSONB
+from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.sql import func
 from decimal import Decimal
 import enum
@@ -28,7 +31,8 @@ money = Annotated[Decimal, 20]
 rate = Annotated[Decimal, 3]
 
 
-class Base(DeclarativeBase):
+# AsyncAttrs: awaitable_attrs loads a lazy relationship explicitly under an AsyncSession
+class Base(AsyncAttrs, DeclarativeBase):
     registry(
         type_annotation_map={
             money: Numeric(20, 2),
@@ -378,6 +382,22 @@ class VariableAttributes(Base):
 
     variable: Mapped["Variable"] = relationship(back_populates="attributes")
 
+class VariableDistribution(Base):
+    __tablename__ = "variabledistribution"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    variableId: Mapped[int] = mapped_column(ForeignKey("variable.id"))
+    amountPerUnit: Mapped[int] = mapped_column(BigInteger) # in money value (100 = 1 currency unit)
+    recordDate: Mapped[datetime]
+    paymentDate: Mapped[datetime]
+    status: Mapped[schemas.TransactionStatus] = mapped_column(default=schemas.TransactionStatus.PENDING)
+    holders: Mapped[int] = mapped_column(default=0)
+    totalUnits: Mapped[int] = mapped_column(BigInteger, default=0)
+    totalAmount: Mapped[int] = mapped_column(BigInteger, default=0)
+    processedAt: Mapped[Optional[datetime]]
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (UniqueConstraint("variableId", "recordDate"),)
+
 class Deposit(Product):
     __tablename__ = "deposit"
 
@@ -425,6 +445,7 @@ class Portfolio(Base):
     user: Mapped["User"] = relationship(back_populates="portfolios")
     wealthObjectiveId: Mapped[Optional[int]] = mapped_column(ForeignKey("wealthobjective.id"))
     wealthObjective: Mapped["WealthObjective"] = relationship(back_populates="portfolios", lazy='selectin')
+    reinvestDistributions: Mapped[bool] = mapped_column(default=False)
 
     # Relationships
     user: Mapped["User"] = relationship(back_populates="portfolios")
@@ -444,9 +465,22 @@ class PortfolioIncome(Base):
     currency: Mapped[schemas.Currency]
     frequency: Mapped[schemas.Frequency]
     startDate: Mapped[datetime]
-    nextIncomeDate: Mapped[datetime]
+    nextIncomeDate: Mapped[datetime] = mapped_column(index=True)
     portfolio: Mapped["Portfolio"] = relationship(back_populates="income")
 
+class PortfolioIncomePayout(Base):
+    __tablename__ = "portfolioincomepayout"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    incomeId: Mapped[int] = mapped_column(ForeignKey("portfolioincome.id"))
+    portfolioId: Mapped[int] = mapped_column(ForeignKey("portfolio.id"))
+    period: Mapped[datetime] # the income date being paid
+    amount: Mapped[int] = mapped_column(BigInteger, default=0) # paid out, in minor units
+    status: Mapped[schemas.TransactionStatus]
+    walletTransactionId: Mapped[Optional[int]] # wallettransaction is partitioned by date, so no foreign key on id alone
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (UniqueConstraint("incomeId", "period"),)
+
 class PortfolioTarget(Base):
     __tablename__ = "portfoliotarget"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -466,7 +500,11 @@ class PortfolioContributionPlan(Base):
     currency: Mapped[schemas.Currency]
     frequency: Mapped[schemas.Frequency]
     startDate: Mapped[datetime]
-    nextContributionDate: Mapped[datetime]
+    nextContributionDate: Mapped[datetime] = mapped_column(index=True)
+    productId: Mapped[Optional[int]] = mapped_column(ForeignKey("product.id")) # product bought with each contribution
+    tenor: Mapped[Optional[int]] # deposit tenor in days when the product is a deposit
+    lastContributionDate: Mapped[Optional[datetime]]
+    lastContributionStatus: Mapped[Optional[schemas.TransactionStatus]]
     portfolio: Mapped["Portfolio"] = relationship(back_populates="contributionPlan")
 
 class PortfolioAllocation(Base):
@@ -501,20 +539,27 @@ class PortfolioDeposit(Base):
     closed: Mapped[bool] = mapped_column(default=False)
     closedDate: Mapped[Optional[datetime]]
     isActive: Mapped[bool] = mapped_column(default=False)
+    lastAccrualDate: Mapped[Optional[datetime]] # interest is accrued up to (excluding) this date
+    rollover: Mapped[bool] = mapped_column(default=False) # roll into a new deposit at maturity instead of paying out
     journalId: Mapped[int] = mapped_column(ForeignKey("journal.id"))
     journal: Mapped["Journal"] = relationship(lazy='selectin')
 
-    __table_args__ = (UniqueConstraint("transactionId", "effectiveDate", "maturityDate"),)
+    __table_args__ = (
+        UniqueConstraint("transactionId", "effectiveDate", "maturityDate"),
+        Index("ix_portfoliodeposit_open", "id", postgresql_where=text("NOT closed AND NOT matured")),
+        Index("ix_portfoliodeposit_maturity", "maturityDate", postgresql_where=text("NOT closed AND NOT matured")),
+    )
 
+# partitioned monthly by date (see utils/partition.py): the table key is (id, date), the mapper key is id
 class PortfolioLedger(Base):
     __tablename__ = "portfolioledger"
-    id: Mapped[int] = mapped_column(primary_key=True)
-    portfolioId: Mapped[int] = mapped_column(ForeignKey("portfolio.id"))
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    portfolioId: Mapped[int] = mapped_column(ForeignKey("portfolio.id"), index=True)
     transactionId: Mapped[Optional[int]] = mapped_column(ForeignKey("portfoliotransaction.id"))
     transaction: Mapped[Optional["PortfolioTransaction"]] = relationship(lazy='selectin')
     side: Mapped[schemas.UserLedgerSide]
     amount: Mapped[int] = mapped_column(BigInteger)
-    date: Mapped[datetime]
+    date: Mapped[datetime] = mapped_column(primary_key=True)
     account: Mapped[schemas.PortfolioAccount]
 
     type: Mapped[str]
@@ -522,42 +567,70 @@ class PortfolioLedger(Base):
     __mapper_args__ = {
         "polymorphic_identity": "portfolioledger",
         "polymorphic_on": "type",
+        "primary_key": [id],
     }
+    __table_args__ = {"postgresql_partition_by": "RANGE (date)"}
 
+# subtype rows join on id alone; a foreign key would need the parent's full partition key
 class DepositLedger(PortfolioLedger):
     __tablename__ = "depositledger"
-    id: Mapped[int] = mapped_column(ForeignKey("portfolioledger.id"), primary_key=True)
-    portfolioDepositId: Mapped[int] = mapped_column(ForeignKey("portfoliodeposit.id"))
+    id: Mapped[int] = column_property(mapped_column(Integer, primary_key=True, autoincrement=False), PortfolioLedger.id)
+    portfolioDepositId: Mapped[int] = mapped_column(ForeignKey("portfoliodeposit.id"), index=True)
     portfolioDeposit: Mapped["PortfolioDeposit"] = relationship(lazy='selectin')
 
     __mapper_args__ = {
         "polymorphic_identity": "depositledger",
+        "inherit_condition": id == PortfolioLedger.id,
+        "inherit_foreign_keys": [id],
     }
 
 class VariableLedger(PortfolioLedger):
     __tablename__ = "variableledger"
-    id: Mapped[int] = mapped_column(ForeignKey("portfolioledger.id"), primary_key=True)
-    variableId: Mapped[int] = mapped_column(ForeignKey("variable.id"))
+    id: Mapped[int] = column_property(mapped_column(Integer, primary_key=True, autoincrement=False), PortfolioLedger.id)
+    variableId: Mapped[int] = mapped_column(ForeignKey("variable.id"), index=True)
     variable: Mapped["Variable"] = relationship(lazy='selectin')
     price: Mapped[int]
     units: Mapped[int]
 
     __mapper_args__ = {
         "polymorphic_identity": "variableledger",
+        "inherit_condition": id == PortfolioLedger.id,
+        "inherit_foreign_keys": [id],
     }
 
+# units or principal held back for sale orders that have not been booked yet
+class PortfolioReservation(Base):
+    __tablename__ = "portfolioreservation"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    portfolioId: Mapped[int] = mapped_column(ForeignKey("portfolio.id"))
+    productId: Mapped[int] = mapped_column(ForeignKey("product.id"))
+    portfolioDepositId: Mapped[Optional[int]] = mapped_column(ForeignKey("portfoliodeposit.id"))
+    transactionId: Mapped[Optional[int]] = mapped_column(ForeignKey("portfoliotransaction.id"))
+    units: Mapped[int] = mapped_column(BigInteger, default=0) # variable units
+    amount: Mapped[int] = mapped_column(BigInteger, default=0) # deposit principal in minor units
+    released: Mapped[bool] = mapped_column(default=False)
+    expiresAt: Mapped[datetime]
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_portfolioreservation_active", "portfolioId", "productId", postgresql_where=text("NOT released")),
+    )
+
 # Association table for many-to-many relationship between PortfolioTransaction and WalletTransaction
 class PortfolioWalletTransactionAssociation(Base):
     __tablename__ = 'portfolio_wallet_transaction_association'
     
     portfolioTransactionId: Mapped[int] = mapped_column(ForeignKey('portfoliotransaction.id'), primary_key=True)
-    walletTransactionId: Mapped[int] = mapped_column(ForeignKey('wallettransaction.id'), primary_key=True)
+    walletTransactionId: Mapped[int] = mapped_column(primary_key=True, index=True) # wallettransaction is partitioned, joined on id alone
     createdAt: Mapped[datetime] = mapped_column(server_default=func.now())
     updatedAt: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
     
     # Relationships
     portfolio_transaction: Mapped["PortfolioTransaction"] = relationship(back_populates="wallet_transaction_associations")
-    wallet_transaction: Mapped["WalletTransaction"] = relationship(back_populates="portfolio_transaction_associations")
+    wallet_transaction: Mapped["WalletTransaction"] = relationship(
+        back_populates="portfolio_transaction_associations",
+        primaryjoin="foreign(PortfolioWalletTransactionAssociation.walletTransactionId) == WalletTransaction.id",
+    )
 
 class TransactionBatch(Base):
     __tablename__ = "transactionbatch"
@@ -568,6 +641,25 @@ class TransactionBatch(Base):
 
     portfolio_transactions: Mapped[List["PortfolioTransaction"]] = relationship(back_populates="batch", lazy='selectin')
 
+class NettedOrder(Base):
+    __tablename__ = "nettedorder"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    productId: Mapped[int] = mapped_column(ForeignKey("product.id"))
+    venue: Mapped[schemas.TransactionVenue]
+    windowEnd: Mapped[datetime]
+    buyUnits: Mapped[int] = mapped_column(BigInteger)
+    sellUnits: Mapped[int] = mapped_column(BigInteger)
+    side: Mapped[Optional[schemas.TransactionType]] # None when buys and sells cross exactly
+    orderUnits: Mapped[int] = mapped_column(BigInteger)
+    filledUnits: Mapped[int] = mapped_column(BigInteger, default=0)
+    price: Mapped[Optional[int]] # fill price in minor units (100 = 1 currency unit)
+    status: Mapped[schemas.TransactionStatus]
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    product: Mapped["Product"] = relationship()
+
+    __table_args__ = (UniqueConstraint("productId", "windowEnd"),)
+
 class PortfolioTransaction(Base):
     __tablename__ = "portfoliotransaction"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -583,6 +675,7 @@ class PortfolioTransaction(Base):
     batch: Mapped["TransactionBatch"] = relationship(back_populates="portfolio_transactions")
     category: Mapped[str]
     settlement: Mapped[schemas.TransactionStatus]
+    nettedOrderId: Mapped[Optional[int]] = mapped_column(ForeignKey("nettedorder.id"), index=True)
     
     # Many-to-many relationship with WalletTransaction through association table
     wallet_transaction_associations: Mapped[List["PortfolioWalletTransactionAssociation"]] = relationship(
@@ -594,6 +687,8 @@ class PortfolioTransaction(Base):
     def wallet_transactions(self) -> List["WalletTransaction"]:
         return [assoc.wallet_transaction for assoc in self.wallet_transaction_associations]
 
+    __table_args__ = (Index("ix_portfoliotransaction_settlement", "settlement", "status", "id"),)
+
     __mapper_args__ = {
         "polymorphic_identity": "portfoliotransaction",
         "polymorphic_on": "category",
@@ -649,23 +744,26 @@ class Wallet(Base):
     user: Mapped["User"] = relationship(back_populates="wallets")
     transactions: Mapped[List["WalletTransaction"]] = relationship(back_populates="wallet")
 
+# partitioned monthly by date (see utils/partition.py): the table key is (id, date), the mapper key is id
 class WalletTransaction(Base):
     __tablename__ = "wallettransaction"
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     walletId: Mapped[int] = mapped_column(ForeignKey("wallet.id"))
     wallet: Mapped["Wallet"] = relationship(back_populates="transactions")
     settled: Mapped[bool] = mapped_column(default=False)
     settledAt: Mapped[Optional[datetime]]
     type: Mapped[schemas.TransactionType]
     amount: Mapped[int] = mapped_column(BigInteger)
-    date: Mapped[datetime] = mapped_column(server_default=func.now())
+    date: Mapped[datetime] = mapped_column(primary_key=True, server_default=func.now())
     status: Mapped[schemas.TransactionStatus]
-    journalId: Mapped[int] = mapped_column(ForeignKey("journal.id"))
+    journalId: Mapped[int] = mapped_column(ForeignKey("journal.id"), index=True)
     journal: Mapped["Journal"] = relationship(lazy='selectin')
+    reference: Mapped[Optional[str]] = mapped_column(index=True) # bank or payment reference, matched by reconciliation
     
     # Many-to-many relationship with PortfolioTransaction through association table
     portfolio_transaction_associations: Mapped[List["PortfolioWalletTransactionAssociation"]] = relationship(
-        back_populates="wallet_transaction"
+        back_populates="wallet_transaction",
+        primaryjoin="WalletTransaction.id == foreign(PortfolioWalletTransactionAssociation.walletTransactionId)",
     )
     
     # Convenience property to access portfolio transactions directly
@@ -673,6 +771,41 @@ class WalletTransaction(Base):
     def portfolio_transactions(self) -> List["PortfolioTransaction"]:
         return [assoc.portfolio_transaction for assoc in self.portfolio_transaction_associations]
 
+    __mapper_args__ = {"primary_key": [id]}
+    __table_args__ = (
+        Index("ix_wallettransaction_unsettled", "id", postgresql_where=text("NOT settled")),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
+
+# running wallet balances, updated in the same transaction as every wallet transaction
+class WalletBalance(Base):
+    __tablename__ = "walletbalance"
+    walletId: Mapped[int] = mapped_column(ForeignKey("wallet.id"), primary_key=True)
+    available: Mapped[int] = mapped_column(BigInteger, default=0) # spendable: ledger less unsettled inflows and holds
+    ledger: Mapped[int] = mapped_column(BigInteger, default=0) # all completed inflows less outflows
+    hold: Mapped[int] = mapped_column(BigInteger, default=0)
+    version: Mapped[int] = mapped_column(default=1)
+    updatedAt: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+    __mapper_args__ = {"version_id_col": version}
+
+# wallet funds held for a pending purchase until it is executed (converted) or fails (released)
+class WalletHold(Base):
+    __tablename__ = "wallethold"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    walletId: Mapped[int] = mapped_column(ForeignKey("wallet.id"))
+    portfolioTransactionId: Mapped[int] = mapped_column(ForeignKey("portfoliotransaction.id"))
+    amount: Mapped[int] = mapped_column(BigInteger) # consideration and fees in minor units
+    released: Mapped[bool] = mapped_column(default=False)
+    converted: Mapped[bool] = mapped_column(default=False)
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+    releasedAt: Mapped[Optional[datetime]]
+
+    __table_args__ = (
+        Index("ix_wallethold_active", "portfolioTransactionId", postgresql_where=text("NOT released")),
+        Index("ix_wallethold_wallet_active", "walletId", postgresql_where=text("NOT released")),
+    )
 
 # financial accounting model
 
@@ -704,15 +837,17 @@ class Account(Base):
 class Journal(Base):
     __tablename__ = "journal"
     id: Mapped[int] = mapped_column(primary_key=True)
-    date: Mapped[datetime] = mapped_column(server_default=func.now())
+    date: Mapped[datetime] = mapped_column(server_default=func.now(), index=True)
 
     entries: Mapped[List["JournalEntry"]] = relationship(back_populates="journal")
 
+# partitioned monthly by date (see utils/partition.py): the table key is (id, date), the mapper key is id
 class JournalEntry(Base):
     __tablename__ = "journalentry"
-    id: Mapped[int] = mapped_column(primary_key=True)
-    accountId: Mapped[int] = mapped_column(ForeignKey("account.id"))
-    journalId: Mapped[int] = mapped_column(ForeignKey("journal.id"))
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    accountId: Mapped[int] = mapped_column(ForeignKey("account.id"), index=True)
+    journalId: Mapped[int] = mapped_column(ForeignKey("journal.id"), index=True)
+    date: Mapped[datetime] = mapped_column(primary_key=True) # the journal's date, copied for partitioning
     amount: Mapped[int] = mapped_column(BigInteger)
     side: Mapped[schemas.EntrySide]  # e.g., "credit", "debit"
     description: Mapped[Optional[str]]
@@ -720,3 +855,148 @@ class JournalEntry(Base):
     journal: Mapped[Optional["Journal"]] = relationship(back_populates="entries")
     account: Mapped[Optional["Account"]] = relationship(back_populates="entries", lazy='selectin')
 
+    __mapper_args__ = {"primary_key": [id]}
+    __table_args__ = {"postgresql_partition_by": "RANGE (date)"}
+
+class AccountBalance(Base):
+    """
+    Running debit and credit totals per account, maintained on every journal post
+    """
+    __tablename__ = "accountbalance"
+    accountId: Mapped[int] = mapped_column(ForeignKey("account.id"), primary_key=True)
+    debit: Mapped[int] = mapped_column(BigInteger, default=0)
+    credit: Mapped[int] = mapped_column(BigInteger, default=0)
+    updatedAt: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+class AccountBalanceCheckpoint(Base):
+    """
+    Debit and credit totals per account for every journal dated up to the end of date
+    """
+    __tablename__ = "accountbalancecheckpoint"
+    accountId: Mapped[int] = mapped_column(ForeignKey("account.id"), primary_key=True)
+    date: Mapped[datetime] = mapped_column(primary_key=True)
+    debit: Mapped[int] = mapped_column(BigInteger, default=0)
+    credit: Mapped[int] = mapped_column(BigInteger, default=0)
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+
+# an accounting period [start, end); once closed, nothing may be posted into it
+class AccountingPeriod(Base):
+    __tablename__ = "accountingperiod"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    start: Mapped[datetime] = mapped_column(unique=True)
+    end: Mapped[datetime] = mapped_column(unique=True)
+    closed: Mapped[bool] = mapped_column(default=False)
+    closedAt: Mapped[Optional[datetime]]
+    createdAt: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    balances: Mapped[List["PeriodBalance"]] = relationship(back_populates="period")
+
+class PeriodBalance(Base):
+    """
+    Per-account totals frozen when a period closes: the period's own debits and credits and the closing cumulative totals
+    """
+    __tablename__ = "periodbalance"
+    periodId: Mapped[int] = mapped_column(ForeignKey("accountingperiod.id"), primary_key=True)
+    accountId: Mapped[int] = mapped_column(ForeignKey("account.id"), primary_key=True)
+    debit: Mapped[int] = mapped_column(BigInteger, default=0)
+    credit: Mapped[int] = mapped_column(BigInteger, default=0)
+    closingDebit: Mapped[int] = mapped_column(BigInteger, default=0)
+    closingCredit: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    period: Mapped["AccountingPeriod"] = relationship(back_populates="balances")
+
+# how far an incremental integrity check has got; it resumes after lastId
+class IntegrityCheckpoint(Base):
+    __tablename__ = "integritycheckpoint"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    lastId: Mapped[int] = mapped_column(BigInteger, default=0)
+    checkedCount: Mapped[int] = mapped_column(BigInteger, default=0)
+    updatedAt: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
+
+class IntegrityViolation(Base):
+    __tablename__ = "integrityviolation"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(unique=True) # one row per violation however often it is re-checked
+    type: Mapped[schemas.IntegrityViolationType]
+    journalId: Mapped[Optional[int]] = mapped_column(index=True)
+    accountId: Mapped[Optional[int]]
+    date: Mapped[Optional[datetime]]
+    expected: Mapped[int] = mapped_column(BigInteger, default=0)
+    actual: Mapped[int] = mapped_column(BigInteger, default=0)
+    detectedAt: Mapped[datetime] = mapped_column(server_default=func.now())
+
+# closed monthly partitions exported to Parquet in MinIO and dropped from the database
+class ArchivedPartition(Base):
+    __tablename__ = "archivedpartition"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tableName: Mapped[str]
+    partitionName: Mapped[str] = mapped_column(unique=True)
+    rangeStart: Mapped[datetime]
+    rangeEnd: Mapped[datetime]
+    objectName: Mapped[Optional[str]] # None when the partition was empty
+    rows: Mapped[int] = mapped_column(BigInteger, default=0)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    archivedAt: Mapped[datetime] = mapped_column(server_default=func.now())
+
+# one reconciliation of a wallet group's bank statement against its wallet transactions and journals
+class ReconciliationRun(Base):
+    __tablename__ = "reconciliationrun"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    walletGroupId: Mapped[int] = mapped_column(ForeignKey("walletgroup.id"))
+    source: Mapped[str] # statement object name, or "anchor" for the statement API
+    start: Mapped[datetime]
+    end: Mapped[datetime]
+    status: Mapped[schemas.TransactionStatus] = mapped_column(default=schemas.TransactionStatus.PENDING)
+    lines: Mapped[int] = mapped_column(BigInteger, default=0)
+    matched: Mapped[int] = mapped_column(BigInteger, default=0)
+    breaks: Mapped[int] = mapped_column(BigInteger, default=0)
+    error: Mapped[Optional[str]]
+    createdAt: Mapped[datetime] = mapped_column(server_default=func.now())
+    completedAt: Mapped[Optional[datetime]]
+
+class ReconciliationBreak(Base):
+    __tablename__ = "reconciliationbreak"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    runId: Mapped[int] = mapped_column(ForeignKey("reconciliationrun.id"), index=True)
+    type: Mapped[schemas.ReconciliationBreakType]
+    walletTransactionId: Mapped[Optional[int]]
+    journalId: Mapped[Optional[int]]
+    reference: Mapped[Optional[str]]
+    amount: Mapped[int] = mapped_column(BigInteger, default=0) # statement or wallet amount in minor units
+    expectedAmount: Mapped[Optional[int]] = mapped_column(BigInteger) # the other side, when there is one
+    date: Mapped[Optional[datetime]]
+
+# partitioned tables get a DEFAULT partition when created; monthly ones are added by utils/partition.py
+for _partitioned in (JournalEntry.__table__, PortfolioLedger.__table__, WalletTransaction.__table__):
+    event.listen(_partitioned, "after_create", DDL(f'CREATE TABLE IF NOT EXISTS "{_partitioned.name}_default" PARTITION OF "{_partitioned.name}" DEFAULT'))
+
+# task dispatch
+
+class TaskOutbox(Base):
+    __tablename__ = "taskoutbox"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    taskId: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), default=uuid.uuid4, unique=True)
+    taskName: Mapped[str]
+    kwargs: Mapped[dict] = mapped_column(JSONB, default=dict)
+    sent: Mapped[bool] = mapped_column(default=False)
+    sentAt: Mapped[Optional[datetime]]
+    attempts: Mapped[int] = mapped_column(default=0)
+    lastError: Mapped[Optional[str]]
+    createdAt: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (Index("ix_taskoutbox_unsent", "id", postgresql_where=text("NOT sent")),)
+
+# settlement
+
+class SettlementRun(Base):
+    __tablename__ = "settlementrun"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    valueDate: Mapped[datetime]
+    stream: Mapped[str] # "wallet" or a TransactionVenue value
+    lastId: Mapped[int] = mapped_column(BigInteger, default=0) # high-water mark, the run resumes after it
+    settledCount: Mapped[int] = mapped_column(default=0)
+    completed: Mapped[bool] = mapped_column(default=False)
+    startedAt: Mapped[datetime] = mapped_column(server_default=func.now())
+    completedAt: Mapped[Optional[datetime]]
+
+    __table_args__ = (UniqueConstraint("valueDate", "stream"),)
@@ -1,13 +1,17 @@
-from fastapi import FastAPI, APIRouter, Depends, status, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, status, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import Field
 from sqlalchemy.orm import Session
 from sqlalchemy import func, case, select, and_, or_, text
-from database import db
+from database import db, ReadSessionMaker
 import model
 import schemas
 from typing import Annotated, Optional, Union, List
 from datetime import datetime, date
 from ..v1 import auth
+from utils.ledger import getAccountBalance, getTrialBalance, getFinancialStatements
+from utils.outbox import enqueueTask
+from utils.export import streamExport, getExportHeaders, export_media_types
 
 account = APIRouter(prefix="/account", tags=["account"])
 
@@ -90,20 +94,124 @@ async def get_account_entries(
   Returns:
     List of ledger entries for the account
   """
-  # Get all entries for this account with journal join
-  query = select(model.JournalEntry).join(model.Journal, model.JournalEntry.journal_id == model.Journal.id).where(model.JournalEntry.account_id == account.id)
+  # entries carry their journal's date, so date filters only touch the matching monthly partitions
+  query = select(model.JournalEntry).where(model.JournalEntry.accountId == account.id)
   
   # Apply date filters if provided
   if start_date:
-    query = query.where(model.Journal.date >= start_date)
+    query = query.where(model.JournalEntry.date >= start_date)
   if end_date:
-    query = query.where(model.Journal.date <= end_date)
+    query = query.where(model.JournalEntry.date <= end_date)
   
   # Apply pagination and ordering by journal date (newest first)
-  entries = db.execute(query.order_by(model.Journal.date.desc()).offset(offset).limit(limit)).scalars().all()
+  entries = db.execute(query.order_by(model.JournalEntry.date.desc()).offset(offset).limit(limit)).scalars().all()
   
   return entries
 
+@account.get('/entries/export')
+async def export_account_entries(
+    account: Annotated[model.Account, Depends(get_account_by_id)],
+    session_factory: ReadSessionMaker,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: schemas.ExportFormat = schemas.ExportFormat.CSV,
+):
+  """
+  Stream every ledger entry of an account as CSV or Parquet, oldest first.
+
+  Rows are read through a server-side cursor and written out chunk by chunk, so a year of a
+  control account's entries is exported in constant memory. Amounts are in minor units.
+  """
+  query = (
+    select(
+      model.JournalEntry.id,
+      model.JournalEntry.journalId,
+      model.JournalEntry.date,
+      model.JournalEntry.side,
+      model.JournalEntry.amount,
+      model.JournalEntry.description,
+    )
+    .where(model.JournalEntry.accountId == account.id)
+  )
+  if start_date:
+    query = query.where(model.JournalEntry.date >= start_date)
+  if end_date:
+    query = query.where(model.JournalEntry.date <= end_date)
+  query = query.order_by(model.JournalEntry.date, model.JournalEntry.id)
+
+  return StreamingResponse(
+    streamExport(session_factory, query, format),
+    media_type=export_media_types[format],
+    headers=getExportHeaders(f"account_{account.code}_entries", format),
+  )
+
+@account.get('/trial_balance')
+async def get_trial_balance(db: db, as_of: Optional[datetime] = None):
+  """
+  Get the trial balance of the whole chart of accounts.
+
+  Args:
+    as_of: Date to calculate balances up to (default: now)
+
+  Returns:
+    Every account with its debit, credit and balance, header accounts rolled up
+    from their children, and the leaf totals
+  """
+  return getTrialBalance(db, as_of)
+
+@account.get('/period')
+async def get_periods(db: db):
+  return db.execute(select(model.AccountingPeriod).order_by(model.AccountingPeriod.start.desc())).scalars().all()
+
+@account.post('/period/close')
+async def close_period(db: db, start: datetime, end: datetime):
+  """
+  Close the accounting period [start, end) in the background.
+
+  Once closed, postings dated inside it are rejected and its statements are served from the snapshot.
+  """
+  if end <= start or end > datetime.now():
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A period must end after it starts and no later than now")
+  enqueueTask(db, "close_period_task", start=start.isoformat(), end=end.isoformat())
+  db.commit()
+  return {"message": "Period close queued", "start": start, "end": end}
+
+@account.get('/period/{period_id}/statements')
+async def get_financial_statements(db: db, period_id: int):
+  """
+  Balance sheet and income statement of a closed period, in minor units, from its frozen balances
+  """
+  period = db.get(model.AccountingPeriod, period_id)
+  if period is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Period not found")
+  if not period.closed:
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Period is not closed")
+  return getFinancialStatements(db, period)
+
+@account.get('/integrity/violations')
+async def get_integrity_violations(
+  db: db,
+  type: Optional[schemas.IntegrityViolationType] = None,
+  limit: Annotated[int, Query(le=1000)] = 100,
+  afterId: int = 0,
+):
+  """
+  Violations found by the ledger integrity checker, oldest first; pass the last id seen as afterId for the next page
+  """
+  query = select(model.IntegrityViolation).where(model.IntegrityViolation.id > afterId)
+  if type is not None:
+    query = query.where(model.IntegrityViolation.type == type)
+  return db.execute(query.order_by(model.IntegrityViolation.id).limit(limit)).scalars().all()
+
+@account.post('/integrity/revalidate')
+async def revalidate_journals(db: db):
+  """
+  Queue a full-history revalidation of every journal, checked in parallel chunks
+  """
+  enqueueTask(db, "revalidate_journals_task")
+  db.commit()
+  return {"message": "Journal revalidation queued"}
+
 @account.put('/{account_id}', response_model=schemas.AccountSchema)
 async def update_account(account_id: int, account_data: schemas.AccountCreate, db: db):
   account = db.get(model.Account, account_id)
@@ -131,7 +239,7 @@ async def delete_account(account_id: int, db: db):
 @account.get('/summary')
 async def get_account_summary(account: Annotated[model.Account, Depends(get_account_by_id)],
     db: db,
-    end_date: Annotated[datetime, Field(le=datetime.now())] = datetime.now()
+    end_date: Optional[datetime] = None
 ):
   
   """
@@ -139,27 +247,19 @@ async def get_account_summary(account: Annotated[model.Account, Depends(get_acco
   
   Args:
     account: The account object (injected via dependency)
-    end_date: Date to calculate balance up to (default: today)
+    end_date: Date to calculate balance up to (default: now)
   
   Returns:
-    Account summary with statistics including total entries, debits, credits, and balance
-  """
-  # Get entry statistics with date filtering
-  total_debit = db.execute(select(func.sum(case((model.Entries.side == schemas.EntrySide.DEBIT, model.Entries.amount), else_=0)).label('total_debits')
-  ).select_from(model.Entries).join(model.Journal, model.Entries.journal_id == model.Journal.id).where(and_(
-    model.Entries.account_id == account.id, 
-    model.Journal.date <= end_date
-  ))).scalar_one_or_none()
-
-  total_credit = db.execute(select(
-    func.sum(case((model.Entries.side == schemas.EntrySide.CREDIT, model.Entries.amount), else_=0)).label('total_credits')
-  ).select_from(model.Entries).join(model.Journal, model.Entries.journal_id == model.Journal.id).where(    and_(
-        model.Entries.account_id == account.id,
-        model.Journal.date <= end_date
-    ))).scalar_one_or_none()
+    Account summary with total debits, credits and balance
+  """
+  # running totals, or the nearest checkpoint plus the entries posted since
+  totals = getAccountBalance(db, account.id, end_date)
+  total_debit = totals["debit"]
+  total_credit = totals["credit"]
 
   return {
     "credit": total_credit,
     "debit": total_debit,
-    "balance": float(total_debit or 0) - float(total_credit or 0) if account.account_type in [schemas.AccountType.ASSET, schemas.AccountType.EXPENSE] else float(total_credit or 0) - float(total_debit or 0),
-  }
\ No newline at end of file
+    "balance": total_debit - total_credit if account.account_type in [schemas.AccountType.ASSET, schemas.AccountType.EXPENSE] else total_credit - total_debit,
+    "as_of": totals["asOf"],
+  }
@@ -4,7 +4,7 @@ from fastapi.security import SecurityScopes
 from sqlalchemy import select, update, delete, func, and_, or_, not_, desc, asc, extract, case
 from sqlalchemy.orm import Session, joinedload, selectinload, with_polymorphic
 from datetime import datetime, timedelta
-from database import db
+from database import AsyncDb, ReadDb
 import model
 import schemas
 from ..v1 import auth
@@ -28,7 +28,7 @@ advisory = APIRouter(
 
 
 @advisory.get("/independence")
-async def getFinancialIndependence(db: db, user: Annotated[model.User, Depends(getUserRiskProfile)]):
+async def getFinancialIndependence(db: ReadDb, user: Annotated[model.User, Depends(getUserRiskProfile)]):
   """
     Check total assets as a proportion of annual income
     investment income is estimated return on assets, subtracted from the total income to get the required investment value to hold.
@@ -56,12 +56,12 @@ async def getFinancialIndependence(db: db, user: Annotated[model.User, Depends(g
     "gap": gap,
     "independence": independence * 100,
   }
-async def recommendIndependence(db: db, user = Depends(getUser)):
+async def recommendIndependence(db: ReadDb, user = Depends(getUser)):
   pass
 
 @advisory.get("/emergency-risk")
 async def getEmergencyRisk(
-    db: db, 
+    db: ReadDb, 
     user: Annotated[model.User, Depends(getUserRiskProfile)]):
   """
     Check total low risk liquid assets as a proportion of 6 months income target amount
@@ -91,7 +91,7 @@ async def recommendEmergencyRisk(user = Depends(getUser)):
   pass
 
 @advisory.get("/liquidity-risk")
-async def getLiquidRisk(db: db, user: Annotated[model.User, Depends(getUserRiskProfile)]):
+async def getLiquidRisk(db: ReadDb, user: Annotated[model.User, Depends(getUserRiskProfile)]):
 
   """
     Check all assets with horizon less than 1 compared to total net worth
@@ -132,7 +132,7 @@ async def getLiquidRisk(db: db, user: Annotated[model.User, Depends(getUserRiskP
 async def recommendLiquidRisk(user = Depends(getUser)):
   pass
 
-async def performance(db: db, user = Depends(getUser)):
+async def performance(db: ReadDb, user = Depends(getUser)):
 
   """
   check portfolio performance relative to other comparable investments
@@ -149,7 +149,7 @@ class RecommendationType(enum.Enum):
 
 
 
-async def getHighestReturnIncomeProduct( db: db,
+async def getHighestReturnIncomeProduct( db: ReadDb,
   portfolio: model.Portfolio = Depends(getPortfolio)):
   """
   Accepts a SQLAlchemy selectable (subquery) for deposit (product) IDs, and returns each product and its latest value and date.
@@ -176,7 +176,7 @@ async def getHighestReturnIncomeProduct( db: db,
   elif frequency == schemas.Frequency.ANNUALLY:
     base_query = base_query.where(or_(model.Deposit.maxTenor.in_([364, 365, 366]), model.Variable.horizon == 1, model.Variable.attributes.has(model.VariableAttributes.distribution == schemas.Frequency.ANNUALLY)))
   
-  products = db.execute(base_query.limit(3)).scalars().all()
+  products = (await db.execute(base_query.limit(3))).scalars().all()
   for product in products:
     recomendation = {
       "product": product,
@@ -238,13 +238,13 @@ def getWeightedReturn(allocation: dict, currency: str, bond_return: float) -> fl
 
 
 @advisory.get("/portfolio/allocation")
-async def getPortfolioAllocation(db: db, portfolio: model.Portfolio = Depends(getPortfolio)):
+async def getPortfolioAllocation(db: ReadDb, portfolio: model.Portfolio = Depends(getPortfolio)):
   pass
 
 
 @advisory.get("/new-portfolio")
 async def getNewPortfolioAllocation(
-  db: db,
+  db: ReadDb,
   portfolio: model.Portfolio = Depends(getPortfolio), 
   ):
 
@@ -286,18 +286,18 @@ async def getNewPortfolioAllocation(
 
           if days_diff <= 365:
             # get highest return deposit or mutual fund return
-            products = db.execute(base_query.where(base_model.horizon <= 1).limit(3)).scalars().all()
+            products = (await db.execute(base_query.where(base_model.horizon <= 1).limit(3))).scalars().all()
 
           elif days_diff > 365 and days_diff <= 1095:
             # get highest return variable product
-            products = db.execute(base_query.where(base_model.horizon > 1, base_model.horizon <= 3).limit(3)).scalars().all()
+            products = (await db.execute(base_query.where(base_model.horizon > 1, base_model.horizon <= 3).limit(3))).scalars().all()
 
           elif days_diff > 1095 and days_diff <= 2190:
 
-            products = db.execute(base_query.where(base_model.horizon > 3, base_model.horizon <= 5).limit(3)).scalars().all()
+            products = (await db.execute(base_query.where(base_model.horizon > 3, base_model.horizon <= 5).limit(3))).scalars().all()
 
           else:
-            products = db.execute(base_query.where(base_model.horizon > 5).limit(3)).scalars().all()
+            products = (await db.execute(base_query.where(base_model.horizon > 5).limit(3))).scalars().all()
 
         # pv of target amount
         pv = npf.pv(0.08 if portfolio.target.currency == schemas.Currency.USD else 0.2, days_diff / 365, 0, -portfolio.target.amount)
@@ -310,7 +310,7 @@ async def getNewPortfolioAllocation(
         return {"recomendation": result, "growthDuration": growth_duration}
 
       else: 
-        products = db.execute(base_query.where(base_model.horizon == portfolio.duration).limit(3)).scalars().all()
+        products = (await db.execute(base_query.where(base_model.horizon == portfolio.duration).limit(3))).scalars().all()
         for product in products:
           result.append({
             "product": product,
@@ -320,15 +320,15 @@ async def getNewPortfolioAllocation(
         
 
 @advisory.post("/wealth-objective")
-async def createWealthObjective(db: db, objective: schemas.WealthObjectiveCreate):
+async def createWealthObjective(db: AsyncDb, objective: schemas.WealthObjectiveCreate):
   wealthObjective = model.WealthObjective(**objective.model_dump())
   db.add(wealthObjective)
-  db.commit()
-  db.refresh(wealthObjective)
+  await db.commit()
+  await db.refresh(wealthObjective)
   return wealthObjective
 
 
-async def getIndependenceRequiredInvestment(db: db, user: model.User):
+async def getIndependenceRequiredInvestment(db: ReadDb, user: model.User):
 
   age = relativedelta(datetime.now(), user.dateOfBirth).years
   years_to_retirement = 60 - age
@@ -362,13 +362,13 @@ async def getIndependenceRequiredInvestment(db: db, user: model.User):
   }
 
 @advisory.get("/portfolio-recommendation", )
-async def getPortfolioRecommendation(db: db, user: Annotated[model.User, Depends(getUserRiskProfile)]):
+async def getPortfolioRecommendation(db: ReadDb, user: Annotated[model.User, Depends(getUserRiskProfile)]):
 
   user_portfolios = user.portfolios
   portfolio_ids = [portfolio.wealthObjectiveId for portfolio in user_portfolios if portfolio.wealthObjectiveId is not None]
 
   recommended = select(model.WealthObjective).where(model.WealthObjective.id.not_in(portfolio_ids))
-  recommended = db.execute(recommended).scalars().all()
+  recommended = (await db.execute(recommended)).scalars().all()
 
   result = []
   required_investment = await getIndependenceRequiredInvestment(db, user)
@@ -6,7 +6,7 @@ from model import User
 from passlib.context import CryptContext
 import jwt
 from datetime import datetime, timedelta, timezone
-from database import db
+from database import db, AsyncDb
 from jwt import InvalidTokenError
 from random import randint
 from random import randrange
@@ -18,6 +18,7 @@ import model
 from celery_app import sendOtpTask
 from config import settings
 from utils.brevo import sendOtpEmail
+from utils.principal import getPrincipal
 # models    
 
 auth = APIRouter(prefix="/auth", tags=["auth"])
@@ -179,19 +180,19 @@ async def signupotp(userData: schemas.SignupCreate, db: db):
     
     return await sendOtp(data=data, type=schemas.OtpType.SIGNUP)
 
-async def getActiveUser(db: db, payload = Security(verifyAccessToken)):
+async def getActiveUser(db: AsyncDb, payload = Security(verifyAccessToken)):
 
-    user = db.execute(select(User).where(User.email == payload.get('username'))).scalar_one_or_none()
+    user = await getPrincipal(db, payload.get('username'))
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User does not exist")
     return user
 
-async def checkWithdrawPermission(db: db, user: Annotated[User, Depends(getActiveUser)]):
+async def checkWithdrawPermission(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(getActiveUser)]):
     if user.tier < 2:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User does not have withdrawal permission")
     return user
 
-async def checkAdvisoryPermission(db: db, user: Annotated[User, Depends(getActiveUser)]):
+async def checkAdvisoryPermission(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(getActiveUser)]):
     if user.tier < 3:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User does not have advisory permission")
     return user
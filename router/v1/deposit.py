@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Query
+from fastapi import APIRouter, Depends, Security, status, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func, case
 from database import db
@@ -6,6 +6,8 @@ from model import Deposit, PortfolioDeposit, Product, PortfolioTransaction, Depo
 from typing import Annotated, Union, Optional, List
 from datetime import datetime
 from ..v1 import auth
+from ..v1.portfolio import getPortfolio
+from utils.deposit import quoteDepositLiquidations, getOpenDepositIds
 
 
 
@@ -14,7 +16,6 @@ deposit = APIRouter(
     tags=["Deposit"]
 )
 
-@deposit.get("/{deposit_id}")
 async def getDeposit(
         deposit_id: int,
         db: db
@@ -27,51 +28,91 @@ async def getDeposit(
      
     return deposit
 
+# the fixed paths are registered before /{deposit_id} so they are not captured as an id
+@deposit.get("/quote")
+async def quoteDeposits(
+    db: db,
+    deposit_ids: List[int] = Query(default=[]),
+    portfolio = Security(getPortfolio, scopes=["readUser"]),
+):
+    """
+    Early liquidation quotes for the given deposits of the portfolio, or every open deposit in it
+    """
+    open_ids = getOpenDepositIds(db, portfolio.id)
+    if set(deposit_ids) - set(open_ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deposit not found")
+    deposit_ids = deposit_ids or open_ids
+    if not deposit_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No deposits to quote")
+    return quoteDepositLiquidations(db, deposit_ids)
+
 @deposit.get("/deposit_value")
 async def getDepositValue(
-    deposit = Depends(getDeposit),
+    db: db,
+    deposit: PortfolioDeposit = Depends(getDeposit),
 ):
-    
-    value = deposit.amount * (1 + (deposit.rate/ 365 * 0.9 * (datetime.now() - deposit.start_date)))
+    quotes = quoteDepositLiquidations(db, [deposit.id])
+    if not quotes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Deposit is closed")
 
-    return value
+    # principal and interest accrued to date, net of withholding tax
+    return quotes[0]["principal"] + quotes[0]["netInterest"]
 
 @deposit.get("/liquidation_value")
 async def getLiquidationValue(
     db: db,
     deposit: PortfolioDeposit = Depends(getDeposit)
 ):
-    days_passed = (datetime.now() - deposit.start_date).days
-    days_left = deposit.tenor - days_passed
-
-    if days_left >= 0:
-        product = db.get(Deposit, deposit.transaction.product_id)
-        penalty = product.penalty if product.penalty else 0     
-    else:
+    if deposit.maturityDate < datetime.now():
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
+            status_code=status.HTTP_400_BAD_REQUEST, 
             detail=f"Deposit has matured")
-    
-    penalty_charge = (1 - penalty)
-    total_interest_earned = deposit.amount * (deposit.rate/ 365 * days_passed)
-    tax = float(total_interest_earned) * 0.1
-    net_interest = float(total_interest_earned) - tax
-    penalty_amount = net_interest * penalty
-    liquidation_value = float(deposit.amount) + float(total_interest_earned) - tax - penalty_charge
+
+    # closed deposits are not quoted
+    quotes = quoteDepositLiquidations(db, [deposit.id])
+    if not quotes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Deposit is closed")
+    quote = quotes[0]
 
     obj = {
-        "principal": deposit.amount,
-        "current": deposit.amount + total_interest_earned,
-        "net_value": liquidation_value
+        "principal": quote["principal"],
+        "current": quote["principal"] + quote["accruedInterest"],
+        "net_value": quote["liquidationValue"]
     }
 
-    if total_interest_earned > 0:
+    if quote["accruedInterest"] > 0:
+
+        obj["tax"] = quote["withholdingTax"]
+        obj["total_interest"] = quote["accruedInterest"]
+        obj["net_interest"] = quote["netInterest"]
+
+    if quote["penalty"] > 0:
+        obj["penalty"] = quote["penalty"]
 
-        obj["tax"] = tax
-        obj["total_interest"] = total_interest_earned
-        obj["net_interest"] = net_interest
+    return obj
 
-    if penalty_amount > 0:
-        obj["penalty"] = penalty_amount
+deposit.get("/{deposit_id}")(getDeposit)
 
-    return obj
\ No newline at end of file
+@deposit.patch("/{deposit_id}/rollover")
+async def setDepositRollover(
+    db: db,
+    rollover: bool,
+    deposit: PortfolioDeposit = Depends(getDeposit),
+):
+    if deposit.closed or deposit.matured:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Deposit is closed")
+    deposit.rollover = rollover
+    db.add(deposit)
+    db.commit()
+    db.refresh(deposit)
+    return deposit
@@ -3,12 +3,15 @@ from sqlalchemy import select, func, case
 from database import db
 import model
 import schemas
+from typing import Optional
+from datetime import datetime
 from ..v1 import auth
+from utils.ledger import postJournals
 
 
 journal = APIRouter(
-    prefix="/deposit",
-    tags=["Deposit"]
+    prefix="/journal",
+    tags=["Journal"]
 )
 
 @journal.get("/{journal_id}")
@@ -17,7 +20,7 @@ async def getJournal(
         db: db
 ):  
   
-  journal = db.get(model.UserDeposit, journal_id)
+  journal = db.get(model.Journal, journal_id)
   if not journal:
     raise HTTPException(
       status_code=status.HTTP_404_NOT_FOUND,
@@ -28,23 +31,20 @@ async def getJournal(
 
 async def prepareJournal(
   credit: list[schemas.JournalEntries],
-  debit: list[schemas.JournalEntries]):
+  debit: list[schemas.JournalEntries],
+  date: Optional[datetime] = None):
 
-  journal = model.Journal()
-  
-  # Extract Pydantic model data and sum amounts
+  # amounts are in minor units; balance is checked again by the posting service
   credit_amount = sum(entry.amount for entry in credit)
   debit_amount = sum(entry.amount for entry in debit)
 
   if credit_amount != debit_amount:
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Credit and debit amounts do not match")
-  
-  credit_entries = [model.Entries(amount=entry.amount, side=schemas.EntrySide.CREDIT, account_id=entry.account_id) for entry in credit]
-  debit_entries = [model.Entries(amount=entry.amount, side=schemas.EntrySide.DEBIT, account_id=entry.account_id) for entry in debit]
 
-  journal.entries = credit_entries + debit_entries
+  credit_entries = [{"accountId": entry.account_id, "amount": entry.amount, "side": schemas.EntrySide.CREDIT, "description": entry.description} for entry in credit]
+  debit_entries = [{"accountId": entry.account_id, "amount": entry.amount, "side": schemas.EntrySide.DEBIT, "description": entry.description} for entry in debit]
 
-  return journal
+  return {"date": date or datetime.now(), "entries": credit_entries + debit_entries}
 
 @journal.post("/")
 async def postJournal(
@@ -52,10 +52,27 @@ async def postJournal(
   journal = Depends(prepareJournal)
 ):
   
-  db.add(journal)
+  try:
+    journal_id = postJournals(db, [journal])[0]
+  except Exception as e:
+    db.rollback()
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
   db.commit()
-  db.refresh(journal)
-  return journal
-
-
+  return db.get(model.Journal, journal_id)
 
+@journal.post("/batch")
+async def postJournalBatch(
+  db: db,
+  journals: list[schemas.JournalCreate],
+):
+  """
+  Post many journals in one database transaction; all are rejected if any is unbalanced
+  """
+  prepared = [await prepareJournal(credit=journal.credit, debit=journal.debit, date=journal.date) for journal in journals]
+  try:
+    journal_ids = postJournals(db, prepared)
+  except Exception as e:
+    db.rollback()
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+  db.commit()
+  return {"journals": journal_ids}
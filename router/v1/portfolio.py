@@ -4,8 +4,9 @@ from math import prod
 from celery import current_app
 from fastapi import FastAPI, APIRouter, Security, Depends, HTTPException, status, Query, Path, Body
 from fastapi.security import SecurityScopes
+from fastapi.responses import StreamingResponse
 import requests
-from database import db
+from database import AsyncDb, ReadDb, ReadSessionMaker
 from sqlalchemy import select, update, delete, func, and_, or_, not_, desc, asc, extract, case
 from sqlalchemy.sql import over
 from sqlalchemy.orm import Session, aliased, joinedload, selectinload, with_polymorphic
@@ -14,8 +15,11 @@ from typing import Any, Optional, List, Union, Annotated
 from datetime import datetime, timedelta
 import model
 from router.v1.product import getPrice, getProduct
-from utils.payment_schedule import generate_schedule_dates
-from ..v1.user import getUser
+from utils.payment_schedule import generate_schedule_dates, next_schedule_date
+from utils.deposit import getDepositBalances
+from utils.contribution import getNextContributionDate
+from utils.export import streamExport, getExportHeaders, export_media_types
+from ..v1.user import getUser, getPortfoliosByUser
 import schemas
 from decimal import Decimal
 import enum
@@ -31,10 +35,10 @@ portfolio = APIRouter(
 @portfolio.get("")
 async def getPortfolio(
     portfolioId: int, 
-    db: db, 
-    user: Annotated[model.User, Security(getUser, scopes=["readUser"])]):
+    db: AsyncDb, 
+    user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["readUser"])]):
 
-    portfolio = db.execute(select(model.Portfolio).where(model.Portfolio.userId == user.id, model.Portfolio.id == portfolioId)).scalar_one_or_none()
+    portfolio = (await db.execute(select(model.Portfolio).where(model.Portfolio.userId == user.id, model.Portfolio.id == portfolioId))).scalar_one_or_none()
 
     if not portfolio:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Portfolio not found")
@@ -42,13 +46,36 @@ async def getPortfolio(
     return portfolio
 
 @portfolio.get("/all")
-async def getAllPortfolios(db: db, user: Annotated[model.User, Security(getUser, scopes=["readUser"])]):
+async def getAllPortfolios(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["readUser"])]):
 
-    return user.portfolios
+    return await getPortfoliosByUser(db, user.id)
+
+async def getCommitmentPlan(db: AsyncDb, commitment: schemas.CommitmentCreate) -> dict:
+    """
+    Check a commitment's product and tenor and return the contribution plan's columns, amount in minor units.
+    The plan starts now unless a start date is given; it first contributes on the first scheduled date after now.
+    """
+    product = (await db.execute(select(model.Product).where(model.Product.id == commitment.productId, model.Product.isActive == True))).scalar_one_or_none()
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    if product.currency != commitment.currency:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{product.title} is priced in {product.currency.value}")
+    if product.category == "deposit":
+        deposit = (await db.execute(select(model.Deposit).where(model.Deposit.id == product.id))).scalar_one()
+        if commitment.tenor is None or not deposit.minTenor <= commitment.tenor <= deposit.maxTenor:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"tenor must be between {deposit.minTenor} and {deposit.maxTenor} days for {product.title}")
+    start = commitment.startDate if "startDate" in commitment.model_fields_set and commitment.startDate is not None else datetime.now()
+    return {
+        **commitment.model_dump(exclude={"startDate"}),
+        "amount": int(commitment.amount * 100),
+        "tenor": commitment.tenor if product.category == "deposit" else None,
+        "startDate": start,
+        "nextContributionDate": getNextContributionDate(start, commitment.frequency, datetime.now()),
+    }
 
 @portfolio.post("", status_code=status.HTTP_201_CREATED)
 async def createPortfolio(
-   db: db,
+   db: AsyncDb,
    type: schemas.PortfolioType,
    user = Security(getUser, scopes=["createUser"]),
    attributes: schemas.PortfolioCreate = Body()
@@ -81,71 +108,88 @@ async def createPortfolio(
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{type.value} cannot have an income a")
         income = model.PortfolioIncome(**attributes.income.model_dump())
         income.startDate = datetime.now()
-
-        nextdate_map = {
-            schemas.Frequency.MONTHLY: timedelta(days=30),
-            schemas.Frequency.BIMONTHLY: timedelta(days=60),
-            schemas.Frequency.QUARTERLY: timedelta(days=90),
-            schemas.Frequency.SEMIANNUALLY: timedelta(days=180),
-            schemas.Frequency.ANNUALLY: timedelta(days=365),
-        }
-
-        income.nextIncomeDate = income.startDate + nextdate_map[attributes.income.frequency]
+        income.nextIncomeDate = next_schedule_date(income.startDate, attributes.income.frequency.value)
         portfolio.income = income
+
+    if attributes.commitment is not None:
+        portfolio.contributionPlan = model.PortfolioContributionPlan(**await getCommitmentPlan(db, attributes.commitment))
     
     # Define portfolio strategic asset allocation
 
-    db.commit()
-    db.refresh(portfolio)
+    await db.commit()
+    await db.refresh(portfolio)
     return portfolio
 
 @portfolio.get("/transactions")
 async def getPortfolioTransactions(
-    db: db,
+    db: AsyncDb,
     portfolio: Annotated[model.Portfolio, Depends(getPortfolio)],
     status: Annotated[Optional[schemas.TransactionStatus], Query()] = schemas.TransactionStatus.COMPLETED):
 
-    transactions = portfolio.transactions
+    transactions = await portfolio.awaitable_attrs.transactions
     if status:
         transactions = [transaction for transaction in transactions if transaction.status == status]
     return transactions
 
+@portfolio.get("/ledger/export")
+async def exportPortfolioLedger(
+    portfolio: Annotated[model.Portfolio, Depends(getPortfolio)],
+    session_factory: ReadSessionMaker,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: schemas.ExportFormat = schemas.ExportFormat.CSV):
+    """
+    Stream a portfolio's ledger as CSV or Parquet, oldest first, with the variable and deposit details of each line.
+    Amounts and prices are in minor units.
+    """
+    ledger = model.PortfolioLedger.__table__
+    variable = model.VariableLedger.__table__
+    deposit = model.DepositLedger.__table__
+    query = (
+        select(
+            ledger.c.id,
+            ledger.c.date,
+            ledger.c.type,
+            ledger.c.account,
+            ledger.c.side,
+            ledger.c.amount,
+            ledger.c.transactionId,
+            variable.c.variableId,
+            variable.c.units,
+            variable.c.price,
+            deposit.c.portfolioDepositId,
+        )
+        .select_from(ledger.outerjoin(variable, variable.c.id == ledger.c.id).outerjoin(deposit, deposit.c.id == ledger.c.id))
+        .where(ledger.c.portfolioId == portfolio.id)
+    )
+    if start:
+        query = query.where(ledger.c.date >= start)
+    if end:
+        query = query.where(ledger.c.date < end)
+    query = query.order_by(ledger.c.date, ledger.c.id)
+
+    return StreamingResponse(
+        streamExport(session_factory, query, format),
+        media_type=export_media_types[format],
+        headers=getExportHeaders(f"portfolio_{portfolio.id}_ledger", format),
+    )
+
 @portfolio.get("/deposit-value")
-async def getNGDepositValue(depositId: int, db: db):
-    deposit = db.get(model.PortfolioDeposit, depositId)
+async def getNGDepositValue(depositId: int, db: ReadDb):
+    deposit = await db.get(model.PortfolioDeposit, depositId)
     if not deposit:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deposit not found")
     
-    deposit_value = db.execute(select(
-        func.sum(case(
-            ((model.DepositLedger.account == schemas.PortfolioAccount.ASSET and model.DepositLedger.side == schemas.UserLedgerSide.IN),
-            model.DepositLedger.amount),
-            ((model.DepositLedger.account == schemas.PortfolioAccount.ASSET and model.DepositLedger.side == schemas.UserLedgerSide.OUT),
-            -model.DepositLedger.amount),
-        )).label("principal"),
-        func.sum(case(
-            ((model.DepositLedger.account == schemas.PortfolioAccount.INTEREST and model.DepositLedger.side == schemas.UserLedgerSide.IN),
-            model.DepositLedger.amount),
-            ((model.DepositLedger.account == schemas.PortfolioAccount.INTEREST and model.DepositLedger.side == schemas.UserLedgerSide.OUT),
-            -model.DepositLedger.amount),
-        )).label("accrued_interest"),
-        func.sum(case(
-            ((model.DepositLedger.account == schemas.PortfolioAccount.TAX and model.DepositLedger.side == schemas.UserLedgerSide.IN),
-            -model.DepositLedger.amount),
-            ((model.DepositLedger.account == schemas.PortfolioAccount.TAX and model.DepositLedger.side == schemas.UserLedgerSide.OUT),
-            model.DepositLedger.amount)
-        )).label("withholding_tax"),
-    ).where(model.DepositLedger.portfolioDepositId == deposit.id)).mappings().all()
-
-    principal = (deposit_value[0].principal if deposit_value[0].principal else 0)
-    accrued_interest = (deposit_value[0].accrued_interest if deposit_value[0].accrued_interest else 0)
-    withholding_tax = (deposit_value[0].withholding_tax if deposit_value[0].withholding_tax else 0)
+    balances = (await db.run_sync(getDepositBalances, [deposit.id])).get(deposit.id, {})
+    principal = balances.get("principal", 0)
+    accrued_interest = balances.get("accrued_interest", 0)
+    withholding_tax = balances.get("withholding_tax", 0)
     current_value = float(principal) + float(accrued_interest) - float(withholding_tax)
 
     return {"deposit": deposit, "current_value": current_value, "principal": principal, "accrued_interest": accrued_interest, "withholding_tax": withholding_tax}
 
 @portfolio.get("/assets")
-async def getPortfolioAssets(db: db, portfolio: model.Portfolio = Depends(getPortfolio)):
+async def getPortfolioAssets(db: ReadDb, portfolio: model.Portfolio = Depends(getPortfolio)):
 
     
     transactions = select(model.PortfolioTransaction.id).where(model.PortfolioTransaction.portfolioId == portfolio.id, model.PortfolioTransaction.status == schemas.TransactionStatus.COMPLETED)
@@ -168,7 +212,7 @@ async def getPortfolioAssets(db: db, portfolio: model.Portfolio = Depends(getPor
 
     product = select(model.Product).options(joinedload(model.Variable.values)).subquery()
 
-    variable_assets = db.execute(
+    variable_assets = (await db.execute(
         select(
             product,
             net_units_expr.label("netUnits"),
@@ -177,7 +221,7 @@ async def getPortfolioAssets(db: db, portfolio: model.Portfolio = Depends(getPor
         .select_from(product).join(ledgers, ledgers.c.variableId == product.c.id)
         .group_by(product.c.id, product.c.issuerId, product.c.title, product.c.description, product.c.currency, product.c.assetClass, product.c.productClass, product.c.category, product.c.benchmarkId, product.c.isActive, product.c.created, product.c.lastModified, product.c.productGroupId, product.c.riskLevel, product.c.horizon, product.c.img, ledgers.c.price)
         .having(net_amount_expr > 0)
-    ).mappings().all()
+    )).mappings().all()
 
     assets = []
 
@@ -193,8 +237,8 @@ async def getPortfolioAssets(db: db, portfolio: model.Portfolio = Depends(getPor
         assets.append(asset_data)
 
 
-    deposits = select(model.PortfolioDeposit, model.DepositTransaction).select_from(model.PortfolioDeposit).join(model.DepositTransaction, model.PortfolioDeposit.transactionId == model.DepositTransaction.id).where(model.DepositTransaction.portfolioId == portfolio.id, model.DepositTransaction.status == schemas.TransactionStatus.COMPLETED, model.PortfolioDeposit.closed == False, model.PortfolioDeposit.matured == False, model.PortfolioDeposit.maturityDate >= datetime.now()).subquery()
-    deposit_products = db.execute(select(model.Product.id, model.Product.currency, model.Product.title, model.Product.category, deposits.c.id.label("depositId"), deposits.c.effectiveDate, deposits.c.maturityDate, deposits.c.amount).select_from(deposits).join(model.Product, deposits.c.productId == model.Product.id)).mappings().all()
+    deposits = select(model.PortfolioDeposit, model.DepositTransaction).select_from(model.PortfolioDeposit).join(model.DepositTransaction, model.PortfolioDeposit.transactionId == model.DepositTransaction.id).where(model.DepositTransaction.portfolioId == portfolio.id, model.DepositTransaction.status == schemas.TransactionStatus.COMPLETED, model.PortfolioDeposit.closed == False, model.PortfolioDeposit.matured == False).subquery()
+    deposit_products = (await db.execute(select(model.Product.id, model.Product.currency, model.Product.title, model.Product.category, deposits.c.id.label("depositId"), deposits.c.effectiveDate, deposits.c.maturityDate, deposits.c.amount).select_from(deposits).join(model.Product, deposits.c.productId == model.Product.id))).mappings().all()
     # return db.execute(deposit_products).mappings().all()
 
     for deposit in deposit_products:
@@ -211,7 +255,7 @@ async def getPortfolioAssets(db: db, portfolio: model.Portfolio = Depends(getPor
     return assets
 
 @portfolio.get("/value")
-async def getPortfolioValue(db: db, assets = Depends(getPortfolioAssets)):
+async def getPortfolioValue(db: ReadDb, assets = Depends(getPortfolioAssets)):
 
     usd_base_value = 0
     ngn_base_value = 0
@@ -240,11 +284,11 @@ async def getPortfolioValue(db: db, assets = Depends(getPortfolioAssets)):
     }
 
 async def getPortfolioDeposits(
-    db: db, 
+    db: AsyncDb, 
     portfolio = Depends(getPortfolio)):
 
     # Active deposits
-    user_deposits = db.execute(
+    user_deposits = (await db.execute(
         select(
             model.UserDeposit.amount,
             model.UserDeposit.start_date,
@@ -262,7 +306,7 @@ async def getPortfolioDeposits(
             model.UserDeposit.closed == False,
             model.UserDeposit.maturity_date >= datetime.now()
         )
-    ).mappings().all()
+    )).mappings().all()
 
     deposit_list = map(lambda x: {
         "Product": x.Product,
@@ -276,13 +320,13 @@ async def getPortfolioDeposits(
     
 @portfolio.get("/product-fit")  
 async def checkProductFit(
-    db: db,
+    db: AsyncDb,
     products: List[int], 
     portfolio = Depends(getPortfolio)):
     """API endpoint to check if a product fits a portfolio's risk profile"""
     """Internal function to check if a product fits a portfolio's risk profile"""
     
-    product = db.execute(select(model.Product).where(model.Product.id.in_(products))).scalars().all()
+    product = (await db.execute(select(model.Product).where(model.Product.id.in_(products)))).scalars().all()
 
     found_product_ids = {product.id for product in product}
 
@@ -306,7 +350,7 @@ async def checkProductFit(
         return {"fit": True}
 
 @portfolio.post("/objectives", status_code=status.HTTP_201_CREATED)
-async def addPortfolioObjectives(db: db, objectives: schemas.PortfolioObjectiveCreate, portfolio: model.Portfolio = Depends(getPortfolio)):
+async def addPortfolioObjectives(db: AsyncDb, objectives: schemas.PortfolioObjectiveCreate, portfolio: model.Portfolio = Depends(getPortfolio)):
 
     updated_attributes = {}
 
@@ -322,53 +366,68 @@ async def addPortfolioObjectives(db: db, objectives: schemas.PortfolioObjectiveC
         income = model.PortfolioIncome(**objectives.income.model_dump())
         income.startDate = datetime.now()
 
-        income.nextIncomeDate = income.startDate + schemas.nextdate_map[objectives.income.frequency]
+        income.nextIncomeDate = next_schedule_date(income.startDate, objectives.income.frequency.value)
         portfolio.income = income
         updated_attributes["income"] = {"amount": income.amount, "currency": income.currency, "frequency": income.frequency, "startDate": income.startDate, "nextIncomeDate": income.nextIncomeDate}
+    if objectives.commitment:
+        if await portfolio.awaitable_attrs.contributionPlan is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Contribution plan already exists")
+        plan = model.PortfolioContributionPlan(**await getCommitmentPlan(db, objectives.commitment))
+        portfolio.contributionPlan = plan
+        updated_attributes["commitment"] = {"amount": plan.amount, "currency": plan.currency, "frequency": plan.frequency, "productId": plan.productId, "tenor": plan.tenor, "startDate": plan.startDate, "nextContributionDate": plan.nextContributionDate}
     
     db.add(portfolio)
-    db.commit()
-    db.refresh(portfolio)
+    await db.commit()
+    await db.refresh(portfolio)
     return {"message": "Objectives created successfully", "objectives": updated_attributes}
 
 @portfolio.patch("/objectives", status_code=status.HTTP_200_OK)
-async def updatePortfolioObjectives(db: db, objectives: schemas.PortfolioObjectiveCreate, portfolio: model.Portfolio = Depends(getPortfolio)):
+async def updatePortfolioObjectives(db: AsyncDb, objectives: schemas.PortfolioObjectiveCreate, portfolio: model.Portfolio = Depends(getPortfolio)):
     updated_attributes = {}
     
     if objectives.target:
         if portfolio.target is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Target not found")
-        target = db.execute(update(model.PortfolioTarget).values(**objectives.target.model_dump()).where(model.PortfolioTarget.id == portfolio.target.id).returning(model.PortfolioTarget)).scalar_one_or_none()
+        target = (await db.execute(update(model.PortfolioTarget).values(**objectives.target.model_dump()).where(model.PortfolioTarget.id == portfolio.target.id).returning(model.PortfolioTarget))).scalar_one_or_none()
         updated_attributes["target"] = {"amount": target.amount, "currency": target.currency, "targetDate": target.targetDate}
     if objectives.income:
         if portfolio.income is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Income not found")
-        income = db.execute(update(model.PortfolioIncome).values(**objectives.income.model_dump()).where(model.PortfolioIncome.id == portfolio.income.id).returning(model.PortfolioIncome)).scalar_one_or_none()
+        income = (await db.execute(update(model.PortfolioIncome).values(**objectives.income.model_dump()).where(model.PortfolioIncome.id == portfolio.income.id).returning(model.PortfolioIncome))).scalar_one_or_none()
         updated_attributes["income"] = {"amount": income.amount, "currency": income.currency, "frequency": income.frequency, "startDate": income.startDate, "nextIncomeDate": income.nextIncomeDate}
+    if objectives.commitment:
+        if await portfolio.awaitable_attrs.contributionPlan is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Contribution plan not found")
+        values = await getCommitmentPlan(db, objectives.commitment)
+        # the schedule only moves when a new start date is given
+        if "startDate" not in objectives.commitment.model_fields_set:
+            del values["startDate"], values["nextContributionDate"]
+        plan = (await db.execute(update(model.PortfolioContributionPlan).values(**values).where(model.PortfolioContributionPlan.id == portfolio.contributionPlan.id).returning(model.PortfolioContributionPlan))).scalar_one_or_none()
+        updated_attributes["commitment"] = {"amount": plan.amount, "currency": plan.currency, "frequency": plan.frequency, "productId": plan.productId, "tenor": plan.tenor, "startDate": plan.startDate, "nextContributionDate": plan.nextContributionDate}
     
-    db.commit()
-    db.refresh(portfolio)
+    await db.commit()
+    await db.refresh(portfolio)
     return {"message": "Objectives updated successfully", "updated": updated_attributes}
 
 @portfolio.delete("/attributes")
-async def deleteAttributes(db: db, target: bool = Query(False), commitment: bool = Query(False), portfolio: model.Portfolio = Depends(getPortfolio)):
+async def deleteAttributes(db: AsyncDb, target: bool = Query(False), commitment: bool = Query(False), portfolio: model.Portfolio = Depends(getPortfolio)):
   if portfolio.target is None:
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Target not found")
-  if portfolio.contributionPlan is None:
+  if await portfolio.awaitable_attrs.contributionPlan is None:
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Contribution plan not found")
 
   if target:
-    db.delete(portfolio.target)
+    await db.delete(portfolio.target)
   if commitment:
-    db.delete(portfolio.contributionPlan)
+    await db.delete(portfolio.contributionPlan)
 
   db.add(portfolio)
-  db.commit()
-  db.refresh(portfolio)
+  await db.commit()
+  await db.refresh(portfolio)
   return portfolio
 
 @portfolio.get("/advice")
-async def getPortfolioAdvice(db: db, portfolio: model.Portfolio = Depends(getPortfolio)):
+async def getPortfolioAdvice(db: ReadDb, portfolio: model.Portfolio = Depends(getPortfolio)):
     """
        - target to commitment: check that the value of periodic contributions can achieve the target
        - target to allocation: check that the allocation of the portfolio can achieve the target
@@ -379,7 +438,7 @@ async def getPortfolioAdvice(db: db, portfolio: model.Portfolio = Depends(getPor
     if portfolio.type == schemas.PortfolioType.EMERGENCY:
         # get portfolio value and compare to target
 
-        deposit_product = db.execute(select(model.Deposit).where(model.Deposit.currency == portfolio.target.currency, model.Deposit.maxTenor <= 180, model.Deposit.minTenor >= 0).order_by(model.Deposit.rate.desc()).limit(1)).scalar_one_or_none()
+        deposit_product = (await db.execute(select(model.Deposit).where(model.Deposit.currency == portfolio.target.currency, model.Deposit.maxTenor <= 180, model.Deposit.minTenor >= 0).order_by(model.Deposit.rate.desc()).limit(1))).scalar_one_or_none()
         
         # mutual_fund_product = find the mutual fund with the highest expected return / yield
         # 
@@ -424,11 +483,11 @@ async def getPortfolioAdvice(db: db, portfolio: model.Portfolio = Depends(getPor
 # def generate_schedule_dates(start_date: datetime, frequency: schemas.Frequency, duration: int)
 
 @portfolio.get("/transaction/all")
-async def getAllPortfolioTransactions(db: db, user: model.User = Depends(auth.getActiveUser)):
-    portfolios = user.portfolios
+async def getAllPortfolioTransactions(db: AsyncDb, user: schemas.UserPrincipal = Depends(auth.getActiveUser)):
+    portfolios = await getPortfoliosByUser(db, user.id)
     all_transactions = []
     for portfolio in portfolios:
-        transactions = filter(lambda x: x.status == schemas.TransactionStatus.COMPLETED, portfolio.transactions)
+        transactions = filter(lambda x: x.status == schemas.TransactionStatus.COMPLETED, await portfolio.awaitable_attrs.transactions)
         all_transactions.extend(list(transactions)) 
 
     all_transactions = sorted(all_transactions, key=lambda x: x.date, reverse=True)
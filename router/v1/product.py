@@ -1,7 +1,7 @@
 from operator import and_
 from click import utils
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, status, Query, Path, Body
-from database import db
+from database import AsyncDb, ReadDb
 from sqlalchemy import select, update, delete, func, or_
 from sqlalchemy.orm import Session, joinedload, selectinload, with_polymorphic
 from typing import Optional, Annotated, Union, List
@@ -35,7 +35,7 @@ product = APIRouter(
 
 @product.get('/search', dependencies=[Depends(readUser)])
 async def searchProducts(
-  db: db,
+  db: ReadDb,
   keyword: str = Query(..., min_length=1, description="Search keyword"),
   page: int = Query(default=1, ge=1),
   type: Optional[str] = Query(enum=["variable", "deposit"], default=None),
@@ -60,7 +60,7 @@ async def searchProducts(
     )
   )
 
-  result = db.execute(base_query.offset((page - 1) * 10)).scalars().all()
+  result = (await db.execute(base_query.offset((page - 1) * 10))).scalars().all()
   # extract all product classes and asset classes from the result
   product_classes = list(set(map(lambda x: {"value": x.productClass, "label": x.productClass.value}, result)))
   asset_classes = list(set(map(lambda x: {"value": x.assetClass, "label": x.assetClass.value}, result)))
@@ -73,7 +73,7 @@ async def searchProducts(
 
 @product.get('/', dependencies=[Depends(readUser)])
 async def getProduct(
-  db: db,
+  db: ReadDb,
   productId: Optional[int] = Query(default=None, description="Product ID"),
   productClass: Optional[schemas.ProductClass] = Query(default=None),
   page: Optional[int] = Query(default=1, ge=1),
@@ -98,7 +98,7 @@ async def getProduct(
 
   parent_class = with_polymorphic(model.Product, [model.Variable, model.Deposit])
   if productId:
-    product = db.execute(select(parent_class).where(parent_class.id == productId)).scalar_one_or_none()
+    product = (await db.execute(select(parent_class).where(parent_class.id == productId))).scalar_one_or_none()
     if not product:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
@@ -159,10 +159,10 @@ async def getProduct(
     if maxTenor:
       base_query = base_query.where(model.Deposit.maxTenor <= maxTenor)
 
-    return db.execute(base_query.offset((page - 1) * 10)).scalars().all()
+    return (await db.execute(base_query.offset((page - 1) * 10))).scalars().all()
 
 @product.post("/issuer", status_code=status.HTTP_201_CREATED)
-async def createIssuer(db: db, issuer_data: schemas.IssuerCreate = Depends(schemas.IssuerCreate.from_issuer_base)):
+async def createIssuer(db: AsyncDb, issuer_data: schemas.IssuerCreate = Depends(schemas.IssuerCreate.from_issuer_base)):
 
   new_issuer = model.Issuer(**issuer_data.model_dump())
   db.add(new_issuer)
@@ -173,49 +173,49 @@ async def createIssuer(db: db, issuer_data: schemas.IssuerCreate = Depends(schem
       new_issuer.img = file_name
     except Exception as e:
       raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to upload image: {e}")
-  db.commit()
-  db.refresh(new_issuer)
+  await db.commit()
+  await db.refresh(new_issuer)
   return new_issuer
 
 @product.get('/issuer', response_model=List[schemas.IssuerSchema])
-async def getIssuers(db: db):
-  issuers = db.execute(select(model.Issuer)).scalars().all()
+async def getIssuers(db: ReadDb):
+  issuers = (await db.execute(select(model.Issuer))).scalars().all()
   return issuers
 
 @product.get('/issuer/{issuer_id}', response_model=schemas.IssuerSchema)
-async def getIssuer(issuer_id: int, db: db):
-  issuer = db.get(model.Issuer, issuer_id)
+async def getIssuer(issuer_id: int, db: AsyncDb):
+  issuer = await db.get(model.Issuer, issuer_id)
   if not issuer:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Issuer not found")
   return issuer
 
 @product.get('/group')
-async def getProductGroups(db: db, groupId: Optional[int] = Query(default=None)):
+async def getProductGroups(db: ReadDb, groupId: Optional[int] = Query(default=None)):
   if groupId:
-    product_group = db.get(model.ProductGroup, groupId)
+    product_group = await db.get(model.ProductGroup, groupId)
     if not product_group:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product group not found")
     return product_group
   else:
-    product_groups = db.execute(select(model.ProductGroup)).scalars().all()
+    product_groups = (await db.execute(select(model.ProductGroup))).scalars().all()
   return product_groups
 
 @product.post('/fees', response_model=schemas.TransactionFeeSchema)
 async def createTransactionFee(
-  db: db,
+  db: AsyncDb,
   feeData: schemas.TransactionFeeCreate,
   ):
 
   new_transaction_fee = model.TransactionFee(**feeData.model_dump())
 
   db.add(new_transaction_fee)
-  db.commit()
-  db.refresh(new_transaction_fee)
+  await db.commit()
+  await db.refresh(new_transaction_fee)
   return new_transaction_fee  
 
 @product.post("/group", response_model=schemas.ProductGroupSchema)
 async def createProductGroup(
-  db: db,
+  db: AsyncDb,
   groupData: schemas.ProductGroupCreate
 ):
 
@@ -225,18 +225,18 @@ async def createProductGroup(
       association = model.ProductGroupFees(TransactionFeeId=fee)
       new_product_group.transactionFees.append(association)
   db.add(new_product_group)
-  db.commit()
-  db.refresh(new_product_group)
+  await db.commit()
+  await db.refresh(new_product_group)
   return new_product_group
 
 @product.patch("/group")
 async def updateProductGroup(
-  db: db,
+  db: AsyncDb,
   productGroupId: int,
   groupData: schemas.ProductGroupUpdate,
 ):
 
-  new_product_group = db.get(model.ProductGroup, productGroupId)
+  new_product_group = await db.get(model.ProductGroup, productGroupId, options=[selectinload(model.ProductGroup.transactionFees)])
   if not new_product_group:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product group not found")
 
@@ -247,7 +247,7 @@ async def updateProductGroup(
   if groupData.feeIds:
     new_product_group.transactionFees = []
     for fee in groupData.feeIds:
-      dbFee = db.get(model.TransactionFee, fee)
+      dbFee = await db.get(model.TransactionFee, fee)
       if not dbFee:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction fee not found")
       association = model.ProductGroupFees()
@@ -255,13 +255,13 @@ async def updateProductGroup(
       new_product_group.transactionFees.append(association)
 
   db.add(new_product_group)
-  db.commit()
-  db.refresh(new_product_group)  
+  await db.commit()
+  await db.refresh(new_product_group)  
   return new_product_group
 
 @product.post('/variable', status_code=status.HTTP_201_CREATED)
 async def createProduct(
-  db: db,
+  db: AsyncDb,
   product_data: schemas.VariableCreate = Depends(schemas.VariableCreate.from_variable_base),
   issuer: model.Issuer = Depends(getIssuer),
 ):
@@ -279,27 +279,47 @@ async def createProduct(
   elif issuer.img is not None:
     new_product.img = issuer.img
 
-  db.commit()
-  db.refresh(new_product)
+  await db.commit()
+  await db.refresh(new_product)
 
   return new_product
 
 @product.post('/variable/attributes', status_code=status.HTTP_201_CREATED)
 async def createVariableAttributes(
-  db: db,
+  db: AsyncDb,
   attributes: schemas.VariableAttributesCreate,
   product: model.Product = Depends(getProduct),
 ):
-  new_attributes = model.VariableAttributes(**attributes.model_dump())
-  new_attributes.variable = product
+  # by id: the product is read through ReadDb, a different session
+  new_attributes = model.VariableAttributes(**attributes.model_dump(), variableId=product.id)
   db.add(new_attributes)
-  db.commit()
-  db.refresh(new_attributes)
+  await db.commit()
+  await db.refresh(new_attributes)
   return new_attributes
 
+@product.post('/variable/distribution', status_code=status.HTTP_201_CREATED)
+async def declareVariableDistribution(
+  db: AsyncDb,
+  distribution: schemas.VariableDistributionCreate,
+  product: model.Product = Depends(getProduct),
+):
+  if product.category != "variable":
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Distributions can only be declared on variable products")
+  new_distribution = model.VariableDistribution(
+    variableId=product.id,
+    amountPerUnit=distribution.amountPerUnit,
+    recordDate=distribution.recordDate,
+    paymentDate=distribution.paymentDate or distribution.recordDate,
+  )
+  # stays pending: the distribution sweep pays it once the record date has closed and the payment date has come
+  db.add(new_distribution)
+  await db.commit()
+  await db.refresh(new_distribution)
+  return new_distribution
+
 @product.post('/deposit', status_code=status.HTTP_201_CREATED)
 async def createDeposit(
-  db: db,
+  db: AsyncDb,
   product_data: schemas.DepositCreate = Depends(schemas.DepositCreate.from_deposit_base),
   issuer: model.Issuer = Depends(getIssuer),
 ):
@@ -319,13 +339,13 @@ async def createDeposit(
   elif issuer.img is not None:
     new_product.img = issuer.img
 
-  db.commit()
-  db.refresh(new_product)
+  await db.commit()
+  await db.refresh(new_product)
 
   return new_product
 
 @product.post('/bulk')
-async def createProducts(db:db, data = Body()):
+async def createProducts(db: AsyncDb, data = Body()):
   
   for product_data in data:
     issuer = model.Issuer(name=product_data.get('name'))
@@ -333,7 +353,7 @@ async def createProducts(db:db, data = Body()):
     product.issuer = issuer
     db.add(product)
   
-  db.commit()
+  await db.commit()
   return {"message": "Products created successfully"}
 
 
@@ -347,10 +367,10 @@ class BulkIn(BaseModel):
   type: str
 
 # @product.post('/bulk-ticket')
-async def addBulkPolygon(db: db, tickers: List[BulkIn]):
+async def addBulkPolygon(db: AsyncDb, tickers: List[BulkIn]):
 
   for ticker in tickers:
-    issuerCheck = db.execute(select(model.Issuer).where(model.Issuer.name == ticker.issuerName)).scalar_one_or_none()
+    issuerCheck = (await db.execute(select(model.Issuer).where(model.Issuer.name == ticker.issuerName))).scalar_one_or_none()
 
     if issuerCheck is None:
       issuer = model.Issuer(name=ticker.issuerName)
@@ -361,27 +381,27 @@ async def addBulkPolygon(db: db, tickers: List[BulkIn]):
     product.issuer = issuer
     db.add(product)
   
-  db.commit()
+  await db.commit()
 
 @product.get('/variable')
-async def getVariable(db: db, variable_id: int):
-  variable = db.get(model.Variable, variable_id)
+async def getVariable(db: AsyncDb, variable_id: int):
+  variable = await db.get(model.Variable, variable_id)
   if not variable:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Variable not found")
   
   return variable
 
 @product.get('/analysis')
-async def getProductAnalysis(db: db, 
+async def getProductAnalysis(db: AsyncDb, 
                              product = Depends(getVariable)
                              ):
 
-  benchmark = product.benchmark
+  benchmark = await product.awaitable_attrs.benchmark
 
   if benchmark is None:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Benchmark not found")
 
-  if product.values is None or benchmark.history is None:
+  if await product.awaitable_attrs.values is None or await benchmark.awaitable_attrs.history is None:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product values or benchmark history not found")
   
   if (product.product_class == schemas.ProductClass.EQUITY or product.product_class == schemas.ProductClass.ETF) and product.currency == schemas. Currency.USD:
@@ -503,74 +523,74 @@ async def getProductAnalysis(db: db,
     character.beta = beta
 
   db.add(character)
-  db.commit()
-  db.refresh(character)
+  await db.commit()
+  await db.refresh(character)
 
   return {"message": "Product character added successfully", "character": character}
 
 
 @product.patch('/')
-async def updateProduct(db: db):
+async def updateProduct(db: AsyncDb):
 
-  for product in db.execute(select(model.Variable)).scalars().all():
+  for product in (await db.execute(select(model.Variable))).scalars().all():
     if product.product_class == schemas.ProductClass.EQUITY and product.currency == schemas.Currency.USD:
       product.benchmark_id = 3
       db.add(product)
   
-  db.commit()
+  await db.commit()
   return {"message": "Products updated successfully"}
 
 @product.post('/value')
-async def addProductValue(db: db, 
+async def addProductValue(db: AsyncDb, 
                           data: list[schemas.VariableValueCreate], 
                           id: int = Query(..., description="Product or benchmark ID"),
                           type: str = Query(enum=['INDEX', 'PRODUCT']),
 ):
 
   if type == 'PRODUCT':
-    product = db.get(model.Variable, id)
+    product = await db.get(model.Variable, id)
     if not product:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     for value in data:
       new_value = model.VariableValue(**value.model_dump(), variableId=product.id)
-      product.values.append(new_value)
+      (await product.awaitable_attrs.values).append(new_value)
       db.add(product)
 
   if type == 'INDEX':
-    benchmark = db.get(model.Benchmark, id)
+    benchmark = await db.get(model.Benchmark, id)
     if not benchmark:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Benchmark not found")
     for value in data:
       new_value = model.BenchmarkValue(**value.model_dump(), benchmarkId=benchmark.id)
-      benchmark.history.append(new_value)
+      (await benchmark.awaitable_attrs.history).append(new_value)
       db.add(benchmark)
 
-  db.commit()
+  await db.commit()
   return {"message": "Product values added successfully"}
 
 @product.patch('/value')
-async def updateProductValue(db: db, date: datetime, value: float, id: int = Query(..., description="Product or benchmark ID"), type: str = Query(enum=['INDEX', 'PRODUCT']),):
+async def updateProductValue(db: AsyncDb, date: datetime, value: float, id: int = Query(..., description="Product or benchmark ID"), type: str = Query(enum=['INDEX', 'PRODUCT']),):
 
   if type == 'PRODUCT':
-    product = db.get(model.Variable, id)
+    product = await db.get(model.Variable, id)
     if not product:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-    new_product_value = db.execute(update(model.VariableValue).where(model.VariableValue.variableId == product.id, model.VariableValue.date == date).values(value=value)).scalar_one_or_none()
+    new_product_value = (await db.execute(update(model.VariableValue).where(model.VariableValue.variableId == product.id, model.VariableValue.date == date).values(value=value))).scalar_one_or_none()
     if new_product_value is None:
       new_product_value = model.VariableValue(variableId=product.id, date=date, value=value)
       db.add(new_product_value)
 
   if type == 'INDEX':
-    benchmark = db.get(model.Benchmark, id)
+    benchmark = await db.get(model.Benchmark, id)
     if not benchmark:
       raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Benchmark not found")
-    new_benchmark_value = db.execute(update(model.BenchmarkValue).where(model.BenchmarkValue.benchmarkId == benchmark.id, model.BenchmarkValue.date == date).values(value=value)).scalar_one_or_none()
+    new_benchmark_value = (await db.execute(update(model.BenchmarkValue).where(model.BenchmarkValue.benchmarkId == benchmark.id, model.BenchmarkValue.date == date).values(value=value))).scalar_one_or_none()
     if new_benchmark_value is None:
       new_benchmark_value = model.BenchmarkValue(benchmarkId=benchmark.id, date=date, value=value)
       db.add(new_benchmark_value)
 
-  db.commit()
+  await db.commit()
   return {"message": f"{type} value updated successfully", "value": new_product_value if type == 'PRODUCT' else new_benchmark_value}
 
 class BulkValueIn(BaseModel):
@@ -617,39 +637,40 @@ async def getUSPrice(ticker: str):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to get price for {ticker}: {response.text}")
 
 @product.get('/mutual-fund/price')
-async def getNGMutualFundPrice(db: db, variable: model.Product = Depends(getProduct)):
-    mutual_fund_value = db.execute(select(model.VariableValue).where(model.VariableValue.variableId == variable.id).order_by(model.VariableValue.date.desc()).limit(1)).scalar_one_or_none()
+async def getNGMutualFundPrice(db: ReadDb, variable: model.Product = Depends(getProduct)):
+    mutual_fund_value = (await db.execute(select(model.VariableValue).where(model.VariableValue.variableId == variable.id).order_by(model.VariableValue.date.desc()).limit(1))).scalar_one_or_none()
     if mutual_fund_value is None:
       return 100.00
     return mutual_fund_value.price
 
 @product.get('/price')
-async def getPrice(db: db, product: model.Product = Depends(getProduct)):
+async def getPrice(db: ReadDb, product: model.Product = Depends(getProduct)):
 
-  if product.productClass == schemas.ProductClass.MUTUAL_FUND and product.productGroup.market == schemas.Country.NG and product.assetClass != schemas.AssetClassType.MONEY_MARKET:
+  product_group = await product.awaitable_attrs.productGroup
+  if product.productClass == schemas.ProductClass.MUTUAL_FUND and product_group.market == schemas.Country.NG and product.assetClass != schemas.AssetClassType.MONEY_MARKET:
     return await getNGMutualFundPrice(db, product)
-  if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and product.productGroup.market == schemas.Country.US:
+  if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and product_group.market == schemas.Country.US:
     return await getUSPrice(product.symbol)
-  if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and product.productGroup.market == schemas.Country.NG:
+  if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and product_group.market == schemas.Country.NG:
     return await getNGXPrice(product.symbol)
-  if product.productClass == schemas.ProductClass.MUTUAL_FUND and product.productGroup.market == schemas.Country.NG and product.assetClass == schemas.AssetClassType.MONEY_MARKET:
+  if product.productClass == schemas.ProductClass.MUTUAL_FUND and product_group.market == schemas.Country.NG and product.assetClass == schemas.AssetClassType.MONEY_MARKET:
     return 1.00
 
 @product.post('/benchmark')
-async def createBenchmark(db: db, benchmark: schemas.BenchmarkCreate):
+async def createBenchmark(db: AsyncDb, benchmark: schemas.BenchmarkCreate):
   new_benchmark = model.Benchmark(**benchmark.model_dump())
   db.add(new_benchmark)
-  db.commit()
-  db.refresh(new_benchmark)
+  await db.commit()
+  await db.refresh(new_benchmark)
   return new_benchmark
 
 @product.post('/image')
-async def uploadProductLogo(db: db, file: UploadFile, product: model.Product = Depends(getProduct)):
+async def uploadProductLogo(db: AsyncDb, file: UploadFile, product: model.Product = Depends(getProduct)):
   file_name = f"logo/{product.title.replace(' ', '_')}.{file.filename.split('.')[-1]}"
   try:
     await upload_file(bucket_name="product", file_object=file.file, file_name=file_name, content_type=file.content_type)
-    db.execute(update(model.Product).where(model.Product.id == product.id).values(img=file_name))
-    db.commit()
+    await db.execute(update(model.Product).where(model.Product.id == product.id).values(img=file_name))
+    await db.commit()
     return {"message": "File uploaded successfully", "file_name": file_name}
   except Exception as e:
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to upload file: {e}")
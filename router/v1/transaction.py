@@ -1,14 +1,14 @@
 import asyncio
+import math
 from model import PortfolioTransaction
 import uuid
 from fastapi import APIRouter, Depends, status, HTTPException, Query, Security
 from fastapi.security import SecurityScopes
-from sqlalchemy.orm import Session, join
+from sqlalchemy.orm import Session, join, selectinload, with_polymorphic
 from sqlalchemy import select, func, case, and_, or_
-from router.v1.portfolio import getPortfolioValue
 import celery_app
 from ..v1 import auth
-from database import db
+from database import AsyncDb
 import model
 import schemas
 from typing import Annotated, Union, Optional, List
@@ -19,30 +19,34 @@ from ..v1.deposit import getLiquidationValue
 from ..v1.journal import prepareJournal
 from ..v1.wallet import generateWalletTransaction, getWalletBalance
 from ..v1.product import getPrice, getProduct
+from utils.outbox import enqueueTask
+from utils.holdings import reserveSaleOrders
+from utils.ledger import postJournal
+from utils.wallet import placeHolds
 
 transaction = APIRouter(prefix="/transaction", tags=["transaction"])
 
 @transaction.get("/")
 async def getTransaction(
     transaction_id: int,
-    db: db,
+    db: AsyncDb,
 ):
-    transaction = db.get(model.PortfolioTransaction, transaction_id)
+    transaction = await db.get(model.PortfolioTransaction, transaction_id)
     if not transaction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
     if transaction.category == "deposittransaction":
-        return db.get(model.DepositTransaction, transaction_id)
+        return await db.get(model.DepositTransaction, transaction_id)
     elif transaction.category == "variabletransaction":
-        return db.get(model.VariableTransaction, transaction_id)
+        return await db.get(model.VariableTransaction, transaction_id)
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid transaction category")
 
 @transaction.get("/status")
 async def getTransactionStatus(
     transaction_id: int,
-    db: db,
+    db: AsyncDb,
 ):
-    transaction = db.get(model.PortfolioTransaction, transaction_id)
+    transaction = await db.get(model.PortfolioTransaction, transaction_id)
     if not transaction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
     return transaction.status
@@ -50,29 +54,33 @@ async def getTransactionStatus(
 @transaction.get("/batch")
 async def getTransactionBatch(
     batch_id: uuid.UUID,
-    db: db,
+    db: AsyncDb,
 ):
-    batch = db.get(model.TransactionBatch, batch_id)
+    batch = await db.get(model.TransactionBatch, batch_id)
     if not batch:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
     return batch
 
-def getDbProduct(
+async def getDbProduct(
     productId: int,
-    db:  db
+    db: AsyncDb
 ):
-    product = db.get(model.Product, productId)
+    # subclass columns and the fee schedule are loaded with the product, since the consideration and purchase read them without awaiting
+    products = with_polymorphic(model.Product, [model.Variable, model.Deposit])
+    product = (await db.execute(
+        select(products)
+        .where(products.id == productId)
+        .options(selectinload(products.productGroup).selectinload(model.ProductGroup.transactionFees))
+    )).scalar_one_or_none()
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Product {productId} not found",
         )
-    if product.category == "variable":
-        return db.get(model.Variable, productId)
-    if product.category == "deposit":
-        return db.get(model.Deposit, productId)
+    if product.category == "variable" or product.category == "deposit":
+        return product
     
-def calculateConsideration(product: model.Variable | model.Deposit, amount: float, side: schemas.TransactionType, db: db):
+def calculateConsideration(product: model.Variable | model.Deposit, amount: float, side: schemas.TransactionType, db: AsyncDb):
     
     all_fees = []    
     if product.productGroup.transactionFees is not None:
@@ -98,12 +106,12 @@ def calculateConsideration(product: model.Variable | model.Deposit, amount: floa
 
 @transaction.post("/consideration")
 async def getTransactionConsideration(
-    db: db,
+    db: AsyncDb,
     orders: list[schemas.PurchaseOrder],
     type: str = Query(enum=["purchase", "sale"]),
 ):
 
-    products = map(lambda x: {"product": getDbProduct(x.productId, db=db), "amount": x.amount, "tenor": None if x.tenor is None else x.tenor}, orders)
+    products = [{"product": await getDbProduct(x.productId, db=db), "amount": x.amount, "tenor": None if x.tenor is None else x.tenor} for x in orders]
     consideration = list(map(lambda x: {"product": x["product"], "amount": x["amount"], "tenor": x["tenor"], "consideration": calculateConsideration(product=x["product"], amount=x["amount"], side=schemas.TransactionType.INVESTMENT if type == "purchase" else schemas.TransactionType.LIQUIDATION, db=db)}, products))
     total_consideration = sum(x["consideration"]["netConsideration"] for x in consideration)
     return {
@@ -113,11 +121,10 @@ async def getTransactionConsideration(
 
 @transaction.post("/coverage")
 async def getTransactionCoverage(
-    db: db,
+    db: AsyncDb,
     wallet = Depends(getWalletBalance),
     consideration: dict = Depends(getTransactionConsideration),
 ):
-    # balance = wallet["balance"]
     balance = wallet.get("availableBalance", 0.00)
     # check if user has sufficient funds
     if balance < consideration["totalConsideration"]:
@@ -125,130 +132,100 @@ async def getTransactionCoverage(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Insufficient funds",
         )
+    # the version read here is checked again when the purchase debits the wallet
     return {
-        **consideration
+        **consideration,
+        "wallet": wallet,
     }
 
 @transaction.post("/execute")
 async def executeTransaction(
+    db: AsyncDb,
     batch: Annotated[model.TransactionBatch, Depends(getTransactionBatch)]):
     if batch.executed:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transactions already executed")
 
-    # separate transactions by product group
-    ng_mutual_funds = list(filter(lambda x: x.product.productClass == schemas.ProductClass.MUTUAL_FUND and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-    ng_deposits = list(filter(lambda x: x.product.productClass == schemas.ProductClass.DEPOSIT and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-    us_stocks = list(filter(lambda x: x.product.productClass == schemas.ProductClass.EQUITY and x.product.productGroup.market == schemas.Country.US, batch.portfolio_transactions))
-    ng_stocks = list(filter(lambda x: x.product.productClass == schemas.ProductClass.EQUITY and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-
-    if ng_mutual_funds:
-        for mutual_fund_transaction in ng_mutual_funds:
-            celery_app.executeMutualFundTransactionTask.delay(portfolio_transaction_id=mutual_fund_transaction.id)
-
-    if ng_deposits:
-        for deposit_transaction in ng_deposits:
-            celery_app.bookPortfolioDepositTask.delay(deposit_transaction_id=deposit_transaction.id)
-    if us_stocks:
-        for stock_transaction in us_stocks:  
-            celery_app.executeAlpacaTransactionTask.delay(portfolio_transaction_id=stock_transaction.id)
-
-    if ng_stocks:
-        for stock_transaction in ng_stocks:
-            celery_app.executeNGXTransactionTask.delay(portfolio_transaction_id=stock_transaction.id)
+    # execute the whole batch in one task, fanned out per venue
+    await db.run_sync(enqueueTask, "execute_transaction_batch_task", batch_id=str(batch.id))
+    await db.commit()
 
     return {
         "message": "Transactions execution initiated",
     }
 
 async def settleTransaction(
-    db: db,
+    db: AsyncDb,
     batch: model.TransactionBatch,
 ):
     db.add(batch)
-    db.commit()
-    db.refresh(batch)
+    await db.commit()
+    await db.refresh(batch)
     return batch
 
 @transaction.post("/purchase")
 async def postTransaction(
-    db: db,
+    db: AsyncDb,
     orderBook = Depends(getTransactionCoverage),
     portfolio = Security(getPortfolio, scopes=["createUser"]),
     date: datetime = datetime.now(),
 ):
-    batch = model.TransactionBatch()
+    # the wallet pays in its own currency only
+    for order in orderBook["orderBook"]:
+        if order["product"].currency != orderBook["wallet"]["currency"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{order['product'].title} is priced in {order['product'].currency.value}, the wallet holds {orderBook['wallet']['currency'].value}")
+
+    batch = model.TransactionBatch(id=uuid.uuid4())
+    holds = []
 
     for order in orderBook["orderBook"]:
         currency = order["product"].currency
-        wallet_journal = model.Journal(
-            date=datetime.now()
-        )
 
+        # the journal is kept in accounting minor units, the wallet moves in minor units of its own currency
         accounting_amount = (order["amount"] * 1470 if order["product"].currency == schemas.Currency.USD else order["amount"]) * 100
+        wallet_amount = int(order["amount"] * 100)
         transaction_amount = order["amount"]
+        booking_date = datetime.now()
+
+        # debit wallet and credit transaction payable for consideration
+        entries = [
+            {"accountId": 10, "amount": accounting_amount, "side": schemas.EntrySide.DEBIT, "description": f"{order["product"].title} investment purchase consideration"},
+            {"accountId": order["product"].productGroup.receivableAccountId, "amount": accounting_amount, "side": schemas.EntrySide.CREDIT, "description": f"{order["product"].title} investment purchase consideration"},
+        ]
+        fee_amounts = []
+        if order.get("consideration", {}).get("fees") is not None:
+            for fee in order.get("consideration", {}).get("fees"):
+                fee_amount = int((fee["amount"] * 1470 if currency == schemas.Currency.USD else fee["amount"]) * 100)
+                fee_amounts.append(int(fee["amount"] * 100))
+                # debit wallet and credit payable for fee
+                entries.append({"accountId": 10, "amount": fee_amount, "side": schemas.EntrySide.DEBIT, "description": f"{fee} fee"})
+                entries.append({"accountId": order["product"].productGroup.payableAccountId, "amount": fee_amount, "side": schemas.EntrySide.CREDIT, "description": f"{fee} fee"})
+
+        # one journal for the consideration and its fees, posted before the wallet rows that reference it
+        journal_id = await db.run_sync(postJournal, booking_date, entries)
 
         consideration_wallet_transaction = model.WalletTransaction(
-            amount=accounting_amount,
+            amount=wallet_amount,
             type=schemas.TransactionType.INVESTMENT,
-            status=schemas.TransactionStatus.COMPLETED,
-            walletId=1,
-            date=datetime.now(),
-        )
-
-        # debit wallet for consideration
-        wallet_entry = model.JournalEntry(
-            accountId=10,
-            amount=accounting_amount,
-            side=schemas.EntrySide.DEBIT,
-            description=f"{order["product"].title} investment purchase consideration"
+            status=schemas.TransactionStatus.PENDING,
+            walletId=orderBook["wallet"]["walletId"],
+            date=booking_date,
+            journalId=journal_id,
         )
-        # credit transaction payable for consideration
-        payable_entry = model.JournalEntry(
-            accountId=order["product"].productGroup.receivableAccountId,
-            amount=accounting_amount,
-            side=schemas.EntrySide.CREDIT,
-            description=f"{order["product"].title} investment purchase consideration"
-        )
-
-        wallet_journal.entries.append(wallet_entry)
-        wallet_journal.entries.append(payable_entry)
-        consideration_wallet_transaction.journal = wallet_journal
         db.add(consideration_wallet_transaction)
+        fee_transactions = []
 
-        # book fee transctions
-        if order.get("consideration", {}).get("fees") is not None:
-            for fee in order.get("consideration", {}).get("fees"):
-
-                fee_amount = int((fee["amount"] * 1470 if currency == schemas.Currency.USD else fee["amount"]) * 100)
-            # book fee wallet transaction
-                fee_transaction = model.WalletTransaction(
-                    amount=fee_amount,
-                    type=schemas.TransactionType.FEE,
-                    status=schemas.TransactionStatus.COMPLETED,
-                    walletId=orderBook["wallet"].id,
-                    journal=wallet_journal,
-                    date=datetime.now()
-                )
-            # debit wallet for fee
-                fee_wallet_entry = model.JournalEntry(
-                    accountId=10,
-                    amount=fee_amount,
-                    side=schemas.EntrySide.DEBIT,
-                    description=f"{fee} fee",
-                    journal=wallet_journal
-                )
-            # credit payable for fee
-                fee_payable_entry = model.JournalEntry(
-                    accountId=order["product"].productGroup.payableAccountId,
-                    amount=fee_amount,
-                    side=schemas.EntrySide.CREDIT,
-                    description=f"{fee} fee",
-                    journal=wallet_journal
-                )
-                wallet_journal.entries.append(fee_wallet_entry)
-                wallet_journal.entries.append(fee_payable_entry)
-                db.add(fee_transaction)
-        db.add(wallet_journal)
+        # book fee wallet transactions
+        for fee_amount in fee_amounts:
+            fee_transaction = model.WalletTransaction(
+                amount=fee_amount,
+                type=schemas.TransactionType.FEE,
+                status=schemas.TransactionStatus.PENDING,
+                walletId=orderBook["wallet"]["walletId"],
+                journalId=journal_id,
+                date=booking_date
+            )
+            db.add(fee_transaction)
+            fee_transactions.append(fee_transaction)
 
         # create product transaction for variable and deposit products
         if order["product"].category == "variable":
@@ -283,62 +260,111 @@ async def postTransaction(
             port_transaction.batch = batch
 
 
-        association = model.PortfolioWalletTransactionAssociation(wallet_transaction=consideration_wallet_transaction)
-        port_transaction.wallet_transaction_associations.append(association)
+        # fees are linked too, so they are completed or failed together with the consideration
+        for wallet_transaction in [consideration_wallet_transaction] + fee_transactions:
+            association = model.PortfolioWalletTransactionAssociation(wallet_transaction=wallet_transaction)
+            port_transaction.wallet_transaction_associations.append(association)
         db.add(consideration_wallet_transaction)
         db.add(batch)
+        holds.append((port_transaction, wallet_amount + sum(fee_amounts)))
 
-    db.commit()
-    db.refresh(batch)
-    # separate transactions by product group
-    ng_mutual_funds = list(filter(lambda x: x.product.productClass == schemas.Currency.NGN and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-    ng_deposits = list(filter(lambda x: x.product.productClass == schemas.Currency.NGN and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-    us_stocks = list(filter(lambda x: x.product.productClass == schemas.Currency.USD and x.product.productGroup.market == schemas.Country.US, batch.portfolio_transactions))
-    ng_stocks = list(filter(lambda x: x.product.productClass == schemas.Currency.NGN and x.product.productGroup.market == schemas.Country.NG, batch.portfolio_transactions))
-
-    if ng_mutual_funds:
-        for mutual_fund_transaction in ng_mutual_funds:
-            celery_app.executeMutualFundTransactionTask.delay(portfolio_transaction_id=mutual_fund_transaction.id)
+    # hold the funds only if the balance has not moved since coverage was checked; converted on execution, released on failure
+    await db.flush()
+    await db.run_sync(
+        placeHolds,
+        [{"walletId": orderBook["wallet"]["walletId"], "portfolioTransactionId": port_transaction.id, "amount": amount} for port_transaction, amount in holds],
+        versions={orderBook["wallet"]["walletId"]: orderBook["wallet"]["version"]},
+    )
 
-    if ng_deposits:
-        for deposit_transaction in ng_deposits:
-            celery_app.bookPortfolioDepositTask.delay(deposit_transaction_id=deposit_transaction.id)
+    # execute the whole batch in one task, fanned out per venue; dispatched by the outbox relay after commit
+    await db.run_sync(enqueueTask, "execute_transaction_batch_task", batch_id=str(batch.id))
 
-    if us_stocks:
-        for stock_transaction in us_stocks:
-            celery_app.executeAlpacaTransactionTask.delay(portfolio_transaction_id=stock_transaction.id)
-
-    if ng_stocks:
-        for stock_transaction in ng_stocks:
-            celery_app.executeNGXTransactionTask.delay(portfolio_transaction_id=stock_transaction.id)
+    await db.commit()
+    await db.refresh(batch)
 
     return {"message": "Transaction initialized", "batch": batch.id}
 
 async def checkAssetAvailability(
-    db: db,
+    db: AsyncDb,
     orders: list[schemas.SaleOrder],
-    assets = Depends(getPortfolioValue),
+    portfolio = Security(getPortfolio, scopes=["createUser"]),
 ):
-    variables = list(filter(lambda x: x["category"] == "variable", assets))
     variable_orders = list(filter(lambda x: x.type == schemas.ProductCategory.VARIABLE, orders))
-    for order in variable_orders:
-        variable = next((asset for asset in variables if asset["product"].id == order.id), None)
-        if variable is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Variable {order.id} not found")
-        if variable["current_value"] < order.amount:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Variable {order.id} has insufficient funds")
-    
-    deposits = list(filter(lambda x: x["category"] == "deposit", assets))
     deposit_orders = list(filter(lambda x: x.type == schemas.ProductCategory.DEPOSIT, orders))
+
+    # price each sold variable once; holdings are read per (portfolio, product) from the ledger
+    variable_units = {}
+    variable_amounts = {}
+    prices = {}
+    for order in variable_orders:
+        if order.id not in prices:
+            prices[order.id] = await getPrice(db=db, product=await getProduct(db=db, productId=order.id))
+        variable_units[order.id] = variable_units.get(order.id, 0) + int(math.ceil(order.amount / prices[order.id]))
+        variable_amounts[order.id] = variable_amounts.get(order.id, 0) + order.amount
+    deposit_amounts = {}
     for order in deposit_orders:
-        deposit = next((asset for asset in deposits if asset["deposit"].id == order.id), None)
-        if deposit is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Deposit {order.id} not found")
-        if deposit["current_value"] < order.amount:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Deposit {order.id} has insufficient funds")
+        deposit_amounts[order.id] = deposit_amounts.get(order.id, 0) + int(order.amount * 100)
+
+    # held until the sale is booked or fails; committed together with the sale that uses it
+    reservations = await db.run_sync(reserveSaleOrders, portfolio.id, variable_units, deposit_amounts)
 
     return {
         "variable_orders": variable_orders,
         "deposit_orders": deposit_orders,
+        "variable_amounts": variable_amounts,
+        "prices": prices,
+        "reservations": reservations,
     }
 
+@transaction.post("/sale")
+async def postSaleTransaction(
+    db: AsyncDb,
+    sale = Depends(checkAssetAvailability),
+    portfolio = Security(getPortfolio, scopes=["createUser"]),
+):
+    batch = model.TransactionBatch(id=uuid.uuid4())
+    sales = []
+
+    # one sale per reserved product or placement
+    for reservation in sale["reservations"]:
+        product = await getDbProduct(reservation.productId, db=db)
+        if reservation.portfolioDepositId is None:
+            price = sale["prices"][reservation.productId]
+            amount = sale["variable_amounts"][reservation.productId]
+            port_transaction = model.VariableTransaction(
+                productId=product.id,
+                amount=int((amount * 1470 if product.currency == schemas.Currency.USD else amount) * 100),
+                type=schemas.TransactionType.LIQUIDATION,
+                status=schemas.TransactionStatus.PENDING,
+                portfolioId=portfolio.id,
+                date=datetime.now(),
+                units=reservation.units,
+                price=int(price * 100),
+                settlement=schemas.TransactionStatus.PENDING,
+            )
+        else:
+            port_transaction = model.DepositTransaction(
+                productId=product.id,
+                amount=reservation.amount,
+                type=schemas.TransactionType.LIQUIDATION,
+                status=schemas.TransactionStatus.PENDING,
+                portfolioId=portfolio.id,
+                date=datetime.now(),
+                settlement=schemas.TransactionStatus.PENDING,
+            )
+        port_transaction.batch = batch
+        db.add(port_transaction)
+        sales.append((reservation, port_transaction))
+
+    # tie each reservation to its sale, which releases it once booked to the ledger or failed
+    await db.flush()
+    for reservation, port_transaction in sales:
+        reservation.transactionId = port_transaction.id
+
+    # execute the whole batch in one task, fanned out per venue; dispatched by the outbox relay after commit
+    await db.run_sync(enqueueTask, "execute_transaction_batch_task", batch_id=str(batch.id))
+
+    await db.commit()
+    await db.refresh(batch)
+
+    return {"message": "Sale initialized", "batch": batch.id}
@@ -3,7 +3,7 @@ from click import File
 from fastapi import APIRouter, Body, Depends, HTTPException, Query, UploadFile, status, Security
 from fastapi.security import SecurityScopes
 from sqlalchemy.orm import Session
-from database import db
+from database import AsyncDb, ReadDb
 import model
 from typing import Annotated, Optional, Union
 from pydantic import BaseModel
@@ -13,8 +13,10 @@ from utils.kyc import prembly
 from ..v1 import auth
 from utils.minio_to_base64 import convert_minio_image_to_base64
 from utils.assesment import runAssesment
+from utils.principal import getPrincipal, loadPrincipal, expirePrincipal
 from datetime import datetime, timedelta
 from sqlalchemy import select, update, insert
+from sqlalchemy.orm import selectinload, raiseload
 from celery_app import linkAnchorAccountTask, uploadAnchorKycDocumentTask, createAnchorDepositAccountTask, validateAnchorTier2KycTask, validateAnchorTier3KycTask
 from utils.minio import upload_file, get_file, download_s3_object_for_requests, validate_image_file
 from utils.anchor import uploadAnchorCustomerDocument, createAnchorCustomer, anchor_api_server_error_codes, anchor_api_client_error_codes
@@ -27,16 +29,16 @@ user = APIRouter(
 )
 
 @user.post("/signup", response_model=schemas.UserSchema, status_code=status.HTTP_201_CREATED)
-async def signup(db: db, data = Security(auth.verifyOtp, scopes=[schemas.OtpType.SIGNUP.value])):
+async def signup(db: AsyncDb, data = Security(auth.verifyOtp, scopes=[schemas.OtpType.SIGNUP.value])):
 
-    user = db.execute(select(model.User).where(model.User.email == data.get('email'), model.User.is_active == True)).scalar_one_or_none()
+    user = (await db.execute(select(model.User).where(model.User.email == data.get('email'), model.User.is_active == True))).scalar_one_or_none()
     if user is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
     user = model.User(first_name=data.get('firstName'), last_name=data.get('lastName'), other_names=data.get('otherNames'), phone_number=data.get('phoneNumber'), email=data.get('email'), is_active=False)
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     # send welcome email - in a queue or send email for Brevo to send in the background
     # await utils.send_email(email=user.email, subject="Welcome to Your Pie", message="Welcome to Your Pie")
@@ -44,9 +46,9 @@ async def signup(db: db, data = Security(auth.verifyOtp, scopes=[schemas.OtpType
     return user
 
 @user.post("/password", status_code=status.HTTP_201_CREATED)
-async def set_password(db: db, password = Body(..., embed=True), payload = Security(auth.verifyAccessToken, scopes=[schemas.AccessLimit.PASSWORD.value])):
+async def set_password(db: AsyncDb, password = Body(..., embed=True), payload = Security(auth.verifyAccessToken, scopes=[schemas.AccessLimit.PASSWORD.value])):
 
-    user = db.execute(select(model.User).where(model.User.email == payload.get('username'))).scalar_one_or_none()
+    user = (await db.execute(select(model.User).where(model.User.email == payload.get('username')))).scalar_one_or_none()
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
@@ -60,67 +62,88 @@ async def set_password(db: db, password = Body(..., embed=True), payload = Secur
     user.portfolios.append(liquid)
 
     db.add(user)
-    db.commit()
+    await db.commit()
     return {"message": "Password reset successfully"}
 
 @user.post("/change-password", status_code=status.HTTP_201_CREATED, response_model=schemas.TokenResponse)
-async def changePassword(db: db, user: Annotated[model.User, Depends(auth.getActiveUser)]):
+async def changePassword(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
 
     # send otp to user
     otp = await auth.sendOtp(data={'email': user.email}, type=schemas.OtpType.RESET_PASSWORD)
     return otp
 
 @user.patch("/password", status_code=status.HTTP_201_CREATED)
-async def updatePassword(db: db, new_password = Body(..., embed=True), token = Security(auth.verifyAccessToken, scopes=[schemas.OtpType.RESET_PASSWORD.value])):
+async def updatePassword(db: AsyncDb, new_password = Body(..., embed=True), token = Security(auth.verifyAccessToken, scopes=[schemas.OtpType.RESET_PASSWORD.value])):
     
-    user = db.execute(update(model.User).where(model.User.email == token.get('email')).values(password=auth.hashpass(new_password)).returning(model.User)).scalar_one()
-    db.commit()
-    db.refresh(user)
+    user = (await db.execute(update(model.User).where(model.User.email == token.get('email')).values(password=auth.hashpass(new_password)).returning(model.User))).scalar_one()
+    await db.commit()
+    await db.refresh(user)
     return user
 
-# @user.get("/", response_model=schemas.UserOut)
-@user.get("/")
 async def getUser(
-    db: db, 
+    db: AsyncDb, 
     user_id: Annotated[Optional[int], Query(description="User_ID is required for admin to get user data")] = None,
     payload = Security(auth.readUser, scopes=["readUser"])):
 
     if payload.get("token") == "user":
-        user = db.execute(select(model.User).where(model.User.email == payload.get("username"))).scalar_one_or_none()
+        user = await getPrincipal(db, payload.get("username"))
     
     if payload.get("token") == "admin":
         if user_id is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User_id query param is required")
-        user = db.get(model.User, user_id)
+        user = await loadPrincipal(db, model.User.id == user_id)
 
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return user
 
+async def getUserWith(db: AsyncDb, user_id: int, *relationships) -> Optional[model.User]:
+    """
+    The user row with only the named relationships loaded; touching any other relationship raises instead of querying
+    """
+    return (await db.execute(
+        select(model.User)
+        .where(model.User.id == user_id)
+        .options(*(selectinload(relationship) for relationship in relationships), raiseload("*"))
+    )).scalar_one_or_none()
+
+async def getPortfoliosByUser(db: AsyncDb, user_id: int) -> list[model.Portfolio]:
+    return (await db.execute(select(model.Portfolio).where(model.Portfolio.userId == user_id))).scalars().all()
+
+async def getKycByUser(db: AsyncDb, user_id: int) -> Optional[model.Kyc]:
+    return (await db.execute(select(model.Kyc).where(model.Kyc.userId == user_id))).scalar_one_or_none()
+
+# @user.get("/", response_model=schemas.UserOut)
+@user.get("/")
+async def getUserProfile(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(getUser)]):
+    # the profile is the one read that returns the whole user graph
+    return await db.get(model.User, user.id)
+
 @user.get("/all")
-async def getAllUsers(db: db):
-    return db.execute(select(model.User)).scalars().all()
+async def getAllUsers(db: AsyncDb):
+    return (await db.execute(select(model.User))).scalars().all()
 
 @user.put("/", status_code=status.HTTP_200_OK)
-async def update_user_password(password: str, db: db):
-   user = db.get(model.User, user.id)
+async def update_user_password(password: str, db: AsyncDb):
+   user = await db.get(model.User, user.id)
    if not user:
        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
    user.password = auth.hashpass(password.password)
    db.add(user)
-   db.commit()
+   await db.commit()
    return {"message": "user password updated successfully"}
 
 @user.post("/risk", status_code=status.HTTP_201_CREATED)
-async def completeRiskQuestionnaire(db: db, data: schemas.RiskProfileCreate, user: Annotated[model.User, Depends(auth.getActiveUser)]):
+async def completeRiskQuestionnaire(db: AsyncDb, data: schemas.RiskProfileCreate, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
     
-    if user.riskProfile:
+    risk_profile_exists = (await db.execute(select(model.RiskProfile.id).where(model.RiskProfile.user_id == user.id))).first()
+    if risk_profile_exists:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Risk profile already exists")
 
     capacity = await runAssesment(data)
 
-    portfolio_types = map(lambda x: x.type, user.portfolios)
-    emergency_portfolio_exists = schemas.PortfolioType.EMERGENCY not in list(portfolio_types)
+    portfolio_types = (await db.execute(select(model.Portfolio.type).where(model.Portfolio.userId == user.id))).scalars().all()
+    emergency_portfolio_exists = schemas.PortfolioType.EMERGENCY not in portfolio_types
 
     risk_profile = model.RiskProfile(**data.model_dump(exclude={"objective"}), objective=data.objective.name, user_id=user.id, capacity=capacity)
     
@@ -128,37 +151,35 @@ async def completeRiskQuestionnaire(db: db, data: schemas.RiskProfileCreate, use
 
         portfolio = model.Portfolio(userId=user.id, type=schemas.PortfolioType.EMERGENCY.name, risk=1, duration=1)
         portfolio.target = model.PortfolioTarget(amount=data.monthly_income * (3 if capacity.value == schemas.RiskLevel.HIGH.value else 6), currency=data.primary_income_currency)
-        user.tier = 2
-        user.riskProfile = risk_profile
-        user.portfolios = user.portfolios
+        await db.execute(update(model.User).where(model.User.id == user.id).values(tier=2))
+        expirePrincipal(db, user.email)
         db.add(portfolio)
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Emergency portfolio already exists")
 
     try:
         db.add(risk_profile)
-        db.add(user)
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-    return user.riskProfile
+    return risk_profile
 
 from .portfolio import getPortfolioAssets, getPortfolioValue
 
 @user.patch("/risk", response_model=schemas.RiskProfileSchema)
-async def updateRiskProfile(db: db, data: schemas.RiskProfileUpdate, user: Annotated[model.User, Depends(getUser)]):
-    risk_profile = user.riskProfile
+async def updateRiskProfile(db: AsyncDb, data: schemas.RiskProfileUpdate, user: Annotated[schemas.UserPrincipal, Depends(getUser)]):
+    risk_profile = (await db.execute(select(model.RiskProfile).where(model.RiskProfile.user_id == user.id))).scalar_one_or_none()
     if risk_profile is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Risk profile does not exist, create one first")
 
-    db.execute(update(model.RiskProfile).where(model.RiskProfile.user_id == user.id).values(**data.model_dump()))
-    db.commit()
+    await db.execute(update(model.RiskProfile).where(model.RiskProfile.user_id == user.id).values(**data.model_dump()))
+    await db.commit()
     return risk_profile
 
 @user.get("/kyc/documents")
-async def getKycDocument(db: db, user: Annotated[model.User, Depends(auth.getActiveUser)]):
+async def getKycDocument(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
 
     selfie_image = await get_file(bucket_name="user", object_name=f"{user.id}/kyc/{schemas.UserDocumentType.SELFIE.value}")
     front_id = await get_file(bucket_name="user", object_name=f"{user.id}/kyc/{schemas.UserDocumentType.FRONT_ID.value}")
@@ -173,12 +194,12 @@ async def getKycDocument(db: db, user: Annotated[model.User, Depends(auth.getAct
     }
 
 @user.post("/kyc/bvn", status_code=status.HTTP_201_CREATED)
-async def verifyBvn(db: db, user: Annotated[model.User, Security(getUser, scopes=["createUser"])], data: schemas.KycBvnCreate):
+async def verifyBvn(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["createUser"])], data: schemas.KycBvnCreate):
 
     if user.bvn is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BVN already verified")
 
-    bvn_exists = db.execute(select(model.User).where(model.User.bvn == data.bvn)).scalar_one_or_none()
+    bvn_exists = (await db.execute(select(model.User).where(model.User.bvn == data.bvn))).scalar_one_or_none()
     if bvn_exists:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BVN already in use")
 
@@ -195,16 +216,17 @@ async def verifyBvn(db: db, user: Annotated[model.User, Security(getUser, scopes
     if not verify_bvn:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BVN not verified")
 
-    db.execute(update(model.User).where(model.User.id == user.id).values(bvn=data.bvn, dateOfBirth=data.dateOfBirth))
+    await db.execute(update(model.User).where(model.User.id == user.id).values(bvn=data.bvn, dateOfBirth=data.dateOfBirth))
+    expirePrincipal(db, user.email)
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     # db.refresh(user)
     return {"message": "BVN verified successfully"}
 
-async def getUserBvn(db: db, user: Annotated[model.User, Security(getUser, scopes=["createUser"])]):
+async def getUserBvn(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["createUser"])]):
     if user.bvn is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BVN not verified")
     return user
@@ -216,10 +238,11 @@ async def validateKycDocumentFile(file: UploadFile):
     return await validate_image_file(file, allowed_file_types=ALLOWED_FILE_TYPES, allowed_extensions=ALLOWED_EXTENSIONS, max_file_size=MAX_FILE_SIZE)
 
 @user.post("/kyc/document/{type}")
-async def uploadKycDocuments(db: db, type: schemas.UserDocumentType, user: Annotated[model.User, Security(getUserBvn, scopes=["createUser"])], file = Depends(validateKycDocumentFile)):
+async def uploadKycDocuments(db: AsyncDb, type: schemas.UserDocumentType, user: Annotated[schemas.UserPrincipal, Security(getUserBvn, scopes=["createUser"])], file = Depends(validateKycDocumentFile)):
     
-    if user.kyc is not None:
-        if user.kyc.identityVerified:
+    kyc = await getKycByUser(db, user.id)
+    if kyc is not None:
+        if kyc.identityVerified:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Identity document already verified")
 
     file_name = f"{user.id}/kyc/{type.value}"
@@ -228,20 +251,20 @@ async def uploadKycDocuments(db: db, type: schemas.UserDocumentType, user: Annot
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to upload file: " + str(e))
 
-    db.commit()
+    await db.commit()
     return {"message": "File uploaded successfully", "file_path": file_path}
 
-async def getKycDocuments(db: db, user: Annotated[model.User, Security(getUserBvn, scopes=["createUser"])]):
+async def getKycDocuments(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUserBvn, scopes=["createUser"])]):
     pass
 
-async def checkKycStatus(db: db, user: Annotated[model.User, Security(getUserBvn, scopes=["createUser"])]):
-    if user.kyc:
+async def checkKycStatus(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUserBvn, scopes=["createUser"])]):
+    if await getKycByUser(db, user.id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="KYC already exists")
 
     return user
 
 @user.post("/kyc", status_code=status.HTTP_201_CREATED)
-async def createUserKyc(db: db, user: Annotated[model.User, Security(checkKycStatus, scopes=["createUser"])], data: schemas.KycCreate):
+async def createUserKyc(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(checkKycStatus, scopes=["createUser"])], data: schemas.KycCreate):
 
     # check identity document file
     try:
@@ -264,11 +287,11 @@ async def createUserKyc(db: db, user: Annotated[model.User, Security(checkKycSta
 
     db.add(kyc)
     # db.add(user_update)
-    db.commit()
+    await db.commit()
     return {"message": "KYC updated successfully"}
 
 @user.post("/kyc/address", status_code=status.HTTP_200_OK)
-async def createUserKycAddress(db: db, user: Annotated[model.User, Security(getUserBvn, scopes=["createUser"])], data: schemas.Address):
+async def createUserKycAddress(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUserBvn, scopes=["createUser"])], data: schemas.Address):
 
     # check proof of address file
     try:
@@ -281,7 +304,7 @@ async def createUserKycAddress(db: db, user: Annotated[model.User, Security(getU
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to get selfie image: " + str(e))
 
-    submitted = db.execute(update(model.Kyc).where(model.Kyc.userId == user.id).values(submitted=True).returning(model.Kyc)).scalar_one_or_none()
+    kyc = (await db.execute(update(model.Kyc).where(model.Kyc.userId == user.id).values(submitted=True).returning(model.Kyc))).scalar_one_or_none()
 
     # create anchor customer
     # result = await createAnchorCustomer(
@@ -312,7 +335,7 @@ async def createUserKycAddress(db: db, user: Annotated[model.User, Security(getU
     # create demo deposit account
     
     user_address = model.UserAddress(
-        kycId=user.kyc.id,
+        kycId=kyc.id,
         houseNumber=data.houseNumber,
         addressLineOne=data.addressLineOne,
         addressLineTwo=data.addressLineTwo,
@@ -324,19 +347,20 @@ async def createUserKycAddress(db: db, user: Annotated[model.User, Security(getU
     db.add(user_address)
 
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     return {"message": "KYC address created successfully (Anchor user created)"}
 
-async def getKycData(db: db, user: Annotated[model.User, Security(getUserBvn, scopes=["createUser"])]):
+async def getKycData(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Security(getUserBvn, scopes=["createUser"])]):
 
-    kyc_data = schemas.AnchorKycCreate(**user.kyc, firstName=user.first_name, lastName=user.last_name, middleName=user.other_names, email=user.email, phoneNumber=user.phone_number)
+    kyc = await getKycByUser(db, user.id)
+    kyc_data = schemas.AnchorKycCreate(**kyc, firstName=user.first_name, lastName=user.last_name, middleName=user.other_names, email=user.email, phoneNumber=user.phone_number)
     return {"kyc_data": kyc_data, "user_id": user.id}
 
 @user.post("/kyc/validate")
-async def validateKyc(db: db, kyc_data: Annotated[dict, Depends(getKycData)]):
+async def validateKyc(db: AsyncDb, kyc_data: Annotated[dict, Depends(getKycData)]):
     
     result = await createAnchorCustomer(**kyc_data.get("kyc_data").model_dump())
     if result.status_code not in [200, 201]:
@@ -344,13 +368,13 @@ async def validateKyc(db: db, kyc_data: Annotated[dict, Depends(getKycData)]):
     return {"message": "KYC validated successfully (Anchor customer created)"}
 
 @user.patch("/kyc")
-async def updateUserKyc(db: db, data: schemas.KycUpdate, user: Annotated[model.User, Security(getUser, scopes=["createUser"])]):
-    if user.kyc:
-        db.execute(update(model.Kyc).where(model.Kyc.user_id == user.id).values(**data.model_dump()))
+async def updateUserKyc(db: AsyncDb, data: schemas.KycUpdate, user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["createUser"])]):
+    if await getKycByUser(db, user.id):
+        await db.execute(update(model.Kyc).where(model.Kyc.user_id == user.id).values(**data.model_dump()))
         try:
-            db.commit()
+            await db.commit()
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
         return {"message": "KYC updated successfully"}
     else:
@@ -359,12 +383,13 @@ async def updateUserKyc(db: db, data: schemas.KycUpdate, user: Annotated[model.U
 @user.get("/anchor/account")
 
 @user.get("/value")
-async def get_user_value(db: db, user = Depends(auth.getActiveUser)):
+async def get_user_value(db: ReadDb, user = Depends(auth.getActiveUser)):
     
     total_usd = 0       
     total_ngn = 0
 
-    for portfolio in user.portfolios:
+    portfolios = await getPortfoliosByUser(db, user.id)
+    for portfolio in portfolios:
         portfolio_value = await getPortfolioValue(db, assets=await getPortfolioAssets(db, portfolio=portfolio))
         total_usd += portfolio_value.get("totalValueUsd", 0.00)
         total_ngn += portfolio_value.get("totalValueNgn", 0.00)
@@ -377,15 +402,15 @@ async def get_user_value(db: db, user = Depends(auth.getActiveUser)):
         "totalNgn": total_ngn,
         "inUsd": total_usd + (total_ngn/1600),
         "inNgn": total_ngn + (total_usd*1600),
-        "holdings_count": len(user.portfolios),
-        "active_deposits_count": len(user.portfolios),
+        "holdings_count": len(portfolios),
+        "active_deposits_count": len(portfolios),
         "calculation_date": datetime.now().isoformat()
     }
 
 @user.post("/kyc/upload")
 async def uploadKycFile(
     type: schemas.UserDocumentType, 
-    user: Annotated[model.User, Security(getUser, scopes=["createUser"])],
+    user: Annotated[schemas.UserPrincipal, Security(getUser, scopes=["createUser"])],
     file: UploadFile = File()):
 
     # Validate the uploaded file
@@ -396,13 +421,15 @@ async def uploadKycFile(
     return {"message": "File uploaded successfully", "file_path": file_path}
 
 @user.get("/kyc")
-async def getUserKyc(user: Annotated[model.User, Depends(auth.getActiveUser)]):
+async def getUserKyc(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
+    user = await getUserWith(db, user.id, model.User.kyc)
     if user.kyc is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="KYC not found")
     return user
 
-async def checkKycVerification(user: Annotated[model.User, Depends(auth.getActiveUser)]):
-    if user.kyc.identityVerified is False and user.kyc.verified is False:
+async def checkKycVerification(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
+    kyc = await getKycByUser(db, user.id)
+    if kyc is None or (kyc.identityVerified is False and kyc.verified is False):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="KYC not verified")
     return user
 
@@ -437,10 +464,10 @@ async def getFileAsBase64(user_id: str, type: schemas.UserDocumentType):
         }
 
 @user.get("/value")
-async def getUserValue(db: db, user = Depends(auth.getActiveUser)):
+async def getUserValue(db: ReadDb, user = Depends(auth.getActiveUser)):
     total_value_ngn = 0
     total_value_usd = 0
-    for portfolio in user.portfolios:
+    for portfolio in await getPortfoliosByUser(db, user.id):
         portfolio_assets = await getPortfolioAssets(db, portfolio=portfolio)
         portfolio_value = await getPortfolioValue(db=db, assets=portfolio_assets)
         total_value_ngn += portfolio_value.get("totalValueNgn")
@@ -452,7 +479,9 @@ async def getUserValue(db: db, user = Depends(auth.getActiveUser)):
     }
 
 @user.get("/risk-profile")
-async def getUserRiskProfile(db: db, user: Annotated[model.User, Depends(auth.getActiveUser)]):
+async def getUserRiskProfile(db: AsyncDb, user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)]):
+    # the advisory endpoints build on this user and read its portfolios alongside the risk profile
+    user = await getUserWith(db, user.id, model.User.riskProfile, model.User.portfolios)
     if user.riskProfile is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Risk profile not found")
     return user
\ No newline at end of file
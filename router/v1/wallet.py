@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status, Security
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, status, Security
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from database import db
+from database import AsyncDb, ReadSessionMaker
 import model
 import schemas
 from utils.anchor import getAnchorBalance
@@ -10,6 +11,12 @@ from typing import Annotated, Optional
 from sqlalchemy import select, func, case
 from datetime import datetime
 from ..v1.journal import prepareJournal
+from utils.ledger import postJournal
+from utils.wallet import getWalletBalanceRow, applyWalletTransactions
+from utils.minio import upload_file
+from utils.outbox import enqueueTask
+from utils.export import streamExport, getExportHeaders, export_media_types
+from config import settings
 from ..v1.user import checkKycVerification, getUser
 
 wallet = APIRouter(
@@ -19,31 +26,33 @@ wallet = APIRouter(
 
 @wallet.post('/')
 async def createWallet(
-  db: db,
+  db: AsyncDb,
   walletGroupId: int,
-  user: Annotated[model.User, Depends(checkKycVerification)]):
+  user: Annotated[schemas.UserPrincipal, Depends(checkKycVerification)]):
 
-  wallet = db.execute(select(model.Wallet).where(model.Wallet.userId == user.id, model.Wallet.walletGroupId == walletGroupId)).scalar_one_or_none()
+  wallet = (await db.execute(select(model.Wallet).where(model.Wallet.userId == user.id, model.Wallet.walletGroupId == walletGroupId))).scalar_one_or_none()
 
   if wallet is not None:
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wallet already exists")
   else: 
     new_wallet = model.Wallet(userId=user.id, walletGroupId=walletGroupId)
     db.add(new_wallet)
-    db.commit()
-    db.refresh(new_wallet)
+    await db.flush()
+    db.add(model.WalletBalance(walletId=new_wallet.id))
+    await db.commit()
+    await db.refresh(new_wallet)
     return new_wallet
 
 @wallet.get('/')
 async def getUserWallet(
-  db: db,
+  db: AsyncDb,
   # kyc: Annotated[model.Kyc, Depends(checkKycVerification)],
   # walletId: int,
   ):
 
   # wallet = db.execute(select(model.Wallet).where(model.Wallet.userId == user.id, model.Wallet.id == walletId)).scalar_one_or_none()
 
-  anchor_account = db.execute(select(model.AnchorAccount).join(model.AnchorUser).where(model.AnchorUser.userId == 1)).scalar_one_or_none()
+  anchor_account = (await db.execute(select(model.AnchorAccount).join(model.AnchorUser).where(model.AnchorUser.userId == 1))).scalar_one_or_none()
   if anchor_account is None:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Anchor account not found")
 
@@ -53,130 +62,128 @@ class WalletBalanceStore(BaseModel):
   balance: float
   last_request: datetime
 
+async def getWallet(
+  db: AsyncDb,
+  walletId: int,
+  user: Annotated[schemas.UserPrincipal, Depends(auth.getActiveUser)],
+):
+  # only the caller's own wallets; another user's id is reported as missing
+  wallet = (await db.execute(select(model.Wallet).where(model.Wallet.id == walletId, model.Wallet.userId == user.id))).scalar_one_or_none()
+  if wallet is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+  return wallet
+
 @wallet.get('/balance')
 async def getWalletBalance(
-  db: db,
-  wallet: Annotated[model.AnchorAccount, Depends(getUserWallet)],
-  last_request: Optional[datetime] = None
+  db: AsyncDb,
+  wallet: Annotated[model.Wallet, Depends(getWallet)],
 ):
 
-  # balance_request = await getAnchorBalance(account_number=wallet.depositAccountId)
-  # if balance_request.status_code != 200:
-  #   raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=balance_request.json())
-
-  # balance = schemas.AnchorBalanceResponse(**balance_request.json())
-  # return balance
+  # one row kept in step with every wallet transaction; version lets a later debit detect a stale read
+  balance = await db.run_sync(getWalletBalanceRow, wallet.id)
+  available = balance.available if balance else 0
+  ledger = balance.ledger if balance else 0
+  hold = balance.hold if balance else 0
   return {
-    "availableBalance": 10000000000.00,
-    "ledgerBalance": 10000000000.00,
-    "hold": 0.00,
-    "pending": 0.00,
+    "walletId": wallet.id,
+    "currency": wallet.walletGroup.currency,
+    "availableBalance": available / 100,
+    "ledgerBalance": ledger / 100,
+    "hold": hold / 100,
+    "pending": (ledger - available - hold) / 100,
+    "version": balance.version if balance else 0,
   }
 
-#   net_inflow_query = (
-#     select(
-#         func.sum(
-#             case(
-#                 (model.WalletTransaction.type == schemas.TransactionType.INVESTMENT.name, -model.WalletTransaction.amount),
-#                 (model.WalletTransaction.type == schemas.TransactionType.LIQUIDATION.name, model.WalletTransaction.amount),
-#                 (model.WalletTransaction.type == schemas.TransactionType.FEE.name, -model.WalletTransaction.amount),
-#                 (model.WalletTransaction.type == schemas.TransactionType.TAX.name, -model.WalletTransaction.amount),
-#                 (model.WalletTransaction.type == schemas.TransactionType.DEPOSIT.name, model.WalletTransaction.amount),
-#                 (model.WalletTransaction.type == schemas.TransactionType.WITHDRAWAL.name, -model.WalletTransaction.amount),
-#                 else_=0
-#             )
-#         ).label("net_inflow")
-#     )
-#     .where(model.WalletTransaction.walletId == wallet.id, model.WalletTransaction.status == schemas.TransactionStatus.COMPLETED)
-# )
-
-#   net_inflow = db.execute(net_inflow_query).scalar()
-#   net_inflow = 0 if net_inflow is None else net_inflow
-#   return {
-#     "balance": float(net_inflow / 100),
-#     "last_request": datetime.now(),
-#     "wallet": wallet,
-#   }
-
 @wallet.get('/transactions')
 async def getWalletTransactions(
-  db: db,
-  wallet: Annotated[model.Wallet, Depends(getUserWallet)],
+  db: AsyncDb,
+  wallet: Annotated[model.Wallet, Depends(getWallet)],
   status: Annotated[Optional[schemas.TransactionStatus], Query()] = None,
 ):
   base_query = select(model.WalletTransaction).where(model.WalletTransaction.walletId == wallet.id).order_by(model.WalletTransaction.date.desc())  
-  transactions = db.execute(base_query).scalars().all()
   if status:
     base_query = base_query.where(model.WalletTransaction.status == status)
-  transactions = db.execute(base_query).scalars().all()
+  transactions = (await db.execute(base_query)).scalars().all()
   return transactions
 
+@wallet.get('/transactions/export')
+async def exportWalletTransactions(
+  wallet: Annotated[model.Wallet, Depends(getWallet)],
+  session_factory: ReadSessionMaker,
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None,
+  format: schemas.ExportFormat = schemas.ExportFormat.CSV,
+):
+  """
+  Stream a wallet's transactions as a CSV or Parquet statement, oldest first; amounts in minor units
+  """
+  query = select(
+    model.WalletTransaction.id,
+    model.WalletTransaction.date,
+    model.WalletTransaction.type,
+    model.WalletTransaction.status,
+    model.WalletTransaction.amount,
+    model.WalletTransaction.settled,
+    model.WalletTransaction.settledAt,
+    model.WalletTransaction.reference,
+    model.WalletTransaction.journalId,
+  ).where(model.WalletTransaction.walletId == wallet.id)
+  if start:
+    query = query.where(model.WalletTransaction.date >= start)
+  if end:
+    query = query.where(model.WalletTransaction.date < end)
+  query = query.order_by(model.WalletTransaction.date, model.WalletTransaction.id)
+
+  return StreamingResponse(
+    streamExport(session_factory, query, format),
+    media_type=export_media_types[format],
+    headers=getExportHeaders(f"wallet_{wallet.id}_transactions", format),
+  )
+
 async def generateWalletTransaction(
     amount: float,
     type: schemas.TransactionType,
-    db: db,
+    db: AsyncDb,
     wallet: model.Wallet,
-    date: datetime
+    date: datetime,
+    reference: Optional[str] = None,
 ):
 
     amount = int(amount * 100)
     if wallet.active == False:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wallet is not active")
-    
-    if type in [schemas.TransactionType.INVESTMENT, schemas.TransactionType.WITHDRAWAL]:
-      # get current balance
-      balance = await getWalletBalance(db=db, wallet=wallet)
-      # check if balance is sufficient
-      if balance.get("balance") < amount:
-          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
-    # create transaction journal
-    transaction_journal = model.Journal(date=date)
-
     funding_account_id = wallet.walletGroup.receivableAccountId if type == schemas.TransactionType.DEPOSIT or type == schemas.TransactionType.LIQUIDATION else 15
     wallet_account_id = wallet.walletGroup.holdingAccountId
 
     funding_entry_type = schemas.EntrySide.DEBIT if type == schemas.TransactionType.DEPOSIT or type == schemas.TransactionType.LIQUIDATION else schemas.EntrySide.CREDIT
     wallet_entry_type = schemas.EntrySide.CREDIT if type == schemas.TransactionType.DEPOSIT or type == schemas.TransactionType.LIQUIDATION else schemas.EntrySide.DEBIT
-    
-    # funding account entry
-    funding_account_entry = model.JournalEntry(
-        accountId=funding_account_id,
-        amount=amount,
-        side=funding_entry_type,
-        description=f"Wallet: {wallet.id} - {type.value} transaction"
-    )
-
-    # wallet account entry
-    wallet_account_entry = model.JournalEntry(
-        accountId=wallet_account_id,
-        amount=amount,
-        side=wallet_entry_type,
-        description=f"Wallet: {wallet.id} - {type.value} transaction"
-    )
-
-    if wallet_account_entry.amount != funding_account_entry.amount:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount mismatch")
-
-    transaction_journal.entries.append(wallet_account_entry)
-    transaction_journal.entries.append(funding_account_entry)
-    db.add(transaction_journal)
-
-    wallet_trx = model.WalletTransaction(amount=amount, type=type, status=schemas.TransactionStatus.COMPLETED, walletId=wallet.id, date=date)
+    description = f"Wallet: {wallet.id} - {type.value} transaction"
+
+    # post the transaction journal: wallet account and funding account entries
+    journal_id = await db.run_sync(postJournal, date, [
+        {"accountId": wallet_account_id, "amount": amount, "side": wallet_entry_type, "description": description},
+        {"accountId": funding_account_id, "amount": amount, "side": funding_entry_type, "description": description},
+    ])
+
+    wallet_trx = model.WalletTransaction(amount=amount, type=type, status=schemas.TransactionStatus.COMPLETED, walletId=wallet.id, date=date, reference=reference)
     wallet_trx.settled = True if type not in [schemas.TransactionType.DEPOSIT, schemas.TransactionType.LIQUIDATION] else False
-    wallet_trx.journal = transaction_journal
+    wallet_trx.journalId = journal_id
     db.add(wallet_trx)
-    db.commit()
-    db.refresh(wallet_trx)
+    # debits are checked against the balance row in the same conditional update that applies them
+    await db.run_sync(applyWalletTransactions, [{"walletId": wallet.id, "amount": amount, "type": type, "settled": wallet_trx.settled}])
+    await db.commit()
+    await db.refresh(wallet_trx)
 
     return {"transaction": wallet_trx, "message": "Transaction initialized"}
 
 @wallet.post('/transaction')
 async def postWalletTransaction(
-  db: db,
+  db: AsyncDb,
   amount: float,
   type: schemas.TransactionType,
-  wallet: Annotated[model.Wallet, Security(getUserWallet, scopes=["createUser"])],
+  wallet: Annotated[model.Wallet, Security(getWallet, scopes=["createUser"])],
   date: Annotated[datetime, Query(le=datetime.now(), description="Transaction date")] = datetime.now(),
+  reference: Annotated[Optional[str], Query(description="Bank or payment reference")] = None,
 ):
 
   return await generateWalletTransaction(
@@ -184,16 +191,81 @@ async def postWalletTransaction(
     type=type, 
     db=db, 
     wallet=wallet, 
-    date=date)
+    date=date,
+    reference=reference)
 
 @wallet.post('/group')
 async def createWalletGroup(
-  db: db,
+  db: AsyncDb,
   walletGroupData: schemas.WalletGroupCreate
 ):
   
   new_wallet_group = model.WalletGroup(**walletGroupData.model_dump())
   db.add(new_wallet_group)
-  db.commit()
-  db.refresh(new_wallet_group)
-  return new_wallet_group
\ No newline at end of file
+  await db.commit()
+  await db.refresh(new_wallet_group)
+  return new_wallet_group
+@wallet.post('/reconciliation')
+async def createReconciliation(
+  db: AsyncDb,
+  walletGroupId: int,
+  start: datetime,
+  end: datetime,
+  file: Optional[UploadFile] = None,
+  accountId: Annotated[Optional[str], Query(description="Anchor deposit account to read the statement from when no file is uploaded")] = None,
+):
+  """
+  Reconcile a wallet group's bank statement for [start, end) against its wallet transactions and journals.
+
+  The statement is either an uploaded CSV (reference, amount, date, direction) in date order or read from the
+  Anchor statement API. Matching runs in the background; poll the run for its breaks.
+  """
+  if await db.get(model.WalletGroup, walletGroupId) is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet group not found")
+  if file is None and accountId is None:
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload a statement file or give an Anchor account")
+
+  if file is not None:
+    source = f"{walletGroupId}/{datetime.now():%Y%m%d%H%M%S}_{file.filename}"
+    await upload_file(bucket_name=settings.RECONCILIATION_BUCKET, file_object=file.file, file_name=source, content_type=file.content_type or "text/csv")
+  else:
+    source = f"anchor:{accountId}"
+
+  run = model.ReconciliationRun(walletGroupId=walletGroupId, source=source, start=start, end=end)
+  db.add(run)
+  await db.flush()
+  await db.run_sync(enqueueTask, "reconcile_statement_task", run_id=run.id)
+  await db.commit()
+  await db.refresh(run)
+  return run
+
+@wallet.get('/reconciliation/{run_id}')
+async def getReconciliation(db: AsyncDb, run_id: int):
+  run = await db.get(model.ReconciliationRun, run_id)
+  if run is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reconciliation run not found")
+  breaks = (await db.execute(
+    select(model.ReconciliationBreak.type, func.count(), func.sum(model.ReconciliationBreak.amount))
+    .where(model.ReconciliationBreak.runId == run_id)
+    .group_by(model.ReconciliationBreak.type)
+  )).all()
+  return {
+    "run": run,
+    "breaks": {type.value: {"count": count, "amount": int(amount or 0) / 100} for type, count, amount in breaks},
+  }
+
+@wallet.get('/reconciliation/{run_id}/breaks')
+async def getReconciliationBreaks(
+  db: AsyncDb,
+  run_id: int,
+  type: Annotated[Optional[schemas.ReconciliationBreakType], Query()] = None,
+  limit: Annotated[int, Query(le=1000)] = 100,
+  afterId: int = 0,
+):
+  """
+  A page of a run's breaks in id order; pass the last id seen as afterId for the next page
+  """
+  query = select(model.ReconciliationBreak).where(model.ReconciliationBreak.runId == run_id, model.ReconciliationBreak.id > afterId)
+  if type is not None:
+    query = query.where(model.ReconciliationBreak.type == type)
+  return (await db.execute(query.order_by(model.ReconciliationBreak.id).limit(limit))).scalars().all()
@@ -366,6 +366,7 @@ class TransactionType(enum.Enum):
     TRANSFER = "transfer"
     BUY = "buy"
     SELL = "sell"
+    REFUND = "refund" # purchase funds given back to the wallet
 
 class PortfolioType(enum.Enum):
     TARGET = "target"
@@ -408,6 +409,27 @@ class TransactionStatus(enum.Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class IntegrityViolationType(enum.Enum):
+    UNBALANCED_JOURNAL = "unbalanced_journal" # debits and credits differ
+    WALLET_MISMATCH = "wallet_mismatch" # wallet transactions disagree with the journal's holding account entries
+    PORTFOLIO_LEDGER_MISMATCH = "portfolio_ledger_mismatch" # a day's portfolio asset ledgers disagree with the asset account
+
+class ExportFormat(enum.Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+
+class ReconciliationBreakType(enum.Enum):
+    STATEMENT_ONLY = "statement_only" # on the bank statement, no wallet transaction
+    WALLET_ONLY = "wallet_only" # wallet transaction missing from the statement
+    AMOUNT_MISMATCH = "amount_mismatch" # same reference, different amount or direction
+    JOURNAL_MISMATCH = "journal_mismatch" # wallet transactions disagree with the holding account entries of their journal
+
+class TransactionVenue(enum.Enum):
+    NG_MUTUAL_FUND = "ng_mutual_fund"
+    NG_DEPOSIT = "ng_deposit"
+    US_EQUITY = "us_equity"
+    NGX_EQUITY = "ngx_equity"
+
 class AccountType(enum.Enum):
     ASSET = "asset"
     LIABILITY = "liability"
@@ -634,6 +656,17 @@ class VariableAttributesCreate(BaseModel):
     minAmount: Optional[int] = None
     divYield: Optional[int] = None
 
+class VariableDistributionCreate(BaseModel):
+    amountPerUnit: int # in money value (100 = 1 currency unit)
+    recordDate: datetime
+    paymentDate: Optional[datetime] = None
+
+    @model_validator(mode='after')
+    def validate_payment_date(self):
+        if self.paymentDate is not None and self.paymentDate < self.recordDate:
+            raise ValueError("Payment date cannot be before the record date")
+        return self
+
 class DepositCreate(ProductCreate):
     minTenor: int
     maxTenor: int
@@ -743,6 +776,20 @@ class UserSchema(UserBase):
     class Config:
         from_attributes = True
 
+class UserPrincipal(UserBase):
+    """
+    The authenticated user as the auth dependencies hand it to handlers: user columns only, no relationships
+    """
+    id: int
+    email: str
+    is_active: bool
+    tier: Optional[int]
+    bvn: Optional[str] = None
+    dateOfBirth: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 
 class RiskProfileBase(BaseModel):
     is_single: bool
@@ -812,7 +859,9 @@ class CommitmentCreate(BaseModel):
     amount: float
     currency: Currency
     frequency: Frequency
+    productId: int # product bought with each contribution
     startDate: Optional[datetime] = datetime.now()
+    tenor: Optional[int] = None # deposit tenor in days, required for deposit products
 
 class AllocationCreate(BaseModel):
   targetAllocation: float
@@ -821,10 +870,12 @@ class AllocationCreate(BaseModel):
 class PortfolioObjectiveCreate(BaseModel):
   target: Optional[TargetCreate] = None
   income: Optional[IncomeCreate] = None
+  commitment: Optional[CommitmentCreate] = None
 
 class PortfolioCreate(PortfolioBase):
     target: Optional[TargetCreate] = None
     income: Optional[IncomeCreate] = None
+    commitment: Optional[CommitmentCreate] = None
 
 class AccountBase(BaseModel):
     account_type: AccountType
@@ -858,10 +909,15 @@ class WalletTransactionCreate(WalletTransactionBase):
     pass
 
 class JournalEntries(BaseModel):
-    amount: float
+    amount: int # in minor units (100 = 1 currency unit)
     account_id: int
     description: Optional[str] = None
 
+class JournalCreate(BaseModel):
+    date: Optional[datetime] = None
+    credit: list[JournalEntries]
+    debit: list[JournalEntries]
+
 class WalletTransactionSchema(WalletTransactionBase):
     id: int
     journal: JournalEntries
@@ -0,0 +1,118 @@
+"""
+Integrity checks against a real Postgres database: the partitioned ledgers and the grouped checks need it.
+
+Set TEST_DATABASE_URL to a database the tests may write to; the app settings still come from .env.
+Each run works in its own schema and drops it afterwards.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+from utils.deposit import accrueDepositInterest, processMaturities
+from utils.integrity import checkPortfolioLedgers
+from utils.ledger import postJournal
+from utils.partition import ensurePartitions
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set")
+
+@pytest.fixture
+def db():
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    engine = create_engine(os.environ["TEST_DATABASE_URL"], connect_args={"options": f"-csearch_path={schema}"})
+    with engine.begin() as connection:
+        connection.execute(text(f'CREATE SCHEMA "{schema}"'))
+    model.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        ensurePartitions(session, 1)
+        session.commit()
+        yield session
+    with engine.begin() as connection:
+        connection.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+    engine.dispose()
+
+def addAccount(db: Session, id: int, name: str, account_type: schemas.AccountType) -> int:
+    db.add(model.Account(id=id, code=id, name=name, currency=schemas.Currency.NGN, account_type=account_type))
+    return id
+
+def placeDeposit(db: Session, portfolio_id: int, product: model.Deposit, principal: int, date: datetime, effective: datetime, maturity: datetime, rollover: bool) -> None:
+    """
+    Book a placement the way settlement does: an ASSET IN ledger and a debit to the product group's asset account
+    """
+    batch = model.TransactionBatch(executed=True)
+    db.add(batch)
+    db.flush()
+    transaction = model.DepositTransaction(
+        portfolioId=portfolio_id, productId=product.id, type=schemas.TransactionType.INVESTMENT, amount=principal,
+        status=schemas.TransactionStatus.COMPLETED, settlement=schemas.TransactionStatus.COMPLETED, batchId=batch.id,
+        rate=product.rate, tenor=(maturity - effective).days,
+    )
+    db.add(transaction)
+    db.flush()
+    journal_id = postJournal(db, date, [
+        {"accountId": product.productGroup.assetAccountId, "amount": principal, "side": schemas.EntrySide.DEBIT, "description": "Deposit placement"},
+        {"accountId": product.productGroup.receivableAccountId, "amount": principal, "side": schemas.EntrySide.CREDIT, "description": "Deposit placement"},
+    ])
+    deposit = model.PortfolioDeposit(transactionId=transaction.id, effectiveDate=effective, maturityDate=maturity, isActive=True, rollover=rollover, journalId=journal_id)
+    db.add(deposit)
+    db.flush()
+    db.execute(insert(model.DepositLedger), [{
+        "portfolioId": portfolio_id, "portfolioDepositId": deposit.id, "transactionId": transaction.id,
+        "side": schemas.UserLedgerSide.IN, "amount": principal, "date": date, "account": schemas.PortfolioAccount.ASSET,
+    }])
+
+def runOn(monkeypatch, day: datetime) -> None:
+    """
+    Stamp the deposit jobs' ledgers and journals with a time on another day, as if they had run then
+    """
+    class RunDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return day + timedelta(hours=12)
+    monkeypatch.setattr("utils.deposit.datetime", RunDatetime)
+
+def test_accrual_and_maturity_leave_portfolio_ledgers_balanced(db, monkeypatch):
+    asset = addAccount(db, 1, "Deposit placements", schemas.AccountType.ASSET)
+    receivable = addAccount(db, 2, "Deposit receivable", schemas.AccountType.ASSET)
+    payable = addAccount(db, 3, "Deposit interest payable", schemas.AccountType.LIABILITY)
+    wallet_receivable = addAccount(db, 4, "Wallet receivable", schemas.AccountType.ASSET)
+    holding = addAccount(db, 5, "Wallet holding", schemas.AccountType.LIABILITY)
+    addAccount(db, settings.WITHHOLDING_TAX_ACCOUNT_ID, "Withholding tax", schemas.AccountType.LIABILITY)
+    db.flush()
+
+    group = model.ProductGroup(name="Deposits", market=list(schemas.Country)[0], assetAccountId=asset, receivableAccountId=receivable, payableAccountId=payable)
+    issuer = model.Issuer(name="Issuer")
+    benchmark = model.Benchmark(title="Benchmark", currency=schemas.Currency.NGN, symbol="BM")
+    user = model.User(email="holder@example.com", first_name="Ada", last_name="Holder", phone_number="0800000000")
+    db.add_all([group, issuer, benchmark, user])
+    db.flush()
+    product = model.Deposit(
+        title="Fixed deposit", issuerId=issuer.id, productGroupId=group.id, benchmarkId=benchmark.id, riskLevel=1, horizon=1,
+        currency=schemas.Currency.NGN, assetClass=schemas.AssetClassType.FIXED_INCOME, productClass=schemas.ProductClass.DEPOSIT,
+        minTenor=30, maxTenor=365, interestPay=schemas.InterestPay.MONTHLY, rate=1500, isActive=True,
+    )
+    portfolio = model.Portfolio(userId=user.id)
+    wallet_group = model.WalletGroup(name="NGN wallets", currency=schemas.Currency.NGN, receivableAccountId=wallet_receivable, holdingAccountId=holding)
+    db.add_all([product, portfolio, wallet_group])
+    db.flush()
+    db.add(model.Wallet(userId=user.id, walletGroupId=wallet_group.id))
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    effective = today - timedelta(days=30)
+    placed = today - timedelta(days=2)
+    placeDeposit(db, portfolio.id, product, 10_000_000, placed, effective, today, rollover=False)
+    placeDeposit(db, portfolio.id, product, 25_000_000, placed, effective, today, rollover=True)
+    db.commit()
+
+    # each step on its own day, so no day's totals can hide another's: accrue up to yesterday,
+    # then mature today, which accrues the last day first
+    runOn(monkeypatch, today - timedelta(days=1))
+    assert accrueDepositInterest(db, today - timedelta(days=2)) == {"deposits": 2, "accrued": 2}
+    runOn(monkeypatch, today)
+    assert processMaturities(db, today) == {"deposits": 2, "paid": 1, "rolled": 1}
+
+    assert checkPortfolioLedgers(db, placed, today + timedelta(days=1)) == 0
@@ -152,4 +152,18 @@ async def getAnchorBalance(account_number: str):
     "x-anchor-key": anchor_api_key_sandbox
   }
   response = requests.get(request_url, headers=headers)
-  return response
\ No newline at end of file
+  return response
+def getAnchorStatement(account_id: str, start: str, end: str, page: int, size: int):
+  """
+  One page of an account's transactions; RECONCILIATION_STATEMENT_URL points this at a local stand-in
+  """
+  request_url = f"{settings.RECONCILIATION_STATEMENT_URL or url_sandbox}/transactions"
+  headers = {
+    "accept": "application/json",
+    "content-type": "application/json",
+    "x-anchor-key": anchor_api_key_sandbox
+  }
+  params = {"accountId": account_id, "from": start, "to": end, "page": page, "size": size}
+  response = requests.get(request_url, headers=headers, params=params, timeout=30)
+  response.raise_for_status()
+  return response.json()
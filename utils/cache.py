@@ -0,0 +1,42 @@
+import json
+import logging
+from typing import Any, Optional
+import redis
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+
+# the cache is an optimisation: a redis outage degrades to a miss, never to an error
+
+def getCached(key: str) -> Optional[Any]:
+    try:
+        value = redis_client.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"Cache read failed for {key}: {str(e)}")
+        return None
+    return json.loads(value) if value is not None else None
+
+def setCached(key: str, value: Any, ttl: int) -> None:
+    try:
+        redis_client.set(key, json.dumps(value, default=str), ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+def deleteCached(pattern: str) -> int:
+    """
+    Delete every key matching a glob pattern
+    """
+    try:
+        keys = list(redis_client.scan_iter(match=pattern, count=500))
+        return redis_client.delete(*keys) if keys else 0
+    except redis.RedisError as e:
+        logger.warning(f"Cache delete failed for {pattern}: {str(e)}")
+        return 0
+
+def evictCached(key: str) -> None:
+    try:
+        redis_client.delete(key)
+    except redis.RedisError as e:
+        logger.warning(f"Cache delete failed for {key}: {str(e)}")
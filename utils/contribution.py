@@ -0,0 +1,216 @@
+import logging
+import uuid
+from datetime import datetime
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session, selectinload
+from config import settings
+import model
+import schemas
+from utils.ledger import postJournal
+from utils.outbox import enqueueTask
+from utils.payment_schedule import next_schedule_date
+from utils.wallet import getWalletBalances, placeHolds
+
+logger = logging.getLogger(__name__)
+
+def claimDuePlans(db: Session, shard: int, shards: int, as_of: datetime, after_id: int, chunk_size: int) -> list:
+    """
+    Claim a chunk of due plans in one shard. SKIP LOCKED lets any number of workers drain the same shard.
+    """
+    return db.execute(
+        select(
+            model.PortfolioContributionPlan.id,
+            model.PortfolioContributionPlan.portfolioId,
+            model.PortfolioContributionPlan.amount,
+            model.PortfolioContributionPlan.currency,
+            model.PortfolioContributionPlan.frequency,
+            model.PortfolioContributionPlan.nextContributionDate,
+            model.PortfolioContributionPlan.productId,
+            model.PortfolioContributionPlan.tenor,
+            model.Portfolio.userId,
+        )
+        .join(model.Portfolio, model.Portfolio.id == model.PortfolioContributionPlan.portfolioId)
+        .where(
+            model.PortfolioContributionPlan.id > after_id,
+            model.PortfolioContributionPlan.id % shards == shard,
+            model.PortfolioContributionPlan.nextContributionDate <= as_of,
+            model.PortfolioContributionPlan.frequency != schemas.Frequency.NONE,
+            model.PortfolioContributionPlan.productId != None,
+            model.Portfolio.active == True,
+            model.Portfolio.deleted == False,
+        )
+        .order_by(model.PortfolioContributionPlan.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True, of=model.PortfolioContributionPlan)
+    ).mappings().all()
+
+def getLatestPrices(db: Session, product_ids: list[int]) -> dict[int, int]:
+    """
+    Latest stored price per variable in minor units
+    """
+    if not product_ids:
+        return {}
+    rows = db.execute(
+        select(model.VariableValue.variableId, model.VariableValue.price)
+        .where(model.VariableValue.variableId.in_(product_ids))
+        .distinct(model.VariableValue.variableId)
+        .order_by(model.VariableValue.variableId, model.VariableValue.date.desc())
+    ).all()
+    return {variable_id: price for variable_id, price in rows}
+
+def getNextContributionDate(date: datetime, frequency: schemas.Frequency, as_of: datetime) -> datetime:
+    # a plan that fell behind contributes once and moves to its next future date
+    while date <= as_of:
+        date = next_schedule_date(date, frequency.value)
+    return date
+
+def processContributionChunk(db: Session, plans: list, as_of: datetime) -> dict:
+    """
+    Book one chunk of due contributions in bulk: wallet debits, one aggregated journal,
+    pending purchase orders in a single batch and the plans' next dates. The caller commits.
+    """
+    products = {
+        product.id: product
+        for product in db.execute(
+            select(model.Product)
+            .where(model.Product.id.in_({plan["productId"] for plan in plans}))
+            .options(selectinload(model.Product.productGroup))
+        ).scalars().all()
+    }
+    prices = getLatestPrices(db, [product.id for product in products.values() if product.category == "variable"])
+    wallets = {
+        (user_id, currency): wallet_id
+        for wallet_id, user_id, currency in db.execute(
+            select(model.Wallet.id, model.Wallet.userId, model.WalletGroup.currency)
+            .join(model.WalletGroup, model.WalletGroup.id == model.Wallet.walletGroupId)
+            .where(model.Wallet.userId.in_({plan["userId"] for plan in plans}), model.Wallet.active == True)
+        ).all()
+    }
+    # locked so the balance checks below hold until the chunk commits
+    balances = getWalletBalances(db, list(wallets.values()), lock=True)
+
+    date = datetime.now()
+    orders = []
+    plan_updates = []
+    for plan in plans:
+        product = products.get(plan["productId"])
+        wallet_id = wallets.get((plan["userId"], plan["currency"]))
+        accounting_amount = plan["amount"] * 1470 if plan["currency"] == schemas.Currency.USD else plan["amount"]
+        price = prices.get(product.id) if product is not None else None
+
+        error = None
+        if product is None or wallet_id is None:
+            error = "product or wallet not found"
+        elif product.category == "variable" and not price:
+            error = "no price for product"
+        elif balances.get(wallet_id, 0) < accounting_amount:
+            error = "insufficient wallet balance"
+
+        if error is None:
+            balances[wallet_id] = balances.get(wallet_id, 0) - accounting_amount
+            orders.append({"plan": plan, "product": product, "walletId": wallet_id, "amount": accounting_amount, "price": price})
+        else:
+            logger.warning(f"Contribution plan {plan['id']} skipped: {error}")
+
+        plan_updates.append({
+            "id": plan["id"],
+            "nextContributionDate": getNextContributionDate(plan["nextContributionDate"], plan["frequency"], as_of),
+            "lastContributionDate": date,
+            "lastContributionStatus": schemas.TransactionStatus.PENDING if error is None else schemas.TransactionStatus.FAILED,
+        })
+
+    if plan_updates:
+        db.execute(update(model.PortfolioContributionPlan), plan_updates)
+    if not orders:
+        return {"plans": len(plans), "orders": 0}
+
+    # debit wallets against each product group's receivable in one journal
+    receivables = {}
+    for order in orders:
+        account_id = order["product"].productGroup.receivableAccountId
+        receivables[account_id] = receivables.get(account_id, 0) + order["amount"]
+    description = f"Recurring contributions {date.date()}"
+    journal_id = postJournal(db, date, [
+        {"accountId": 10, "amount": sum(receivables.values()), "side": schemas.EntrySide.DEBIT, "description": description},
+    ] + [
+        {"accountId": account_id, "amount": amount, "side": schemas.EntrySide.CREDIT, "description": description}
+        for account_id, amount in receivables.items()
+    ])
+
+    wallet_transactions = [
+        {"walletId": order["walletId"], "amount": order["amount"], "type": schemas.TransactionType.INVESTMENT, "status": schemas.TransactionStatus.PENDING, "date": date, "journalId": journal_id, "settled": True}
+        for order in orders
+    ]
+    wallet_transaction_ids = db.execute(
+        insert(model.WalletTransaction).returning(model.WalletTransaction.id, sort_by_parameter_order=True),
+        wallet_transactions,
+    ).scalars().all()
+
+    batch_id = uuid.uuid4()
+    db.execute(insert(model.TransactionBatch).values(id=batch_id, executed=False, executedAt=None))
+
+    associations = []
+    order_indexes = []
+    for category, transaction_model in [("variable", model.VariableTransaction), ("deposit", model.DepositTransaction)]:
+        indexes = [index for index, order in enumerate(orders) if order["product"].category == category]
+        if not indexes:
+            continue
+        rows = []
+        for index in indexes:
+            order = orders[index]
+            row = {
+                "portfolioId": order["plan"]["portfolioId"],
+                "productId": order["product"].id,
+                "amount": order["amount"],
+                "type": schemas.TransactionType.INVESTMENT,
+                "status": schemas.TransactionStatus.PENDING,
+                "settlement": schemas.TransactionStatus.PENDING,
+                "date": date,
+                "batchId": batch_id,
+                "category": transaction_model.__mapper__.polymorphic_identity,
+            }
+            if category == "variable":
+                row.update(units=order["plan"]["amount"] // order["price"], price=order["price"])
+            else:
+                row.update(tenor=order["plan"]["tenor"], rate=order["product"].rate)
+            rows.append(row)
+        transaction_ids = db.execute(insert(transaction_model).returning(transaction_model.id, sort_by_parameter_order=True), rows).scalars().all()
+        associations += [
+            {"portfolioTransactionId": transaction_id, "walletTransactionId": wallet_transaction_ids[index]}
+            for index, transaction_id in zip(indexes, transaction_ids)
+        ]
+        order_indexes += indexes
+    db.execute(insert(model.PortfolioWalletTransactionAssociation), associations)
+    # the debits stay held until the purchases execute or fail
+    placeHolds(db, [
+        {"walletId": orders[index]["walletId"], "portfolioTransactionId": association["portfolioTransactionId"], "amount": orders[index]["amount"]}
+        for index, association in zip(order_indexes, associations)
+    ])
+
+    enqueueTask(db, "execute_transaction_batch_task", batch_id=str(batch_id))
+    return {"plans": len(plans), "orders": len(orders), "batchId": str(batch_id)}
+
+def runContributionShard(db: Session, shard: int, shards: int = settings.CONTRIBUTION_SHARDS, as_of: datetime = None, chunk_size: int = settings.CONTRIBUTION_CHUNK_SIZE) -> dict:
+    """
+    Drain the due plans of one shard, one chunk per database transaction
+    """
+    as_of = as_of or datetime.now()
+    after_id = 0
+    plans_count = 0
+    orders_count = 0
+    while True:
+        plans = claimDuePlans(db, shard, shards, as_of, after_id, chunk_size)
+        if not plans:
+            db.commit()
+            break
+        try:
+            result = processContributionChunk(db, plans, as_of)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Contribution shard {shard} chunk after plan {after_id} failed: {str(e)}")
+            result = {"plans": 0, "orders": 0}
+        after_id = plans[-1]["id"]
+        plans_count += result["plans"]
+        orders_count += result["orders"]
+    return {"shard": shard, "plans": plans_count, "orders": orders_count}
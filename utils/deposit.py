@@ -0,0 +1,403 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, insert, update, func, case, and_, or_
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+from utils.ledger import postJournal
+from utils.wallet import applyWalletTransactions
+
+logger = logging.getLogger(__name__)
+
+def getDepositBalances(db: Session, portfolio_deposit_ids: list[int]) -> dict[int, dict]:
+    """
+    Principal, accrued interest and withholding tax per portfolio deposit from the deposit ledger, in minor units
+    """
+    if not portfolio_deposit_ids:
+        return {}
+    rows = db.execute(
+        select(
+            model.DepositLedger.portfolioDepositId,
+            func.sum(case(
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.ASSET, model.DepositLedger.side == schemas.UserLedgerSide.IN), model.DepositLedger.amount),
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.ASSET, model.DepositLedger.side == schemas.UserLedgerSide.OUT), -model.DepositLedger.amount),
+                else_=0,
+            )).label("principal"),
+            func.sum(case(
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.INTEREST, model.DepositLedger.side == schemas.UserLedgerSide.IN), model.DepositLedger.amount),
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.INTEREST, model.DepositLedger.side == schemas.UserLedgerSide.OUT), -model.DepositLedger.amount),
+                else_=0,
+            )).label("accrued_interest"),
+            func.sum(case(
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.TAX, model.DepositLedger.side == schemas.UserLedgerSide.IN), -model.DepositLedger.amount),
+                (and_(model.DepositLedger.account == schemas.PortfolioAccount.TAX, model.DepositLedger.side == schemas.UserLedgerSide.OUT), model.DepositLedger.amount),
+                else_=0,
+            )).label("withholding_tax"),
+        )
+        .where(model.DepositLedger.portfolioDepositId.in_(portfolio_deposit_ids))
+        .group_by(model.DepositLedger.portfolioDepositId)
+    ).mappings().all()
+    return {
+        row["portfolioDepositId"]: {
+            "principal": int(row["principal"] or 0),
+            "accrued_interest": int(row["accrued_interest"] or 0),
+            "withholding_tax": int(row["withholding_tax"] or 0),
+        }
+        for row in rows
+    }
+
+def claimAccrualChunk(db: Session, accrual_end: datetime, after_id: int, chunk_size: int) -> list:
+    return db.execute(
+        select(
+            model.PortfolioDeposit.id,
+            model.PortfolioDeposit.effectiveDate,
+            model.PortfolioDeposit.maturityDate,
+            model.PortfolioDeposit.lastAccrualDate,
+            model.DepositTransaction.portfolioId,
+            model.DepositTransaction.rate,
+            model.ProductGroup.assetAccountId,
+            model.ProductGroup.payableAccountId,
+        )
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .join(model.Product, model.Product.id == model.DepositTransaction.productId)
+        .join(model.ProductGroup, model.ProductGroup.id == model.Product.productGroupId)
+        .where(
+            model.PortfolioDeposit.id > after_id,
+            model.PortfolioDeposit.closed == False,
+            model.PortfolioDeposit.matured == False,
+            model.PortfolioDeposit.effectiveDate < accrual_end,
+            or_(model.PortfolioDeposit.lastAccrualDate == None, model.PortfolioDeposit.lastAccrualDate < accrual_end),
+        )
+        .order_by(model.PortfolioDeposit.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True, of=model.PortfolioDeposit)
+    ).mappings().all()
+
+def accrueDepositChunk(db: Session, deposits: list, accrual_end: datetime) -> int:
+    """
+    Accrue interest and withholding tax for a chunk of deposits in one vectorized pass. The caller commits.
+
+    Interest runs from lastAccrualDate (or the effective date) to the earlier of accrual_end and maturity,
+    actual/365 on the ledger principal, and is floored to the minor unit.
+
+    Returns:
+        int: number of deposits that accrued interest
+    """
+    ids = [deposit["id"] for deposit in deposits]
+    balances = getDepositBalances(db, ids)
+
+    principal = np.array([balances.get(deposit["id"], {}).get("principal", 0) for deposit in deposits], dtype=np.int64)
+    rate = np.array([deposit["rate"] or 0 for deposit in deposits], dtype=np.int64)
+    start = np.array([deposit["lastAccrualDate"] or deposit["effectiveDate"] for deposit in deposits], dtype="datetime64[D]")
+    end = np.minimum(
+        np.array([deposit["maturityDate"] for deposit in deposits], dtype="datetime64[D]"),
+        np.datetime64(accrual_end.date(), "D"),
+    )
+    days = np.clip((end - start).astype(np.int64), 0, None)
+
+    gross = np.maximum(principal, 0) * rate * days // (10000 * 365)
+    tax = gross * settings.WITHHOLDING_TAX_BPS // 10000
+
+    date = datetime.now()
+    accrued = np.flatnonzero(gross > 0)
+    ledgers = []
+    entries = defaultdict(int)
+    for index in accrued.tolist():
+        deposit = deposits[index]
+        ledgers.append({"portfolioId": deposit["portfolioId"], "portfolioDepositId": deposit["id"], "side": schemas.UserLedgerSide.IN, "amount": int(gross[index]), "date": date, "account": schemas.PortfolioAccount.INTEREST})
+        if tax[index] > 0:
+            ledgers.append({"portfolioId": deposit["portfolioId"], "portfolioDepositId": deposit["id"], "side": schemas.UserLedgerSide.OUT, "amount": int(tax[index]), "date": date, "account": schemas.PortfolioAccount.TAX})
+        # interest earned on the placement, owed to the client net of withholding tax
+        entries[(deposit["assetAccountId"], schemas.EntrySide.DEBIT)] += int(gross[index])
+        entries[(deposit["payableAccountId"], schemas.EntrySide.CREDIT)] += int(gross[index] - tax[index])
+        entries[(settings.WITHHOLDING_TAX_ACCOUNT_ID, schemas.EntrySide.CREDIT)] += int(tax[index])
+
+    if ledgers:
+        db.execute(insert(model.DepositLedger), ledgers)
+        description = f"Deposit interest accrual to {accrual_end.date()}"
+        postJournal(db, date, [
+            {"accountId": account_id, "amount": amount, "side": side, "description": description}
+            for (account_id, side), amount in entries.items()
+        ])
+
+    db.execute(
+        update(model.PortfolioDeposit)
+        .where(model.PortfolioDeposit.id.in_(ids))
+        .values(lastAccrualDate=func.least(model.PortfolioDeposit.maturityDate, accrual_end))
+    )
+    return len(accrued)
+
+def accrueDepositInterest(db: Session, accrual_date: datetime, chunk_size: int = settings.ACCRUAL_CHUNK_SIZE) -> dict:
+    """
+    Accrue interest on every open deposit through the end of accrual_date, one chunk per database transaction.
+    lastAccrualDate makes the job restartable and a repeated run for the same day a no-op.
+    """
+    accrual_end = accrual_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    after_id = 0
+    deposits_count = 0
+    accrued_count = 0
+    while True:
+        deposits = claimAccrualChunk(db, accrual_end, after_id, chunk_size)
+        if not deposits:
+            db.commit()
+            break
+        try:
+            accrued_count += accrueDepositChunk(db, deposits, accrual_end)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Interest accrual chunk after deposit {after_id} failed: {str(e)}")
+        after_id = deposits[-1]["id"]
+        deposits_count += len(deposits)
+    return {"deposits": deposits_count, "accrued": accrued_count}
+
+def quoteDepositLiquidations(db: Session, portfolio_deposit_ids: list[int], as_of: datetime = None) -> list[dict]:
+    """
+    Quote early liquidation for a set of deposits with array math over their terms and ledger balances.
+
+    Interest is the ledger accrual plus the days not yet accrued up to as_of (actual/365, floored
+    to the minor unit); the penalty applies to net interest and is waived once a deposit has matured.
+    All amounts are in minor units.
+    """
+    if not portfolio_deposit_ids:
+        return []
+    as_of = as_of or datetime.now()
+    rows = db.execute(
+        select(
+            model.PortfolioDeposit.id,
+            model.PortfolioDeposit.effectiveDate,
+            model.PortfolioDeposit.maturityDate,
+            model.PortfolioDeposit.lastAccrualDate,
+            model.DepositTransaction.rate,
+            model.DepositTransaction.tenor,
+            model.DepositTransaction.productId,
+            model.Deposit.penalty,
+            model.Deposit.currency,
+        )
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .join(model.Deposit, model.Deposit.id == model.DepositTransaction.productId)
+        .where(model.PortfolioDeposit.id.in_(portfolio_deposit_ids), model.PortfolioDeposit.closed == False)
+        .order_by(model.PortfolioDeposit.id)
+    ).mappings().all()
+    if not rows:
+        return []
+    balances = getDepositBalances(db, [row["id"] for row in rows])
+
+    today = np.datetime64(as_of.date(), "D")
+    principal = np.array([balances.get(row["id"], {}).get("principal", 0) for row in rows], dtype=np.int64)
+    rate = np.array([row["rate"] or 0 for row in rows], dtype=np.int64)
+    penalty_rate = np.array([row["penalty"] or 0 for row in rows], dtype=np.int64)
+    effective = np.array([row["effectiveDate"] for row in rows], dtype="datetime64[D]")
+    maturity = np.array([row["maturityDate"] for row in rows], dtype="datetime64[D]")
+    accrued_to = np.array([row["lastAccrualDate"] or row["effectiveDate"] for row in rows], dtype="datetime64[D]")
+
+    pending_days = np.clip((np.minimum(maturity, today) - accrued_to).astype(np.int64), 0, None)
+    pending_interest = np.maximum(principal, 0) * rate * pending_days // (10000 * 365)
+    interest = np.array([balances.get(row["id"], {}).get("accrued_interest", 0) for row in rows], dtype=np.int64) + pending_interest
+    tax = np.array([balances.get(row["id"], {}).get("withholding_tax", 0) for row in rows], dtype=np.int64) + pending_interest * settings.WITHHOLDING_TAX_BPS // 10000
+    net_interest = interest - tax
+    matured = maturity <= today
+    penalty = np.where(matured, 0, np.maximum(net_interest, 0) * penalty_rate // 10000)
+    liquidation_value = principal + net_interest - penalty
+
+    days_held = np.clip((today - effective).astype(np.int64), 0, None)
+    days_to_maturity = np.clip((maturity - today).astype(np.int64), 0, None)
+
+    return [
+        {
+            "depositId": row["id"],
+            "productId": row["productId"],
+            "currency": row["currency"],
+            "principal": int(principal[index]),
+            "accruedInterest": int(interest[index]),
+            "withholdingTax": int(tax[index]),
+            "netInterest": int(net_interest[index]),
+            "penalty": int(penalty[index]),
+            "liquidationValue": int(liquidation_value[index]),
+            "daysHeld": int(days_held[index]),
+            "daysToMaturity": int(days_to_maturity[index]),
+            "matured": bool(matured[index]),
+        }
+        for index, row in enumerate(rows)
+    ]
+
+def getOpenDepositIds(db: Session, portfolio_id: int) -> list[int]:
+    return db.execute(
+        select(model.PortfolioDeposit.id)
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .where(model.DepositTransaction.portfolioId == portfolio_id, model.PortfolioDeposit.closed == False, model.PortfolioDeposit.matured == False)
+    ).scalars().all()
+
+def claimMaturityChunk(db: Session, maturity_end: datetime, after_id: int, chunk_size: int) -> list:
+    return db.execute(
+        select(
+            model.PortfolioDeposit.id,
+            model.PortfolioDeposit.effectiveDate,
+            model.PortfolioDeposit.maturityDate,
+            model.PortfolioDeposit.lastAccrualDate,
+            model.PortfolioDeposit.rollover,
+            model.DepositTransaction.portfolioId,
+            model.DepositTransaction.productId,
+            model.DepositTransaction.rate,
+            model.DepositTransaction.tenor,
+            model.Deposit.rate.label("productRate"),
+            model.Deposit.currency,
+            model.Portfolio.userId,
+            model.ProductGroup.assetAccountId,
+            model.ProductGroup.payableAccountId,
+            model.ProductGroup.receivableAccountId,
+        )
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .join(model.Deposit, model.Deposit.id == model.DepositTransaction.productId)
+        .join(model.ProductGroup, model.ProductGroup.id == model.Deposit.productGroupId)
+        .join(model.Portfolio, model.Portfolio.id == model.DepositTransaction.portfolioId)
+        .where(
+            model.PortfolioDeposit.id > after_id,
+            model.PortfolioDeposit.closed == False,
+            model.PortfolioDeposit.matured == False,
+            model.PortfolioDeposit.maturityDate < maturity_end,
+        )
+        .order_by(model.PortfolioDeposit.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True, of=model.PortfolioDeposit)
+    ).mappings().all()
+
+def matureDepositChunk(db: Session, deposits: list) -> dict:
+    """
+    Mature a chunk of deposits in bulk. The caller commits.
+
+    Interest is accrued up to maturity first, then each deposit's ledger is closed out and its
+    net value (principal plus interest less withholding tax) is either credited to the owner's
+    wallet or rolled into a new deposit for the same tenor at the product's current rate.
+    """
+    maturity_end = max(deposit["maturityDate"] for deposit in deposits) + timedelta(days=1)
+    accrueDepositChunk(db, deposits, maturity_end)
+    balances = getDepositBalances(db, [deposit["id"] for deposit in deposits])
+
+    wallets = {
+        (user_id, currency): (wallet_id, receivable_account_id, holding_account_id)
+        for wallet_id, user_id, currency, receivable_account_id, holding_account_id in db.execute(
+            select(model.Wallet.id, model.Wallet.userId, model.WalletGroup.currency, model.WalletGroup.receivableAccountId, model.WalletGroup.holdingAccountId)
+            .join(model.WalletGroup, model.WalletGroup.id == model.Wallet.walletGroupId)
+            .where(model.Wallet.userId.in_({deposit["userId"] for deposit in deposits if not deposit["rollover"]}), model.Wallet.active == True)
+        ).all()
+    }
+
+    date = datetime.now()
+    ledgers = []
+    entries = defaultdict(int)
+    payouts = []
+    rollovers = []
+    for deposit in deposits:
+        balance = balances.get(deposit["id"], {})
+        principal = balance.get("principal", 0)
+        interest = balance.get("accrued_interest", 0)
+        tax = balance.get("withholding_tax", 0)
+        net_interest = interest - tax
+        value = principal + net_interest
+        wallet = wallets.get((deposit["userId"], deposit["currency"]))
+        if not deposit["rollover"] and wallet is None:
+            logger.error(f"No {deposit['currency'].value} wallet to pay matured deposit {deposit['id']}")
+            continue
+
+        # close out the deposit ledger
+        for account, side, amount in [
+            (schemas.PortfolioAccount.ASSET, schemas.UserLedgerSide.OUT, principal),
+            (schemas.PortfolioAccount.INTEREST, schemas.UserLedgerSide.OUT, interest),
+            (schemas.PortfolioAccount.TAX, schemas.UserLedgerSide.IN, tax),
+        ]:
+            if amount:
+                ledgers.append({"portfolioId": deposit["portfolioId"], "portfolioDepositId": deposit["id"], "side": side, "amount": amount, "date": date, "account": account})
+
+        # interest payable and withholding tax are settled out of the placement
+        entries[(deposit["payableAccountId"], schemas.EntrySide.DEBIT)] += net_interest
+        entries[(settings.WITHHOLDING_TAX_ACCOUNT_ID, schemas.EntrySide.DEBIT)] += tax
+        if deposit["rollover"]:
+            entries[(deposit["assetAccountId"], schemas.EntrySide.CREDIT)] += tax
+            entries[(deposit["receivableAccountId"], schemas.EntrySide.CREDIT)] += net_interest
+            rollovers.append({"deposit": deposit, "amount": value})
+        else:
+            entries[(deposit["receivableAccountId"], schemas.EntrySide.DEBIT)] += principal
+            entries[(deposit["assetAccountId"], schemas.EntrySide.CREDIT)] += principal + interest
+            entries[(wallet[1], schemas.EntrySide.DEBIT)] += value
+            entries[(wallet[2], schemas.EntrySide.CREDIT)] += value
+            payouts.append({"deposit": deposit, "wallet": wallet, "amount": value})
+
+    matured_ids = [item["deposit"]["id"] for item in payouts + rollovers]
+    if not matured_ids:
+        return {"deposits": len(deposits), "paid": 0, "rolled": 0}
+
+    description = f"Deposit maturities {date.date()}"
+    journal_id = postJournal(db, date, [
+        {"accountId": account_id, "amount": amount, "side": side, "description": description}
+        for (account_id, side), amount in entries.items()
+    ])
+    if journal_id is None:
+        journal_id = db.execute(insert(model.Journal).values(date=date).returning(model.Journal.id)).scalar_one()
+
+    if payouts:
+        wallet_transactions = [
+            {"walletId": payout["wallet"][0], "amount": payout["amount"], "type": schemas.TransactionType.LIQUIDATION, "status": schemas.TransactionStatus.COMPLETED, "date": date, "journalId": journal_id, "settled": False}
+            for payout in payouts
+        ]
+        db.execute(insert(model.WalletTransaction), wallet_transactions)
+        applyWalletTransactions(db, wallet_transactions)
+
+    if rollovers:
+        batch_id = uuid.uuid4()
+        db.execute(insert(model.TransactionBatch).values(id=batch_id, executed=True, executedAt=date))
+        transaction_ids = db.execute(
+            insert(model.DepositTransaction).returning(model.DepositTransaction.id, sort_by_parameter_order=True),
+            [
+                {"portfolioId": rollover["deposit"]["portfolioId"], "productId": rollover["deposit"]["productId"], "amount": rollover["amount"], "type": schemas.TransactionType.INVESTMENT, "status": schemas.TransactionStatus.COMPLETED, "settlement": schemas.TransactionStatus.COMPLETED, "date": date, "batchId": batch_id, "category": "deposittransaction", "tenor": rollover["deposit"]["tenor"], "rate": rollover["deposit"]["productRate"]}
+                for rollover in rollovers
+            ],
+        ).scalars().all()
+        new_deposit_ids = db.execute(
+            insert(model.PortfolioDeposit).returning(model.PortfolioDeposit.id, sort_by_parameter_order=True),
+            [
+                {"transactionId": transaction_id, "effectiveDate": rollover["deposit"]["maturityDate"], "maturityDate": rollover["deposit"]["maturityDate"] + timedelta(days=rollover["deposit"]["tenor"] or 0), "matured": False, "closed": False, "isActive": True, "rollover": True, "journalId": journal_id}
+                for rollover, transaction_id in zip(rollovers, transaction_ids)
+            ],
+        ).scalars().all()
+        ledgers += [
+            {"portfolioId": rollover["deposit"]["portfolioId"], "portfolioDepositId": new_deposit_id, "transactionId": transaction_id, "side": schemas.UserLedgerSide.IN, "amount": rollover["amount"], "date": date, "account": schemas.PortfolioAccount.ASSET}
+            for rollover, transaction_id, new_deposit_id in zip(rollovers, transaction_ids, new_deposit_ids)
+        ]
+
+    if ledgers:
+        db.execute(insert(model.DepositLedger), ledgers)
+    db.execute(
+        update(model.PortfolioDeposit)
+        .where(model.PortfolioDeposit.id.in_(matured_ids))
+        .values(matured=True, closed=True, closedDate=date, isActive=False)
+    )
+    return {"deposits": len(deposits), "paid": len(payouts), "rolled": len(rollovers)}
+
+def processMaturities(db: Session, as_of: datetime, chunk_size: int = settings.MATURITY_CHUNK_SIZE) -> dict:
+    """
+    Mature every deposit due by the end of as_of, one chunk per database transaction
+    """
+    maturity_end = as_of.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    after_id = 0
+    totals = {"deposits": 0, "paid": 0, "rolled": 0}
+    while True:
+        deposits = claimMaturityChunk(db, maturity_end, after_id, chunk_size)
+        if not deposits:
+            db.commit()
+            break
+        try:
+            result = matureDepositChunk(db, deposits)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Maturity chunk after deposit {after_id} failed: {str(e)}")
+            result = {"deposits": len(deposits), "paid": 0, "rolled": 0}
+        after_id = deposits[-1]["id"]
+        for key in totals:
+            totals[key] += result[key]
+    return totals
@@ -0,0 +1,162 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, func, case
+from sqlalchemy.orm import Session, selectinload
+import model
+import schemas
+from utils.contribution import getLatestPrices
+from utils.ledger import postJournal, getDayStart
+from utils.outbox import enqueueTask
+from utils.wallet import applyWalletTransactions
+
+logger = logging.getLogger(__name__)
+
+def getRecordEnd(record_date: datetime) -> datetime:
+    return getDayStart(record_date) + timedelta(days=1)
+
+def isDistributionDue(distribution: model.VariableDistribution, now: datetime) -> bool:
+    """
+    Holdings are only final once the record date has closed, and nothing is paid before the payment date
+    """
+    return getRecordEnd(distribution.recordDate) <= now and distribution.paymentDate <= now
+
+def getDueDistributions(db: Session, now: datetime) -> list[int]:
+    """
+    Pending distributions whose record date has closed and whose payment date has arrived
+    """
+    return db.execute(
+        select(model.VariableDistribution.id)
+        .where(
+            model.VariableDistribution.status == schemas.TransactionStatus.PENDING,
+            model.VariableDistribution.recordDate < getDayStart(now),
+            model.VariableDistribution.paymentDate <= now,
+        )
+        .order_by(model.VariableDistribution.paymentDate, model.VariableDistribution.id)
+    ).scalars().all()
+
+def getEntitlements(db: Session, variable_id: int, record_date: datetime) -> list:
+    """
+    Units held per portfolio at the end of the record date, in one grouped query
+    """
+    record_end = getRecordEnd(record_date)
+    units = func.sum(case(
+        (model.VariableLedger.side == schemas.UserLedgerSide.IN, model.VariableLedger.units),
+        else_=-model.VariableLedger.units,
+    ))
+    return db.execute(
+        select(
+            model.VariableLedger.portfolioId,
+            model.Portfolio.userId,
+            model.Portfolio.reinvestDistributions,
+            units.label("units"),
+        )
+        .join(model.Portfolio, model.Portfolio.id == model.VariableLedger.portfolioId)
+        .where(
+            model.VariableLedger.variableId == variable_id,
+            model.VariableLedger.account == schemas.PortfolioAccount.ASSET,
+            model.VariableLedger.date < record_end,
+        )
+        .group_by(model.VariableLedger.portfolioId, model.Portfolio.userId, model.Portfolio.reinvestDistributions)
+        .having(units > 0)
+        .order_by(model.VariableLedger.portfolioId)
+    ).mappings().all()
+
+def processDistribution(db: Session, distribution_id: int) -> dict:
+    """
+    Pay a due distribution to every holder in a single batch. The caller commits.
+    A distribution that is not due yet is left pending for the sweep to pick up.
+
+    Each portfolio is credited units held on the record date times the per-unit amount as a DIVIDEND ledger row.
+    The cash is then either credited to the owner's wallet or, for portfolios that reinvest distributions,
+    put into one pending purchase batch executed like any other order.
+    """
+    distribution = db.execute(
+        select(model.VariableDistribution).where(model.VariableDistribution.id == distribution_id).with_for_update()
+    ).scalar_one_or_none()
+    if distribution is None:
+        raise Exception(f"Distribution not found for distribution_id: {distribution_id}")
+    if distribution.status != schemas.TransactionStatus.PENDING:
+        return {"distributionId": distribution.id, "status": distribution.status.value, "holders": distribution.holders}
+    if not isDistributionDue(distribution, datetime.now()):
+        return {"distributionId": distribution.id, "status": distribution.status.value, "holders": 0, "due": False}
+
+    product = db.execute(
+        select(model.Variable).where(model.Variable.id == distribution.variableId).options(selectinload(model.Variable.productGroup))
+    ).scalar_one()
+    holders = getEntitlements(db, product.id, distribution.recordDate)
+    date = datetime.now()
+
+    wallets = {
+        user_id: (wallet_id, receivable_account_id, holding_account_id)
+        for wallet_id, user_id, receivable_account_id, holding_account_id in db.execute(
+            select(model.Wallet.id, model.Wallet.userId, model.WalletGroup.receivableAccountId, model.WalletGroup.holdingAccountId)
+            .join(model.WalletGroup, model.WalletGroup.id == model.Wallet.walletGroupId)
+            .where(
+                model.Wallet.userId.in_({holder["userId"] for holder in holders if not holder["reinvestDistributions"]}),
+                model.WalletGroup.currency == product.currency,
+                model.Wallet.active == True,
+            )
+        ).all()
+    }
+    price = getLatestPrices(db, [product.id]).get(product.id)
+
+    ledgers = []
+    cash = []
+    reinvest = []
+    for holder in holders:
+        amount = int(holder["units"]) * distribution.amountPerUnit
+        if amount <= 0:
+            continue
+        ledgers.append({"portfolioId": holder["portfolioId"], "variableId": product.id, "side": schemas.UserLedgerSide.IN, "amount": amount, "date": date, "account": schemas.PortfolioAccount.DIVIDEND, "price": distribution.amountPerUnit, "units": 0})
+        wallet = wallets.get(holder["userId"])
+        # reinvest when asked to, or when there is no wallet to pay into
+        if (holder["reinvestDistributions"] or wallet is None) and price:
+            reinvest.append({"holder": holder, "amount": amount, "units": amount // price})
+        elif wallet is not None:
+            cash.append({"holder": holder, "wallet": wallet, "amount": amount})
+        else:
+            logger.error(f"Distribution {distribution.id}: portfolio {holder['portfolioId']} has no wallet and {product.title} has no price")
+            continue
+        ledgers.append({"portfolioId": holder["portfolioId"], "variableId": product.id, "side": schemas.UserLedgerSide.OUT, "amount": amount, "date": date, "account": schemas.PortfolioAccount.DIVIDEND, "price": distribution.amountPerUnit, "units": 0})
+
+    entries = defaultdict(int)
+    clearing_account_id = 57 if product.currency == schemas.Currency.USD else 12
+    for payout in cash:
+        entries[(payout["wallet"][1], schemas.EntrySide.DEBIT)] += payout["amount"]
+        entries[(payout["wallet"][2], schemas.EntrySide.CREDIT)] += payout["amount"]
+    for order in reinvest:
+        entries[(clearing_account_id, schemas.EntrySide.DEBIT)] += order["amount"]
+        entries[(product.productGroup.receivableAccountId, schemas.EntrySide.CREDIT)] += order["amount"]
+    description = f"{product.title} distribution {distribution.recordDate.date()}"
+    journal_id = postJournal(db, date, [
+        {"accountId": account_id, "amount": amount, "side": side, "description": description}
+        for (account_id, side), amount in entries.items()
+    ])
+
+    if ledgers:
+        db.execute(insert(model.VariableLedger), ledgers)
+    if cash:
+        wallet_transactions = [
+            {"walletId": payout["wallet"][0], "amount": payout["amount"], "type": schemas.TransactionType.DIVIDEND, "status": schemas.TransactionStatus.COMPLETED, "date": date, "journalId": journal_id, "settled": False}
+            for payout in cash
+        ]
+        db.execute(insert(model.WalletTransaction), wallet_transactions)
+        applyWalletTransactions(db, wallet_transactions)
+    if reinvest:
+        batch_id = uuid.uuid4()
+        db.execute(insert(model.TransactionBatch).values(id=batch_id, executed=False, executedAt=None))
+        db.execute(insert(model.VariableTransaction), [
+            {"portfolioId": order["holder"]["portfolioId"], "productId": product.id, "amount": order["amount"], "type": schemas.TransactionType.INVESTMENT, "status": schemas.TransactionStatus.PENDING, "settlement": schemas.TransactionStatus.PENDING, "date": date, "batchId": batch_id, "category": "variabletransaction", "units": order["units"], "price": price}
+            for order in reinvest
+        ])
+        enqueueTask(db, "execute_transaction_batch_task", batch_id=str(batch_id))
+
+    distribution.status = schemas.TransactionStatus.COMPLETED
+    distribution.holders = len(cash) + len(reinvest)
+    distribution.totalUnits = sum(int(holder["units"]) for holder in holders)
+    distribution.totalAmount = sum(payout["amount"] for payout in cash) + sum(order["amount"] for order in reinvest)
+    distribution.processedAt = date
+    db.add(distribution)
+    return {"distributionId": distribution.id, "status": distribution.status.value, "holders": distribution.holders, "paid": len(cash), "reinvested": len(reinvest)}
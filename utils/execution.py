@@ -0,0 +1,207 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload, with_polymorphic
+import model
+import schemas
+from utils.holdings import releaseReservations
+from utils.ledger import postJournal
+from utils.wallet import convertHolds, releaseHolds
+
+logger = logging.getLogger(__name__)
+
+sale_types = [schemas.TransactionType.LIQUIDATION, schemas.TransactionType.SELL]
+
+portfolio_transactions = with_polymorphic(model.PortfolioTransaction, [model.DepositTransaction, model.VariableTransaction])
+
+def getProductVenue(product: model.Product) -> Optional[schemas.TransactionVenue]:
+    """
+    Map a product to the venue that executes its orders
+    """
+    market = product.productGroup.market
+    if product.productClass == schemas.ProductClass.MUTUAL_FUND and market == schemas.Country.NG:
+        return schemas.TransactionVenue.NG_MUTUAL_FUND
+    if product.productClass == schemas.ProductClass.DEPOSIT and market == schemas.Country.NG:
+        return schemas.TransactionVenue.NG_DEPOSIT
+    if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and market == schemas.Country.US:
+        return schemas.TransactionVenue.US_EQUITY
+    if product.productClass in [schemas.ProductClass.EQUITY, schemas.ProductClass.ETF] and market == schemas.Country.NG:
+        return schemas.TransactionVenue.NGX_EQUITY
+    return None
+
+def groupTransactionsByVenue(transactions: list[model.PortfolioTransaction]) -> dict[schemas.TransactionVenue, list[int]]:
+    """
+    Group pending portfolio transactions by execution venue
+
+    Returns:
+        dict: venue -> list of portfolio transaction ids
+    """
+    venues = defaultdict(list)
+    for transaction in transactions:
+        if transaction.status != schemas.TransactionStatus.PENDING:
+            continue
+        venue = getProductVenue(transaction.product)
+        if venue is None:
+            logger.error(f"No execution venue for product {transaction.productId} on transaction {transaction.id}")
+            continue
+        venues[venue].append(transaction.id)
+    return dict(venues)
+
+def bookPurchaseTransaction(db: Session, transaction: model.DepositTransaction | model.VariableTransaction):
+    """
+    Add the execution journal and portfolio ledgers for a purchase to the session.
+
+    The caller owns the database transaction: the journal is posted but nothing is committed here.
+    """
+    date = datetime.now()
+
+    # credit portfolio clearing and debit asset holding for consideration
+    journal_id = postJournal(db, date, [
+        {"accountId": 57 if transaction.product.currency == schemas.Currency.USD else 12, "amount": transaction.amount, "side": schemas.EntrySide.CREDIT, "description": f"{transaction.product.title} transaction"},
+        {"accountId": transaction.product.productGroup.assetAccountId, "amount": transaction.amount, "side": schemas.EntrySide.DEBIT, "description": f"{transaction.product.title} transaction"},
+    ])
+
+    if transaction.category == "deposittransaction":
+        portfolio_deposit = model.PortfolioDeposit(
+            transaction=transaction,
+            effectiveDate=date,
+            maturityDate=transaction.date + timedelta(days=transaction.tenor),
+            matured=False,
+            closed=False,
+            closedDate=None,
+            isActive=False
+        )
+        portfolio_deposit.journalId = journal_id
+        db.add(portfolio_deposit)
+
+        # create deposit ledger
+        deposit_ledger = model.DepositLedger(
+            portfolioDeposit=portfolio_deposit,
+            side=schemas.UserLedgerSide.IN,
+            amount=transaction.amount,
+            date=date,
+            account=schemas.PortfolioAccount.ASSET,
+            transactionId=transaction.id,
+            portfolioId=transaction.portfolioId,
+        )
+        db.add(deposit_ledger)
+
+    if transaction.category == "variabletransaction":
+        variable_ledger = model.VariableLedger(
+            variableId=transaction.productId,
+            side=schemas.UserLedgerSide.IN,
+            amount=transaction.amount,
+            account=schemas.PortfolioAccount.ASSET,
+            transactionId=transaction.id,
+            price=transaction.price,
+            units=transaction.units,
+            date=date,
+            portfolioId=transaction.portfolioId,
+        )
+        db.add(variable_ledger)
+
+    transaction.status = schemas.TransactionStatus.COMPLETED
+    db.add(transaction)
+    # the wallet funds held for the purchase become the debit
+    convertHolds(db, [transaction.id])
+    return transaction
+
+def bookSaleTransaction(db: Session, transaction: model.DepositTransaction | model.VariableTransaction):
+    """
+    Add the execution journal and portfolio ledgers for a sale to the session and release what it reserved.
+
+    The caller owns the database transaction: the journal is posted but nothing is committed here.
+    """
+    date = datetime.now()
+
+    # debit portfolio clearing and credit asset holding for consideration
+    postJournal(db, date, [
+        {"accountId": 57 if transaction.product.currency == schemas.Currency.USD else 12, "amount": transaction.amount, "side": schemas.EntrySide.DEBIT, "description": f"{transaction.product.title} sale"},
+        {"accountId": transaction.product.productGroup.assetAccountId, "amount": transaction.amount, "side": schemas.EntrySide.CREDIT, "description": f"{transaction.product.title} sale"},
+    ])
+
+    if transaction.category == "deposittransaction":
+        # the reservation records which placement the principal comes out of
+        portfolio_deposit_id = db.execute(
+            select(model.PortfolioReservation.portfolioDepositId)
+            .where(model.PortfolioReservation.transactionId == transaction.id, model.PortfolioReservation.portfolioDepositId != None)
+        ).scalar_one()
+        db.add(model.DepositLedger(
+            portfolioDepositId=portfolio_deposit_id,
+            side=schemas.UserLedgerSide.OUT,
+            amount=transaction.amount,
+            date=date,
+            account=schemas.PortfolioAccount.ASSET,
+            transactionId=transaction.id,
+            portfolioId=transaction.portfolioId,
+        ))
+
+    if transaction.category == "variabletransaction":
+        db.add(model.VariableLedger(
+            variableId=transaction.productId,
+            side=schemas.UserLedgerSide.OUT,
+            amount=transaction.amount,
+            account=schemas.PortfolioAccount.ASSET,
+            transactionId=transaction.id,
+            price=transaction.price,
+            units=transaction.units,
+            date=date,
+            portfolioId=transaction.portfolioId,
+        ))
+
+    transaction.status = schemas.TransactionStatus.COMPLETED
+    db.add(transaction)
+    # the ledger now carries what the sale reserved
+    releaseReservations(db, [transaction.id])
+    return transaction
+
+def executeVenueTransactions(db: Session, venue: schemas.TransactionVenue, transaction_ids: list[int]) -> list[dict]:
+    """
+    Execute all transactions of a batch routed to one venue in a single database transaction.
+
+    Every line is booked inside its own savepoint so a bad line is marked failed
+    without rolling back the rest of the venue's lines.
+
+    Returns:
+        list: per-line outcomes {transactionId, status, error}
+    """
+    transactions = db.execute(
+        select(portfolio_transactions)
+        .where(portfolio_transactions.id.in_(transaction_ids))
+        .options(selectinload(portfolio_transactions.product).selectinload(model.Product.productGroup))
+        .order_by(portfolio_transactions.id)
+    ).scalars().all()
+
+    outcomes = []
+    found_ids = {transaction.id for transaction in transactions}
+    for missing_id in set(transaction_ids) - found_ids:
+        outcomes.append({"transactionId": missing_id, "status": schemas.TransactionStatus.FAILED.value, "error": "Transaction not found"})
+
+    failed = []
+    for transaction in transactions:
+        if transaction.status != schemas.TransactionStatus.PENDING:
+            outcomes.append({"transactionId": transaction.id, "status": transaction.status.value, "error": "Transaction is not pending"})
+            continue
+        try:
+            with db.begin_nested():
+                # call venue API to execute transaction
+                if transaction.type in sale_types:
+                    bookSaleTransaction(db, transaction)
+                else:
+                    bookPurchaseTransaction(db, transaction)
+            outcomes.append({"transactionId": transaction.id, "status": schemas.TransactionStatus.COMPLETED.value, "error": None})
+        except Exception as e:
+            logger.error(f"Failed to execute {venue.value} transaction {transaction.id}: {str(e)}")
+            failed.append(transaction)
+            outcomes.append({"transactionId": transaction.id, "status": schemas.TransactionStatus.FAILED.value, "error": str(e)})
+
+    for transaction in failed:
+        transaction.status = schemas.TransactionStatus.FAILED
+        db.add(transaction)
+    releaseHolds(db, [transaction.id for transaction in failed])
+    releaseReservations(db, [transaction.id for transaction in failed])
+
+    db.commit()
+    return outcomes
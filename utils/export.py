@@ -0,0 +1,110 @@
+import csv
+import enum
+import io
+import logging
+from datetime import datetime
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Select, Boolean, Integer, DateTime, Numeric
+from sqlalchemy.orm import Session
+from config import settings
+import schemas
+
+logger = logging.getLogger(__name__)
+
+export_media_types = {
+    schemas.ExportFormat.CSV: "text/csv",
+    schemas.ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+def getArrowSchema(columns) -> pa.Schema:
+    """
+    Arrow schema for a set of SQLAlchemy columns; enums, strings and anything else are written as strings.
+    Every field is nullable, since outer-joined columns can be null whatever their table says.
+    """
+    fields = []
+    for col in columns:
+        if isinstance(col.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(col.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(col.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(col.type, Numeric) and col.type.precision:
+            arrow_type = pa.decimal128(col.type.precision, col.type.scale or 0)
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col.name, arrow_type))
+    return pa.schema(fields)
+
+def getExportValue(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+def streamChunks(session_factory, statement: Select, chunk_size: int) -> Iterator[list[tuple]]:
+    """
+    Run a query on a session of its own through a server-side cursor, yielding chunk_size rows at a time.
+
+    The request's session is closed once the endpoint returns, before the response body is sent,
+    so the export cannot borrow it.
+    """
+    with session_factory() as session:
+        result = session.execute(statement, execution_options={"stream_results": True, "yield_per": chunk_size})
+        for partition in result.partitions():
+            yield [tuple(getExportValue(value) for value in row) for row in partition]
+
+def streamCsv(session_factory, statement: Select, chunk_size: int = settings.EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col.name for col in statement.selected_columns])
+    for rows in streamChunks(session_factory, statement, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file that hands back what has been written since the last drain, so each Parquet
+    row group leaves memory as soon as it is encoded
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def streamParquet(session_factory, statement: Select, chunk_size: int = settings.EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    schema = getArrowSchema(statement.selected_columns)
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in streamChunks(session_factory, statement, chunk_size):
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in rows], schema=schema))
+            yield sink.drain()
+    # the footer is written on close
+    yield sink.drain()
+
+def streamExport(session_factory, statement: Select, format: schemas.ExportFormat) -> Iterator[bytes]:
+    if format == schemas.ExportFormat.PARQUET:
+        return streamParquet(session_factory, statement)
+    return streamCsv(session_factory, statement)
+
+def getExportHeaders(name: str, format: schemas.ExportFormat) -> dict:
+    return {"Content-Disposition": f'attachment; filename="{name}_{datetime.now():%Y%m%d%H%M%S}.{format.value}"'}
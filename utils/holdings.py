@@ -0,0 +1,152 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, func, case, and_
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+
+logger = logging.getLogger(__name__)
+
+def isActiveReservation():
+    return and_(model.PortfolioReservation.released == False, model.PortfolioReservation.expiresAt > datetime.now())
+
+def getVariableHoldings(db: Session, portfolio_id: int, product_ids: list[int]) -> dict[int, int]:
+    """
+    Net units held per product, read from the ledger indexes instead of revaluing the portfolio
+
+    Returns:
+        dict: product id -> units held less units reserved for open sale orders
+    """
+    if not product_ids:
+        return {}
+    held = db.execute(
+        select(
+            model.VariableLedger.variableId,
+            func.sum(case(
+                (model.VariableLedger.side == schemas.UserLedgerSide.IN, model.VariableLedger.units),
+                else_=-model.VariableLedger.units,
+            )),
+        )
+        .where(
+            model.VariableLedger.portfolioId == portfolio_id,
+            model.VariableLedger.variableId.in_(product_ids),
+            model.VariableLedger.account == schemas.PortfolioAccount.ASSET,
+        )
+        .group_by(model.VariableLedger.variableId)
+    ).all()
+    reserved = db.execute(
+        select(model.PortfolioReservation.productId, func.sum(model.PortfolioReservation.units))
+        .where(
+            model.PortfolioReservation.portfolioId == portfolio_id,
+            model.PortfolioReservation.productId.in_(product_ids),
+            model.PortfolioReservation.portfolioDepositId == None,
+            isActiveReservation(),
+        )
+        .group_by(model.PortfolioReservation.productId)
+    ).all()
+    holdings = {product_id: int(units or 0) for product_id, units in held}
+    for product_id, units in reserved:
+        holdings[product_id] = holdings.get(product_id, 0) - int(units or 0)
+    return holdings
+
+def getDepositHoldings(db: Session, portfolio_id: int, portfolio_deposit_ids: list[int]) -> dict[int, dict]:
+    """
+    Open principal per portfolio deposit, read from the ledger indexes
+
+    Returns:
+        dict: portfolio deposit id -> {productId, principal} with principal less active reservations
+    """
+    if not portfolio_deposit_ids:
+        return {}
+    held = db.execute(
+        select(
+            model.DepositLedger.portfolioDepositId,
+            model.DepositTransaction.productId,
+            func.sum(case(
+                (model.DepositLedger.side == schemas.UserLedgerSide.IN, model.DepositLedger.amount),
+                else_=-model.DepositLedger.amount,
+            )),
+        )
+        .join(model.PortfolioDeposit, model.PortfolioDeposit.id == model.DepositLedger.portfolioDepositId)
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .where(
+            model.DepositLedger.portfolioId == portfolio_id,
+            model.DepositLedger.portfolioDepositId.in_(portfolio_deposit_ids),
+            model.DepositLedger.account == schemas.PortfolioAccount.ASSET,
+            model.PortfolioDeposit.closed == False,
+            model.PortfolioDeposit.matured == False,
+        )
+        .group_by(model.DepositLedger.portfolioDepositId, model.DepositTransaction.productId)
+    ).all()
+    reserved = db.execute(
+        select(model.PortfolioReservation.portfolioDepositId, func.sum(model.PortfolioReservation.amount))
+        .where(
+            model.PortfolioReservation.portfolioId == portfolio_id,
+            model.PortfolioReservation.portfolioDepositId.in_(portfolio_deposit_ids),
+            isActiveReservation(),
+        )
+        .group_by(model.PortfolioReservation.portfolioDepositId)
+    ).all()
+    holdings = {deposit_id: {"productId": product_id, "principal": int(principal or 0)} for deposit_id, product_id, principal in held}
+    for deposit_id, amount in reserved:
+        if deposit_id in holdings:
+            holdings[deposit_id]["principal"] -= int(amount or 0)
+    return holdings
+
+def reserveSaleOrders(db: Session, portfolio_id: int, variable_units: dict[int, int], deposit_amounts: dict[int, int], transaction_id: Optional[int] = None) -> list[model.PortfolioReservation]:
+    """
+    Check and reserve the units (variables) or principal (deposits) a set of sale orders needs.
+
+    The portfolio row is locked with SELECT ... FOR UPDATE for the check-and-insert, so concurrent
+    sales of the same portfolio queue behind each other while other portfolios are unaffected.
+    Reservations expire after SALE_RESERVATION_MINUTES unless released or booked earlier.
+    The caller commits.
+
+    Args:
+        variable_units: product id -> units to sell
+        deposit_amounts: portfolio deposit id -> principal to liquidate in minor units
+    """
+    db.execute(select(model.Portfolio.id).where(model.Portfolio.id == portfolio_id).with_for_update())
+
+    variables = getVariableHoldings(db, portfolio_id, list(variable_units))
+    for product_id, units in variable_units.items():
+        if product_id not in variables:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Variable {product_id} not found")
+        if variables[product_id] < units:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Variable {product_id} has insufficient units")
+
+    deposits = getDepositHoldings(db, portfolio_id, list(deposit_amounts))
+    for deposit_id, amount in deposit_amounts.items():
+        if deposit_id not in deposits:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Deposit {deposit_id} not found")
+        if deposits[deposit_id]["principal"] < amount:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Deposit {deposit_id} has insufficient funds")
+
+    expires_at = datetime.now() + timedelta(minutes=settings.SALE_RESERVATION_MINUTES)
+    reservations = [
+        model.PortfolioReservation(portfolioId=portfolio_id, productId=product_id, units=units, transactionId=transaction_id, expiresAt=expires_at)
+        for product_id, units in variable_units.items()
+    ] + [
+        model.PortfolioReservation(portfolioId=portfolio_id, productId=deposits[deposit_id]["productId"], portfolioDepositId=deposit_id, amount=amount, transactionId=transaction_id, expiresAt=expires_at)
+        for deposit_id, amount in deposit_amounts.items()
+    ]
+    db.add_all(reservations)
+    return reservations
+
+def releaseReservations(db: Session, transaction_ids: list[int]):
+    """
+    Release the reservations of a set of sale transactions once they are booked to the ledger or have failed.
+    The caller commits.
+
+    A booked sale's ledger OUT rows now carry what it reserved; a failed or unfilled sale frees it again.
+    """
+    if not transaction_ids:
+        return
+    db.execute(
+        update(model.PortfolioReservation)
+        .where(model.PortfolioReservation.transactionId.in_(transaction_ids), model.PortfolioReservation.released == False)
+        .values(released=True)
+    )
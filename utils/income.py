@@ -0,0 +1,312 @@
+import logging
+import math
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select, insert, update, func, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
+from config import settings
+import model
+import schemas
+from utils.contribution import getLatestPrices
+from utils.deposit import getDepositBalances
+from utils.wallet import applyWalletTransactions
+from utils.ledger import postJournal
+from utils.payment_schedule import next_schedule_date
+
+logger = logging.getLogger(__name__)
+
+def claimDueIncomes(db: Session, as_of: datetime, after_id: int, chunk_size: int) -> list:
+    return db.execute(
+        select(
+            model.PortfolioIncome.id,
+            model.PortfolioIncome.portfolioId,
+            model.PortfolioIncome.amount,
+            model.PortfolioIncome.currency,
+            model.PortfolioIncome.frequency,
+            model.PortfolioIncome.nextIncomeDate,
+            model.Portfolio.userId,
+        )
+        .join(model.Portfolio, model.Portfolio.id == model.PortfolioIncome.portfolioId)
+        .where(
+            model.PortfolioIncome.id > after_id,
+            model.PortfolioIncome.nextIncomeDate <= as_of,
+            model.PortfolioIncome.frequency != schemas.Frequency.NONE,
+            model.Portfolio.active == True,
+            model.Portfolio.deleted == False,
+        )
+        .order_by(model.PortfolioIncome.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True, of=model.PortfolioIncome)
+    ).mappings().all()
+
+def getInterestSources(db: Session, portfolio_ids: list[int]) -> dict[int, list[dict]]:
+    """
+    Accrued interest net of withholding tax per open portfolio deposit, grouped by portfolio
+    """
+    deposits = db.execute(
+        select(
+            model.DepositTransaction.portfolioId,
+            model.PortfolioDeposit.id.label("portfolioDepositId"),
+            model.Product.id.label("productId"),
+            model.Product.currency,
+        )
+        .join(model.DepositTransaction, model.DepositTransaction.id == model.PortfolioDeposit.transactionId)
+        .join(model.Product, model.Product.id == model.DepositTransaction.productId)
+        .where(
+            model.DepositTransaction.portfolioId.in_(portfolio_ids),
+            model.PortfolioDeposit.closed == False,
+            model.PortfolioDeposit.matured == False,
+        )
+        .order_by(model.PortfolioDeposit.id)
+    ).mappings().all()
+    balances = getDepositBalances(db, [deposit["portfolioDepositId"] for deposit in deposits])
+    sources = defaultdict(list)
+    for deposit in deposits:
+        balance = balances.get(deposit["portfolioDepositId"], {})
+        interest = balance.get("accrued_interest", 0)
+        tax = balance.get("withholding_tax", 0)
+        # the withholding tax share of the accrual belongs to the tax authority
+        if interest - tax > 0:
+            sources[deposit["portfolioId"]].append({**deposit, "available": interest - tax, "interest": interest, "tax": tax})
+    return sources
+
+def getFundSources(db: Session, portfolio_ids: list[int]) -> dict[int, list[dict]]:
+    """
+    Mutual fund units per portfolio less units reserved for open sale orders
+    """
+    held = db.execute(
+        select(
+            model.VariableLedger.portfolioId,
+            model.VariableLedger.variableId.label("productId"),
+            model.Product.currency,
+            func.sum(case(
+                (model.VariableLedger.side == schemas.UserLedgerSide.IN, model.VariableLedger.units),
+                else_=-model.VariableLedger.units,
+            )).label("units"),
+        )
+        .join(model.Product, model.Product.id == model.VariableLedger.variableId)
+        .where(
+            model.VariableLedger.portfolioId.in_(portfolio_ids),
+            model.VariableLedger.account == schemas.PortfolioAccount.ASSET,
+            model.Product.productClass == schemas.ProductClass.MUTUAL_FUND,
+        )
+        .group_by(model.VariableLedger.portfolioId, model.VariableLedger.variableId, model.Product.currency)
+        .order_by(model.VariableLedger.variableId)
+    ).mappings().all()
+    reserved = {
+        (portfolio_id, product_id): int(units or 0)
+        for portfolio_id, product_id, units in db.execute(
+            select(model.PortfolioReservation.portfolioId, model.PortfolioReservation.productId, func.sum(model.PortfolioReservation.units))
+            .where(
+                model.PortfolioReservation.portfolioId.in_(portfolio_ids),
+                model.PortfolioReservation.portfolioDepositId == None,
+                model.PortfolioReservation.released == False,
+                model.PortfolioReservation.expiresAt > datetime.now(),
+            )
+            .group_by(model.PortfolioReservation.portfolioId, model.PortfolioReservation.productId)
+        ).all()
+    }
+    sources = defaultdict(list)
+    for row in held:
+        units = int(row["units"] or 0) - reserved.get((row["portfolioId"], row["productId"]), 0)
+        if units > 0:
+            sources[row["portfolioId"]].append({**row, "units": units})
+    return sources
+
+def planIncomeLiquidations(amount: int, currency: schemas.Currency, interest: list[dict], funds: list[dict], prices: dict[int, int]) -> list[dict]:
+    """
+    Pick what to liquidate for one payout: net deposit interest first, then fund units at the latest price.
+    amount and the liquidation amounts are in accounting minor units.
+    """
+    liquidations = []
+    remaining = amount
+    for source in interest:
+        if remaining <= 0:
+            break
+        if source["currency"] != currency:
+            continue
+        take = min(int(source["available"]), remaining)
+        # the tax withheld on the interest paid out is settled with it, in proportion; all of it when the interest is taken in full
+        tax = source["tax"] * take // source["available"]
+        liquidations.append({"kind": "interest", "portfolioDepositId": source["portfolioDepositId"], "productId": source["productId"], "amount": take, "gross": take + tax, "tax": tax})
+        remaining -= take
+    for source in funds:
+        if remaining <= 0:
+            break
+        price = prices.get(source["productId"])
+        if source["currency"] != currency or not price:
+            continue
+        units = min(source["units"], math.ceil(remaining / price))
+        liquidations.append({"kind": "fund", "productId": source["productId"], "units": units, "price": price, "amount": units * price})
+        remaining -= units * price
+    return liquidations
+
+def processIncomeChunk(db: Session, incomes: list, as_of: datetime) -> dict:
+    """
+    Pay one chunk of due incomes. Payouts are keyed on (income, period) so a period is paid at most once,
+    whatever happens to the run. The caller commits.
+    """
+    date = datetime.now()
+    new_payouts = {
+        income_id: payout_id
+        for income_id, payout_id in db.execute(
+            pg_insert(model.PortfolioIncomePayout)
+            .values([
+                {"incomeId": income["id"], "portfolioId": income["portfolioId"], "period": income["nextIncomeDate"], "amount": 0, "status": schemas.TransactionStatus.PENDING}
+                for income in incomes
+            ])
+            .on_conflict_do_nothing(index_elements=["incomeId", "period"])
+            .returning(model.PortfolioIncomePayout.incomeId, model.PortfolioIncomePayout.id)
+        ).all()
+    }
+    due = [income for income in incomes if income["id"] in new_payouts]
+
+    # roll every claimed income forward, including periods an earlier run already paid
+    income_updates = []
+    for income in incomes:
+        next_date = income["nextIncomeDate"]
+        while next_date <= as_of:
+            next_date = next_schedule_date(next_date, income["frequency"].value)
+        income_updates.append({"id": income["id"], "nextIncomeDate": next_date})
+    db.execute(update(model.PortfolioIncome), income_updates)
+    if not due:
+        return {"incomes": len(incomes), "paid": 0}
+
+    portfolio_ids = list({income["portfolioId"] for income in due})
+    interest_sources = getInterestSources(db, portfolio_ids)
+    fund_sources = getFundSources(db, portfolio_ids)
+    prices = getLatestPrices(db, list({source["productId"] for sources in fund_sources.values() for source in sources}))
+    products = {
+        product.id: product
+        for product in db.execute(
+            select(model.Product)
+            .where(model.Product.id.in_({source["productId"] for sources in list(interest_sources.values()) + list(fund_sources.values()) for source in sources}))
+            .options(selectinload(model.Product.productGroup))
+        ).scalars().all()
+    }
+    wallets = {
+        (user_id, currency): (wallet_id, receivable_account_id, holding_account_id)
+        for wallet_id, user_id, currency, receivable_account_id, holding_account_id in db.execute(
+            select(model.Wallet.id, model.Wallet.userId, model.WalletGroup.currency, model.WalletGroup.receivableAccountId, model.WalletGroup.holdingAccountId)
+            .join(model.WalletGroup, model.WalletGroup.id == model.Wallet.walletGroupId)
+            .where(model.Wallet.userId.in_({income["userId"] for income in due}), model.Wallet.active == True)
+        ).all()
+    }
+
+    payouts = []
+    for income in due:
+        wallet = wallets.get((income["userId"], income["currency"]))
+        # incomes are set in major units of their currency; ledgers and journals are in NGN accounting minor units
+        requested = int((income["amount"] * 1470 if income["currency"] == schemas.Currency.USD else income["amount"]) * 100)
+        liquidations = [] if wallet is None else planIncomeLiquidations(
+            requested, income["currency"], interest_sources.get(income["portfolioId"], []), fund_sources.get(income["portfolioId"], []), prices
+        )
+        amount = sum(liquidation["amount"] for liquidation in liquidations)
+        # the wallet is credited in its own currency; NGN accounting units are the wallet's own
+        wallet_amount = amount * int(income["amount"] * 100) // requested if requested else 0
+        payouts.append({"income": income, "wallet": wallet, "liquidations": liquidations, "amount": amount, "walletAmount": wallet_amount})
+
+    paid = [payout for payout in payouts if payout["amount"] > 0]
+    failed = [{"id": new_payouts[payout["income"]["id"]], "status": schemas.TransactionStatus.FAILED} for payout in payouts if payout["amount"] == 0]
+    for payout in payouts:
+        if payout["amount"] == 0:
+            logger.warning(f"Income {payout['income']['id']} for portfolio {payout['income']['portfolioId']} has nothing to pay out")
+    if failed:
+        db.execute(update(model.PortfolioIncomePayout), failed)
+    if not paid:
+        return {"incomes": len(incomes), "paid": 0}
+
+    # one journal for the chunk: liquidated assets to clearing, clearing proceeds credited to wallets
+    entries = defaultdict(int)
+    for payout in paid:
+        for liquidation in payout["liquidations"]:
+            product = products[liquidation["productId"]]
+            if liquidation["kind"] == "interest":
+                # as at maturity: interest payable and withholding tax are settled out of the placement
+                entries[(product.productGroup.payableAccountId, schemas.EntrySide.DEBIT)] += liquidation["amount"]
+                entries[(settings.WITHHOLDING_TAX_ACCOUNT_ID, schemas.EntrySide.DEBIT)] += liquidation["tax"]
+                entries[(product.productGroup.assetAccountId, schemas.EntrySide.CREDIT)] += liquidation["gross"]
+                continue
+            clearing_account_id = 57 if product.currency == schemas.Currency.USD else 12
+            entries[(clearing_account_id, schemas.EntrySide.DEBIT)] += liquidation["amount"]
+            entries[(product.productGroup.assetAccountId, schemas.EntrySide.CREDIT)] += liquidation["amount"]
+        entries[(payout["wallet"][1], schemas.EntrySide.DEBIT)] += payout["amount"]
+        entries[(payout["wallet"][2], schemas.EntrySide.CREDIT)] += payout["amount"]
+    description = f"Income payouts {date.date()}"
+    journal_id = postJournal(db, date, [
+        {"accountId": account_id, "amount": amount, "side": side, "description": description}
+        for (account_id, side), amount in entries.items()
+    ])
+
+    wallet_transactions = [
+        {"walletId": payout["wallet"][0], "amount": payout["walletAmount"], "type": schemas.TransactionType.LIQUIDATION, "status": schemas.TransactionStatus.COMPLETED, "date": date, "journalId": journal_id, "settled": False}
+        for payout in paid
+    ]
+    wallet_transaction_ids = db.execute(
+        insert(model.WalletTransaction).returning(model.WalletTransaction.id, sort_by_parameter_order=True),
+        wallet_transactions,
+    ).scalars().all()
+    applyWalletTransactions(db, wallet_transactions)
+
+    # interest comes straight off the deposit ledger, gross, with the tax withheld on it closed out
+    interest_ledgers = [
+        {"portfolioId": payout["income"]["portfolioId"], "portfolioDepositId": liquidation["portfolioDepositId"], "side": side, "amount": amount, "date": date, "account": account}
+        for payout in paid for liquidation in payout["liquidations"] if liquidation["kind"] == "interest"
+        for account, side, amount in [
+            (schemas.PortfolioAccount.INTEREST, schemas.UserLedgerSide.OUT, liquidation["gross"]),
+            (schemas.PortfolioAccount.TAX, schemas.UserLedgerSide.IN, liquidation["tax"]),
+        ]
+        if amount
+    ]
+    if interest_ledgers:
+        db.execute(insert(model.DepositLedger), interest_ledgers)
+
+    # fund units are redeemed at the latest price and settle with the venue's cycle
+    fund_liquidations = [(payout, liquidation) for payout in paid for liquidation in payout["liquidations"] if liquidation["kind"] == "fund"]
+    if fund_liquidations:
+        batch_id = uuid.uuid4()
+        db.execute(insert(model.TransactionBatch).values(id=batch_id, executed=True, executedAt=date))
+        transaction_ids = db.execute(
+            insert(model.VariableTransaction).returning(model.VariableTransaction.id, sort_by_parameter_order=True),
+            [
+                {"portfolioId": payout["income"]["portfolioId"], "productId": liquidation["productId"], "amount": liquidation["amount"], "type": schemas.TransactionType.LIQUIDATION, "status": schemas.TransactionStatus.COMPLETED, "settlement": schemas.TransactionStatus.PENDING, "date": date, "batchId": batch_id, "category": "variabletransaction", "units": liquidation["units"], "price": liquidation["price"]}
+                for payout, liquidation in fund_liquidations
+            ],
+        ).scalars().all()
+        db.execute(insert(model.VariableLedger), [
+            {"portfolioId": payout["income"]["portfolioId"], "transactionId": transaction_id, "variableId": liquidation["productId"], "side": schemas.UserLedgerSide.OUT, "amount": liquidation["amount"], "date": date, "account": schemas.PortfolioAccount.ASSET, "price": liquidation["price"], "units": liquidation["units"]}
+            for (payout, liquidation), transaction_id in zip(fund_liquidations, transaction_ids)
+        ])
+
+    db.execute(update(model.PortfolioIncomePayout), [
+        {"id": new_payouts[payout["income"]["id"]], "amount": payout["walletAmount"], "status": schemas.TransactionStatus.COMPLETED, "walletTransactionId": wallet_transaction_id}
+        for payout, wallet_transaction_id in zip(paid, wallet_transaction_ids)
+    ])
+    return {"incomes": len(incomes), "paid": len(paid)}
+
+def runIncomePayouts(db: Session, as_of: datetime = None, chunk_size: int = settings.INCOME_CHUNK_SIZE) -> dict:
+    """
+    Pay every due income, one chunk per database transaction
+    """
+    as_of = as_of or datetime.now()
+    after_id = 0
+    incomes_count = 0
+    paid_count = 0
+    while True:
+        incomes = claimDueIncomes(db, as_of, after_id, chunk_size)
+        if not incomes:
+            db.commit()
+            break
+        try:
+            result = processIncomeChunk(db, incomes, as_of)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Income payout chunk after income {after_id} failed: {str(e)}")
+            result = {"incomes": 0, "paid": 0}
+        after_id = incomes[-1]["id"]
+        incomes_count += result["incomes"]
+        paid_count += result["paid"]
+    return {"incomes": incomes_count, "paid": paid_count}
@@ -0,0 +1,225 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, literal, cast, String, Date, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+from utils.wallet import wallet_inflow_types
+
+logger = logging.getLogger(__name__)
+
+journal_check = "journals"
+# portfolio ledger accounts whose movements are booked on the product group's asset account
+asset_ledger_accounts = [schemas.PortfolioAccount.ASSET, schemas.PortfolioAccount.INTEREST]
+
+def getViolationType(type: schemas.IntegrityViolationType):
+    return literal(type, model.IntegrityViolation.__table__.c.type.type)
+
+def recordViolations(db: Session, violations) -> int:
+    """
+    Insert the rows of a violations SELECT, skipping any already recorded
+    """
+    result = db.execute(
+        pg_insert(model.IntegrityViolation)
+        .from_select([column.name for column in violations.selected_columns], violations)
+        .on_conflict_do_nothing(index_elements=["key"])
+    )
+    return result.rowcount
+
+def checkUnbalancedJournals(db: Session, low: int, high: int, start: datetime, end: datetime) -> int:
+    net = func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=-model.JournalEntry.amount))
+    return recordViolations(db, (
+        select(
+            (literal("unbalanced:") + cast(model.JournalEntry.journalId, String)).label("key"),
+            getViolationType(schemas.IntegrityViolationType.UNBALANCED_JOURNAL).label("type"),
+            model.JournalEntry.journalId.label("journalId"),
+            literal(0).label("expected"),
+            net.label("actual"),
+        )
+        .where(model.JournalEntry.journalId > low, model.JournalEntry.journalId <= high, model.JournalEntry.date.between(start, end))
+        .group_by(model.JournalEntry.journalId)
+        .having(net != 0)
+    ))
+
+def checkWalletJournals(db: Session, low: int, high: int, start: datetime, end: datetime) -> int:
+    """
+    Every journal with wallet transactions must move the wallet holding accounts by exactly their net amount
+    """
+    holding_accounts = select(model.WalletGroup.holdingAccountId)
+    wallet_side = (
+        select(
+            model.WalletTransaction.journalId,
+            func.sum(case((model.WalletTransaction.type.in_(wallet_inflow_types), model.WalletTransaction.amount), else_=-model.WalletTransaction.amount)).label("amount"),
+        )
+        .where(model.WalletTransaction.journalId > low, model.WalletTransaction.journalId <= high)
+        .group_by(model.WalletTransaction.journalId)
+        .subquery()
+    )
+    # holding accounts are liabilities: credits add to wallets, debits take from them
+    entry_side = (
+        select(
+            model.JournalEntry.journalId,
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=-model.JournalEntry.amount)).label("amount"),
+        )
+        .where(
+            model.JournalEntry.journalId > low,
+            model.JournalEntry.journalId <= high,
+            model.JournalEntry.date.between(start, end),
+            model.JournalEntry.accountId.in_(holding_accounts),
+        )
+        .group_by(model.JournalEntry.journalId)
+        .subquery()
+    )
+    expected = func.coalesce(entry_side.c.amount, 0)
+    return recordViolations(db, (
+        select(
+            (literal("wallet:") + cast(wallet_side.c.journalId, String)).label("key"),
+            getViolationType(schemas.IntegrityViolationType.WALLET_MISMATCH).label("type"),
+            wallet_side.c.journalId.label("journalId"),
+            expected.label("expected"),
+            wallet_side.c.amount.label("actual"),
+        )
+        .select_from(wallet_side.outerjoin(entry_side, entry_side.c.journalId == wallet_side.c.journalId))
+        .where(expected != wallet_side.c.amount)
+    ))
+
+def checkPortfolioLedgers(db: Session, start: datetime, end: datetime) -> int:
+    """
+    For each whole day in [start, end), portfolio asset ledgers per product group must net to the entries on its asset account.
+    Ledgers carry no journal id, so this compares daily totals rather than single journals.
+
+    Deposit interest sits on the asset account too: accruals debit it by the gross interest booked IN to the interest
+    ledger, and maturities and income payouts credit it by the interest booked OUT, so interest rows count alongside
+    asset rows. Withholding tax is settled against the payable and tax accounts and never touches the asset account.
+    """
+    ledger = model.PortfolioLedger.__table__
+    variable = model.VariableLedger.__table__
+    deposit = model.DepositLedger.__table__
+    transaction = model.PortfolioTransaction.__table__
+    day = cast(ledger.c.date, Date)
+    ledger_side = (
+        select(
+            model.ProductGroup.assetAccountId.label("accountId"),
+            day.label("day"),
+            func.sum(case((ledger.c.side == schemas.UserLedgerSide.IN, ledger.c.amount), else_=-ledger.c.amount)).label("amount"),
+        )
+        .select_from(
+            ledger
+            .outerjoin(variable, variable.c.id == ledger.c.id)
+            .outerjoin(deposit, deposit.c.id == ledger.c.id)
+            .outerjoin(model.PortfolioDeposit, model.PortfolioDeposit.id == deposit.c.portfolioDepositId)
+            .outerjoin(transaction, transaction.c.id == model.PortfolioDeposit.transactionId)
+            .join(model.Product, model.Product.id == func.coalesce(variable.c.variableId, transaction.c.productId))
+            .join(model.ProductGroup, model.ProductGroup.id == model.Product.productGroupId)
+        )
+        .where(ledger.c.account.in_(asset_ledger_accounts), ledger.c.date >= start, ledger.c.date < end)
+        .group_by(model.ProductGroup.assetAccountId, day)
+        .subquery()
+    )
+    entry_day = cast(model.JournalEntry.date, Date)
+    entry_side = (
+        select(
+            model.JournalEntry.accountId,
+            entry_day.label("day"),
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=-model.JournalEntry.amount)).label("amount"),
+        )
+        .where(
+            model.JournalEntry.accountId.in_(select(model.ProductGroup.assetAccountId)),
+            model.JournalEntry.date >= start,
+            model.JournalEntry.date < end,
+        )
+        .group_by(model.JournalEntry.accountId, entry_day)
+        .subquery()
+    )
+    account_id = func.coalesce(ledger_side.c.accountId, entry_side.c.accountId)
+    violation_day = func.coalesce(ledger_side.c.day, entry_side.c.day)
+    expected = func.coalesce(entry_side.c.amount, 0)
+    actual = func.coalesce(ledger_side.c.amount, 0)
+    return recordViolations(db, (
+        select(
+            (literal("portfolio_ledger:") + cast(account_id, String) + literal(":") + cast(violation_day, String)).label("key"),
+            getViolationType(schemas.IntegrityViolationType.PORTFOLIO_LEDGER_MISMATCH).label("type"),
+            account_id.label("accountId"),
+            cast(violation_day, model.IntegrityViolation.__table__.c.date.type).label("date"),
+            expected.label("expected"),
+            actual.label("actual"),
+        )
+        .select_from(ledger_side.join(
+            entry_side,
+            and_(entry_side.c.accountId == ledger_side.c.accountId, entry_side.c.day == ledger_side.c.day),
+            full=True,
+        ))
+        .where(expected != actual)
+    ))
+
+def checkJournalRange(db: Session, low: int, high: int) -> dict:
+    """
+    Validate the journals with ids in (low, high] with grouped aggregates. The caller commits.
+
+    Entry scans are bounded by the range's journal dates so only the matching monthly partitions are read.
+
+    Returns:
+        dict: journals checked and violations found per check
+    """
+    journals, start, end = db.execute(
+        select(func.count(), func.min(model.Journal.date), func.max(model.Journal.date))
+        .where(model.Journal.id > low, model.Journal.id <= high)
+    ).one()
+    if not journals:
+        return {"journals": 0, "unbalanced": 0, "wallet": 0, "portfolioLedger": 0}
+    days_start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    days_end = end.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return {
+        "journals": journals,
+        "unbalanced": checkUnbalancedJournals(db, low, high, start, end),
+        "wallet": checkWalletJournals(db, low, high, start, end),
+        "portfolioLedger": checkPortfolioLedgers(db, days_start, days_end),
+    }
+
+def lockIntegrityCheckpoint(db: Session, name: str) -> model.IntegrityCheckpoint:
+    """
+    Get or create a check's high-water mark and lock it, so concurrent runs take turns
+    """
+    db.execute(
+        pg_insert(model.IntegrityCheckpoint)
+        .values(name=name, lastId=0, checkedCount=0)
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    return db.execute(
+        select(model.IntegrityCheckpoint).where(model.IntegrityCheckpoint.name == name).with_for_update()
+    ).scalar_one()
+
+def runIntegrityCheck(db: Session, chunk_size: int = settings.INTEGRITY_CHUNK_SIZE) -> dict:
+    """
+    Check the journals posted since the last run, one chunk per database transaction, advancing the high-water mark.
+
+    Each run starts INTEGRITY_LOOKBACK_IDS behind the mark, because a journal id can commit after a higher one;
+    violations are keyed, so re-checking them records nothing twice.
+    """
+    totals = {"journals": 0, "unbalanced": 0, "wallet": 0, "portfolioLedger": 0}
+    checkpoint = lockIntegrityCheckpoint(db, journal_check)
+    low = max(checkpoint.lastId - settings.INTEGRITY_LOOKBACK_IDS, 0)
+    latest = db.execute(select(func.max(model.Journal.id))).scalar() or 0
+    while low < latest:
+        high = min(low + chunk_size, latest)
+        counts = checkJournalRange(db, low, high)
+        for name, count in counts.items():
+            totals[name] += count
+        checkpoint.lastId = max(checkpoint.lastId, high)
+        checkpoint.checkedCount += counts["journals"]
+        db.add(checkpoint)
+        db.commit()
+        low = high
+        if low < latest:
+            checkpoint = lockIntegrityCheckpoint(db, journal_check)
+    db.commit()
+    return totals
+
+def getJournalRanges(db: Session, chunk_size: int = settings.INTEGRITY_CHUNK_SIZE) -> list[tuple[int, int]]:
+    """
+    Split the whole journal id space into (low, high] ranges for a parallel full revalidation
+    """
+    latest = db.execute(select(func.max(model.Journal.id))).scalar() or 0
+    return [(low, min(low + chunk_size, latest)) for low in range(0, latest, chunk_size)]
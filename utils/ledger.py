@@ -0,0 +1,585 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+import numpy as np
+from sqlalchemy import insert, select, update, func, case, event, bindparam, inspect, literal, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
+from config import settings
+import model
+import schemas
+from utils.cache import getCached, setCached, deleteCached
+
+logger = logging.getLogger(__name__)
+
+def getDayStart(date: datetime) -> datetime:
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def applyBalances(connection: Connection, entries: list[dict]) -> bool:
+    """
+    Add posted entries to the running account totals and to every checkpoint on or after their date
+
+    Args:
+        entries: dicts with accountId, amount (minor units), side and date
+
+    Returns:
+        bool: whether any entry is dated before today, so past trial balances changed
+    """
+    totals = defaultdict(lambda: [0, 0])
+    dated = defaultdict(lambda: [0, 0])
+    for entry in entries:
+        index = 0 if entry["side"] == schemas.EntrySide.DEBIT else 1
+        totals[entry["accountId"]][index] += entry["amount"]
+        dated[(entry["accountId"], getDayStart(entry["date"]))][index] += entry["amount"]
+    if not totals:
+        return False
+
+    # rows in account order so concurrent posts lock balances in the same order
+    upsert = pg_insert(model.AccountBalance).values([
+        {"accountId": account_id, "debit": debit, "credit": credit}
+        for account_id, (debit, credit) in sorted(totals.items())
+    ])
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=[model.AccountBalance.accountId],
+        set_={
+            "debit": model.AccountBalance.debit + upsert.excluded.debit,
+            "credit": model.AccountBalance.credit + upsert.excluded.credit,
+            "updatedAt": func.now(),
+        },
+    ))
+
+    # checked after the balance upsert: a close in progress holds these rows, so this read sees its commit
+    closed_through = connection.execute(select(func.max(model.AccountingPeriod.end)).where(model.AccountingPeriod.closed == True)).scalar()
+    if closed_through is not None and min(entry["date"] for entry in entries) < closed_through:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Accounting period closed through {closed_through.isoformat()}; post to an open period")
+
+    # only back-dated posts touch any checkpoint rows
+    checkpoints = model.AccountBalanceCheckpoint.__table__
+    connection.execute(
+        update(checkpoints)
+        .where(checkpoints.c.accountId == bindparam("b_account_id"), checkpoints.c.date >= bindparam("b_date"))
+        .values(debit=checkpoints.c.debit + bindparam("b_debit"), credit=checkpoints.c.credit + bindparam("b_credit")),
+        [
+            {"b_account_id": account_id, "b_date": date, "b_debit": debit, "b_credit": credit}
+            for (account_id, date), (debit, credit) in sorted(dated.items())
+        ],
+    )
+    return min(date for _, date in dated) < getDayStart(datetime.now())
+
+@event.listens_for(Session, "after_flush")
+def applyFlushedEntries(session: Session, flush_context) -> None:
+    """
+    Keep balances in step with journals built through the ORM
+    """
+    entries = [obj for obj in session.new if isinstance(obj, model.JournalEntry)]
+    if not entries:
+        return
+    now = datetime.now()
+    rows = []
+    for entry in entries:
+        # read loaded state only: lazy loads are not allowed inside a flush
+        journal = inspect(entry).dict.get("journal")
+        date = inspect(entry).dict.get("date") or (inspect(journal).dict.get("date") if journal is not None else None)
+        rows.append({"accountId": entry.accountId, "amount": entry.amount, "side": entry.side, "date": date or now})
+    if applyBalances(session.connection(), rows):
+        session.info["trialBalanceStale"] = True
+
+@event.listens_for(Session, "after_commit")
+def expireTrialBalances(session: Session) -> None:
+    if session.info.pop("trialBalanceStale", False):
+        deleteCached("trial_balance:*")
+
+@event.listens_for(Session, "after_rollback")
+def keepTrialBalances(session: Session) -> None:
+    session.info.pop("trialBalanceStale", None)
+
+def postJournals(db: Session, journals: list[dict]) -> list[Optional[int]]:
+    """
+    Post many balanced journals with one multi-row insert for the journals and one for all their entries. The caller commits.
+
+    Balance is checked for every journal at once before anything is written, and again over the
+    inserted rows in the database before the ids are returned.
+
+    Args:
+        journals: dicts with date and entries; entries are dicts with accountId, amount (minor units), side and description
+
+    Returns:
+        list: journal id per input journal, None where every entry is zero
+    """
+    journals = [
+        {**journal, "entries": [entry for entry in journal["entries"] if entry["amount"]]}
+        for journal in journals
+    ]
+    indexes = [index for index, journal in enumerate(journals) if journal["entries"]]
+    if not indexes:
+        return [None] * len(journals)
+
+    positions = np.array([position for position, index in enumerate(indexes) for _ in journals[index]["entries"]], dtype=np.int64)
+    amounts = np.array([entry["amount"] for index in indexes for entry in journals[index]["entries"]], dtype=np.int64)
+    debits = np.array([entry["side"] == schemas.EntrySide.DEBIT for index in indexes for entry in journals[index]["entries"]])
+    if (amounts < 0).any():
+        raise Exception("Journal entries must have positive amounts")
+    net = np.zeros(len(indexes), dtype=np.int64)
+    np.add.at(net, positions, np.where(debits, amounts, -amounts))
+    unbalanced = np.flatnonzero(net)
+    if unbalanced.size:
+        raise Exception(f"Unbalanced journals at positions {[indexes[position] for position in unbalanced[:10]]}: net {net[unbalanced[:10]].tolist()}")
+
+    journal_ids = db.execute(
+        insert(model.Journal).returning(model.Journal.id, sort_by_parameter_order=True),
+        [{"date": journals[index]["date"]} for index in indexes],
+    ).scalars().all()
+    db.execute(insert(model.JournalEntry), [
+        {**entry, "journalId": journal_id, "date": journals[index]["date"]}
+        for index, journal_id in zip(indexes, journal_ids)
+        for entry in journals[index]["entries"]
+    ])
+
+    # the rows as stored must balance too; one grouped pass over the new journals
+    unbalanced_ids = db.execute(
+        select(model.JournalEntry.journalId)
+        .where(
+            model.JournalEntry.journalId.in_(journal_ids),
+            model.JournalEntry.date.between(min(journals[index]["date"] for index in indexes), max(journals[index]["date"] for index in indexes)),
+        )
+        .group_by(model.JournalEntry.journalId)
+        .having(func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=-model.JournalEntry.amount)) != 0)
+    ).scalars().all()
+    if unbalanced_ids:
+        raise Exception(f"Unbalanced journals stored: {unbalanced_ids[:10]}")
+
+    if applyBalances(db.connection(), [
+        {**entry, "date": journals[index]["date"]}
+        for index in indexes
+        for entry in journals[index]["entries"]
+    ]):
+        db.info["trialBalanceStale"] = True
+
+    ids = [None] * len(journals)
+    for index, journal_id in zip(indexes, journal_ids):
+        ids[index] = journal_id
+    return ids
+
+def postJournal(db: Session, date: datetime, entries: list[dict]) -> Optional[int]:
+    """
+    Post one balanced journal. The caller commits.
+
+    Returns:
+        int: journal id, or None when every entry is zero
+    """
+    return postJournals(db, [{"date": date, "entries": entries}])[0]
+
+def sumEntries(db: Session, account_id: int, start: Optional[datetime], end: datetime) -> tuple[int, int]:
+    """
+    Debit and credit totals of an account for journals dated in [start, end]
+    """
+    query = (
+        select(
+            func.coalesce(func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=0)), 0),
+        )
+        .where(model.JournalEntry.accountId == account_id, model.JournalEntry.date <= end)
+    )
+    if start is not None:
+        query = query.where(model.JournalEntry.date >= start)
+    debit, credit = db.execute(query).one()
+    return int(debit), int(credit)
+
+def getArchivedThrough(db: Session) -> Optional[datetime]:
+    """
+    End of the archived journal entry partitions; entries dated before it are no longer in the table
+    """
+    return db.execute(select(func.max(model.ArchivedPartition.rangeEnd)).where(model.ArchivedPartition.tableName == "journalentry")).scalar()
+
+def checkArchivedHistory(db: Session, as_of: datetime) -> None:
+    """
+    Refuse a past balance read whose nearest checkpoint predates archived journal entries, as it would sum without them
+    """
+    archived_through = getArchivedThrough(db)
+    if archived_through is None:
+        return
+    # a checkpoint holds totals through the end of its day
+    covered = db.execute(
+        select(func.min(model.AccountBalanceCheckpoint.date)).where(model.AccountBalanceCheckpoint.date >= archived_through - timedelta(days=1))
+    ).scalar()
+    if covered is None or covered >= getDayStart(as_of):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Journal entries before {archived_through.date().isoformat()} are archived; balances can be read as of {(covered + timedelta(days=1)).date().isoformat() if covered else 'the next checkpoint'} or later",
+        )
+
+def getAccountBalance(db: Session, account_id: int, as_of: Optional[datetime] = None) -> dict:
+    """
+    Debit and credit totals of an account, now or as of a date
+
+    A past date reads the latest checkpoint before it and scans only the entries posted since; dates before
+    the first checkpoint covering archived entries are refused.
+    """
+    if as_of is None or as_of >= datetime.now():
+        balance = db.get(model.AccountBalance, account_id)
+        return {"debit": balance.debit if balance else 0, "credit": balance.credit if balance else 0, "asOf": datetime.now()}
+
+    checkArchivedHistory(db, as_of)
+    checkpoint = db.execute(
+        select(model.AccountBalanceCheckpoint)
+        .where(
+            model.AccountBalanceCheckpoint.accountId == account_id,
+            model.AccountBalanceCheckpoint.date < getDayStart(as_of),
+        )
+        .order_by(model.AccountBalanceCheckpoint.date.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+    if checkpoint is None:
+        debit, credit = sumEntries(db, account_id, None, as_of)
+    else:
+        debit, credit = sumEntries(db, account_id, checkpoint.date + timedelta(days=1), as_of)
+        debit += checkpoint.debit
+        credit += checkpoint.credit
+    return {"debit": debit, "credit": credit, "asOf": as_of}
+
+def getAccountBalances(db: Session, as_of: Optional[datetime] = None) -> dict[int, tuple[int, int]]:
+    """
+    Debit and credit totals of every account, now or as of a date, from checkpoints and one grouped delta query
+    """
+    if as_of is None or as_of >= datetime.now():
+        return {
+            account_id: (debit, credit)
+            for account_id, debit, credit in db.execute(
+                select(model.AccountBalance.accountId, model.AccountBalance.debit, model.AccountBalance.credit)
+            ).all()
+        }
+
+    checkArchivedHistory(db, as_of)
+    checkpoints = {
+        account_id: (date, debit, credit)
+        for account_id, date, debit, credit in db.execute(
+            select(
+                model.AccountBalanceCheckpoint.accountId,
+                model.AccountBalanceCheckpoint.date,
+                model.AccountBalanceCheckpoint.debit,
+                model.AccountBalanceCheckpoint.credit,
+            )
+            .where(model.AccountBalanceCheckpoint.date < getDayStart(as_of))
+            .distinct(model.AccountBalanceCheckpoint.accountId)
+            .order_by(model.AccountBalanceCheckpoint.accountId, model.AccountBalanceCheckpoint.date.desc())
+        ).all()
+    }
+    latest = (
+        select(model.AccountBalanceCheckpoint.accountId, model.AccountBalanceCheckpoint.date)
+        .where(model.AccountBalanceCheckpoint.date < getDayStart(as_of))
+        .distinct(model.AccountBalanceCheckpoint.accountId)
+        .order_by(model.AccountBalanceCheckpoint.accountId, model.AccountBalanceCheckpoint.date.desc())
+        .subquery()
+    )
+    delta = (
+        select(
+            model.JournalEntry.accountId,
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=0)),
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=0)),
+        )
+        .outerjoin(latest, latest.c.accountId == model.JournalEntry.accountId)
+        .where(
+            model.JournalEntry.date <= as_of,
+            or_(latest.c.date == None, model.JournalEntry.date >= latest.c.date + timedelta(days=1)),
+        )
+        .group_by(model.JournalEntry.accountId)
+    )
+    # a sargable lower bound when every posting account has a checkpoint, which is the normal case
+    if checkpoints:
+        posted = set(db.execute(select(model.AccountBalance.accountId)).scalars().all())
+        if posted <= checkpoints.keys():
+            delta = delta.where(model.JournalEntry.date >= min(date for date, _, _ in checkpoints.values()) + timedelta(days=1))
+
+    balances = {account_id: (debit, credit) for account_id, (_, debit, credit) in checkpoints.items()}
+    for account_id, debit, credit in db.execute(delta).all():
+        base_debit, base_credit = balances.get(account_id, (0, 0))
+        balances[account_id] = (base_debit + int(debit or 0), base_credit + int(credit or 0))
+    return balances
+
+def getAccounts(db: Session) -> list:
+    """
+    The chart of accounts as mappings, for building statements
+    """
+    return db.execute(
+        select(
+            model.Account.id,
+            model.Account.code,
+            model.Account.name,
+            model.Account.level,
+            model.Account.parent_id,
+            model.Account.is_header,
+            model.Account.account_type,
+        )
+    ).mappings().all()
+
+def rollUpAccounts(accounts: list, balances: dict[int, tuple[int, int]]) -> tuple[dict[int, dict], dict[int, list[int]]]:
+    """
+    Account rows with their debit, credit and normal-side balance, header accounts summed from their children
+
+    Returns:
+        tuple: rows by account id, and child account ids by account id
+    """
+    rows = {
+        account["id"]: {
+            "id": account["id"],
+            "code": account["code"],
+            "name": account["name"],
+            "level": account["level"],
+            "parentId": account["parent_id"],
+            "isHeader": account["is_header"],
+            "accountType": account["account_type"].value,
+            "debit": balances.get(account["id"], (0, 0))[0],
+            "credit": balances.get(account["id"], (0, 0))[1],
+        }
+        for account in accounts
+    }
+    children = defaultdict(list)
+    for row in rows.values():
+        if row["parentId"] in rows:
+            children[row["parentId"]].append(row["id"])
+
+    # post-order walk so every header is summed after all of its descendants
+    order = []
+    stack = [(row["id"], False) for row in rows.values() if row["parentId"] not in rows]
+    while stack:
+        account_id, expanded = stack.pop()
+        if expanded:
+            order.append(account_id)
+            continue
+        stack.append((account_id, True))
+        stack.extend((child_id, False) for child_id in children[account_id])
+    for account_id in order:
+        row = rows[account_id]
+        for child_id in children[account_id]:
+            row["debit"] += rows[child_id]["debit"]
+            row["credit"] += rows[child_id]["credit"]
+
+    for row in rows.values():
+        debit_normal = row["accountType"] in [schemas.AccountType.ASSET.value, schemas.AccountType.EXPENSE.value]
+        row["balance"] = row["debit"] - row["credit"] if debit_normal else row["credit"] - row["debit"]
+    return rows, children
+
+def getTrialBalance(db: Session, as_of: Optional[datetime] = None) -> dict:
+    """
+    Trial balance over the whole chart, with header accounts rolled up from their children
+
+    Leaf totals come from getAccountBalances; the roll-up is one pass over the account tree in memory.
+    Results are cached per as-of date and dropped when a back-dated post changes them.
+    """
+    key = f"trial_balance:{as_of.isoformat() if as_of else 'current'}"
+    cached = getCached(key)
+    if cached is not None:
+        return cached
+
+    accounts = getAccounts(db)
+    rows, children = rollUpAccounts(accounts, getAccountBalances(db, as_of))
+
+    leaf_debit = leaf_credit = 0
+    for account_id, row in rows.items():
+        if not children[account_id]:
+            leaf_debit += row["debit"]
+            leaf_credit += row["credit"]
+
+    result = {
+        "asOf": (as_of or datetime.now()).isoformat(),
+        "accounts": sorted(rows.values(), key=lambda row: str(row["code"])),
+        "totalDebit": leaf_debit,
+        "totalCredit": leaf_credit,
+        "balanced": leaf_debit == leaf_credit,
+    }
+    setCached(key, result, settings.TRIAL_BALANCE_CACHE_SECONDS if as_of is None or as_of >= getDayStart(datetime.now()) else 86400)
+    return result
+
+def checkpointAccountBalances(db: Session, date: datetime) -> int:
+    """
+    Write the closing totals of every account for date. The caller commits.
+
+    Closing totals are the running totals less anything dated after the day, so this
+    runs shortly after midnight when that tail is small.
+    """
+    date = getDayStart(date)
+    # hold posts until the checkpoint commits, so back-dated ones land on it
+    db.execute(select(model.AccountBalance.accountId).with_for_update(read=True)).all()
+    later = (
+        select(
+            model.JournalEntry.accountId,
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=0)).label("debit"),
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=0)).label("credit"),
+        )
+        .where(model.JournalEntry.date >= date + timedelta(days=1))
+        .group_by(model.JournalEntry.accountId)
+        .subquery()
+    )
+    result = db.execute(
+        pg_insert(model.AccountBalanceCheckpoint)
+        .from_select(
+            ["accountId", "date", "debit", "credit"],
+            select(
+                model.AccountBalance.accountId,
+                literal(date),
+                model.AccountBalance.debit - func.coalesce(later.c.debit, 0),
+                model.AccountBalance.credit - func.coalesce(later.c.credit, 0),
+            ).outerjoin(later, later.c.accountId == model.AccountBalance.accountId)
+        )
+        .on_conflict_do_nothing()
+    )
+    return result.rowcount
+
+def closePeriod(db: Session, start: datetime, end: datetime) -> model.AccountingPeriod:
+    """
+    Close the period [start, end) and freeze every account's totals for it into PeriodBalance. The caller commits.
+
+    Periods close in order: the first may start anywhere, each later one starts where the last closed one ended.
+    Closing totals come from the checkpoints; opening totals are the previous period's closing ones.
+    """
+    if end <= start or end > datetime.now():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A period must end after it starts and no later than now")
+    previous = db.execute(
+        select(model.AccountingPeriod)
+        .where(model.AccountingPeriod.closed == True)
+        .order_by(model.AccountingPeriod.end.desc())
+        .limit(1)
+        .with_for_update()
+    ).scalar_one_or_none()
+    if previous is not None and previous.end != start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"The next period to close starts at {previous.end.isoformat()}")
+
+    period = db.execute(select(model.AccountingPeriod).where(model.AccountingPeriod.start == start)).scalar_one_or_none()
+    if period is None:
+        period = model.AccountingPeriod(start=start, end=end)
+        db.add(period)
+        db.flush()
+    elif period.closed:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Period already closed")
+    period.end = end
+
+    # hold posts until the close commits; they then see the period closed and are rejected
+    db.execute(select(model.AccountBalance.accountId).with_for_update(read=True)).all()
+    last = timedelta(microseconds=1)
+    closing = getAccountBalances(db, end - last)
+    if previous is not None:
+        opening = {
+            account_id: (debit, credit)
+            for account_id, debit, credit in db.execute(
+                select(model.PeriodBalance.accountId, model.PeriodBalance.closingDebit, model.PeriodBalance.closingCredit)
+                .where(model.PeriodBalance.periodId == previous.id)
+            ).all()
+        }
+    else:
+        opening = getAccountBalances(db, start - last)
+
+    rows = []
+    for account_id in sorted(closing.keys() | opening.keys()):
+        closing_debit, closing_credit = closing.get(account_id, (0, 0))
+        opening_debit, opening_credit = opening.get(account_id, (0, 0))
+        rows.append({
+            "periodId": period.id,
+            "accountId": account_id,
+            "debit": closing_debit - opening_debit,
+            "credit": closing_credit - opening_credit,
+            "closingDebit": closing_debit,
+            "closingCredit": closing_credit,
+        })
+    if rows:
+        db.execute(insert(model.PeriodBalance), rows)
+    period.closed = True
+    period.closedAt = datetime.now()
+    db.add(period)
+    return period
+
+def getFinancialStatements(db: Session, period: model.AccountingPeriod) -> dict:
+    """
+    Balance sheet at the end of a closed period and income statement for it, read from its PeriodBalance snapshot
+    """
+    key = f"financial_statements:{period.id}"
+    cached = getCached(key)
+    if cached is not None:
+        return cached
+
+    snapshot = db.execute(
+        select(model.PeriodBalance.accountId, model.PeriodBalance.debit, model.PeriodBalance.credit, model.PeriodBalance.closingDebit, model.PeriodBalance.closingCredit)
+        .where(model.PeriodBalance.periodId == period.id)
+    ).all()
+    accounts = getAccounts(db)
+    position, children = rollUpAccounts(accounts, {row.accountId: (row.closingDebit, row.closingCredit) for row in snapshot})
+    activity, _ = rollUpAccounts(accounts, {row.accountId: (row.debit, row.credit) for row in snapshot})
+
+    def getSection(rows: dict, types: list[schemas.AccountType]) -> tuple[list[dict], int]:
+        section = sorted([row for row in rows.values() if row["accountType"] in [type.value for type in types]], key=lambda row: str(row["code"]))
+        # leaves only, so headers are not counted twice
+        return section, sum(row["balance"] for row in section if not children[row["id"]])
+
+    income_types = [schemas.AccountType.REVENUE, schemas.AccountType.INCOME]
+    assets, total_assets = getSection(position, [schemas.AccountType.ASSET])
+    liabilities, total_liabilities = getSection(position, [schemas.AccountType.LIABILITY])
+    equity, total_equity = getSection(position, [schemas.AccountType.EQUITY])
+    _, cumulative_income = getSection(position, income_types)
+    _, cumulative_expenses = getSection(position, [schemas.AccountType.EXPENSE])
+    # income and expense accounts are not closed out to equity, so their cumulative net is retained earnings
+    retained_earnings = cumulative_income - cumulative_expenses
+    income, total_income = getSection(activity, income_types)
+    expenses, total_expenses = getSection(activity, [schemas.AccountType.EXPENSE])
+
+    result = {
+        "period": {"id": period.id, "start": period.start.isoformat(), "end": period.end.isoformat(), "closedAt": period.closedAt.isoformat()},
+        "balanceSheet": {
+            "assets": assets,
+            "liabilities": liabilities,
+            "equity": equity,
+            "totalAssets": total_assets,
+            "totalLiabilities": total_liabilities,
+            "totalEquity": total_equity,
+            "retainedEarnings": retained_earnings,
+            "balanced": total_assets == total_liabilities + total_equity + retained_earnings,
+        },
+        "incomeStatement": {
+            "income": income,
+            "expenses": expenses,
+            "totalIncome": total_income,
+            "totalExpenses": total_expenses,
+            "netIncome": total_income - total_expenses,
+        },
+    }
+    # a closed period never changes
+    setCached(key, result, 86400)
+    return result
+
+def rebuildAccountBalances(db: Session) -> int:
+    """
+    Recompute every running total from the journal entries in one grouped query. The caller commits.
+
+    Used to seed the table and to repair it. Once journal entries are archived, the totals start from the latest
+    checkpoint, which must cover the archived range, and add the entries dated after it. Checkpoints are rebuilt by
+    deleting them and re-running the checkpoint task, but only while no partition is archived: after that the
+    checkpoints are the only record of the archived totals.
+    """
+    entries = select(
+        model.JournalEntry.accountId,
+        func.sum(case((model.JournalEntry.side == schemas.EntrySide.DEBIT, model.JournalEntry.amount), else_=0)).label("debit"),
+        func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=0)).label("credit"),
+    ).group_by(model.JournalEntry.accountId)
+
+    archived_through = getArchivedThrough(db)
+    if archived_through is None:
+        totals = entries
+    else:
+        base_date = db.execute(select(func.max(model.AccountBalanceCheckpoint.date))).scalar()
+        if base_date is None or base_date < archived_through - timedelta(days=1):
+            raise Exception(f"Journal entries before {archived_through.date().isoformat()} are archived and no checkpoint covers them")
+        base = select(model.AccountBalanceCheckpoint.accountId, model.AccountBalanceCheckpoint.debit, model.AccountBalanceCheckpoint.credit).where(model.AccountBalanceCheckpoint.date == base_date)
+        # accounts missing from the checkpoint had no entries by then, so all of theirs are still in the table
+        since = entries.where(or_(
+            model.JournalEntry.date >= base_date + timedelta(days=1),
+            model.JournalEntry.accountId.not_in(base.with_only_columns(model.AccountBalanceCheckpoint.accountId)),
+        ))
+        combined = base.union_all(since).subquery()
+        totals = select(combined.c.accountId, func.sum(combined.c.debit), func.sum(combined.c.credit)).group_by(combined.c.accountId)
+    upsert = pg_insert(model.AccountBalance).from_select(["accountId", "debit", "credit"], totals)
+    result = db.execute(upsert.on_conflict_do_update(
+        index_elements=[model.AccountBalance.accountId],
+        set_={"debit": upsert.excluded.debit, "credit": upsert.excluded.credit, "updatedAt": func.now()},
+    ))
+    return result.rowcount
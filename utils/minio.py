@@ -62,6 +62,25 @@ async def upload_file(
     except Exception as e:
       raise Exception(f"Failed to upload file: {e}")
 
+def upload_local_file(bucket_name: str, object_name: str, file_path: str, content_type: str) -> int:
+    """
+    Upload a file from disk in multipart chunks, for exports too large to hold in memory
+
+    Returns:
+        int: size of the stored object in bytes
+    """
+    object_name = _normalize_object_name(object_name)
+    if not minio_client.bucket_exists(bucket_name):
+        try:
+            minio_client.make_bucket(bucket_name)
+        except Exception as e:
+            raise Exception(f"Failed to create bucket: {e}")
+    try:
+        minio_client.fput_object(bucket_name, object_name, file_path, content_type=content_type)
+        return minio_client.stat_object(bucket_name, object_name).size
+    except Exception as e:
+        raise Exception(f"Failed to upload file: {e}")
+
 async def get_file(bucket_name: str, file_name: str):
     file_name = _normalize_object_name(file_name)
     try:
@@ -227,4 +246,13 @@ async def validate_image_file(file: UploadFile, max_file_size: int = MAX_FILE_SI
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Error validating file content"
-        )        
\ No newline at end of file
+        )        
+def open_s3_object(bucket_name: str, object_name: str):
+    """
+    Open an S3 object for streaming reads; the caller closes and releases the response
+    """
+    object_name = _normalize_object_name(object_name)
+    try:
+        return minio_client.get_object(bucket_name, object_name)
+    except S3Error as e:
+        raise Exception(f"Error opening S3 object: {e}")
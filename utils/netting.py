@@ -0,0 +1,218 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+import numpy as np
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session, selectinload
+from config import settings
+import model
+import schemas
+from utils.execution import getProductVenue
+from utils.ledger import postJournal
+from utils.holdings import releaseReservations
+from utils.wallet import convertHolds, releaseHolds
+
+logger = logging.getLogger(__name__)
+
+buy_types = [schemas.TransactionType.INVESTMENT, schemas.TransactionType.BUY]
+sell_types = [schemas.TransactionType.LIQUIDATION, schemas.TransactionType.SELL]
+
+def getNettedVenues() -> list[schemas.TransactionVenue]:
+    return [schemas.TransactionVenue(venue) for venue in settings.NETTED_VENUES]
+
+def getWindowEnd(date: datetime, minutes: int = settings.DEALING_WINDOW_MINUTES) -> datetime:
+    """
+    Floor a timestamp to the start of its dealing window; orders placed before it are dealt
+    """
+    midnight = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((date - midnight).total_seconds() // 60)
+    return midnight + timedelta(minutes=elapsed - elapsed % minutes)
+
+def allocateFills(requested: np.ndarray, filled: int) -> np.ndarray:
+    """
+    Allocate filled units pro rata to the requested units (largest remainder, so totals are exact)
+    """
+    total = int(requested.sum())
+    if filled >= total:
+        return requested.copy()
+    if filled <= 0 or total == 0:
+        return np.zeros_like(requested)
+    exact = requested * (filled / total)
+    allocation = np.floor(exact).astype(np.int64)
+    remainder = filled - int(allocation.sum())
+    if remainder > 0:
+        allocation[np.argsort(-(exact - allocation), kind="stable")[:remainder]] += 1
+    return allocation
+
+def placeStandInOrder(db: Session, product: model.Product, side: schemas.TransactionType, units: int, quoted_price: int) -> tuple[int, int]:
+    """
+    Venue APIs are not wired yet: fill the whole order at the window's quoted price
+
+    Returns:
+        tuple: (filled units, fill price in minor units)
+    """
+    return units, quoted_price
+
+venue_adapters = {
+    schemas.TransactionVenue.US_EQUITY: placeStandInOrder,
+    schemas.TransactionVenue.NGX_EQUITY: placeStandInOrder,
+    schemas.TransactionVenue.NG_MUTUAL_FUND: placeStandInOrder,
+}
+
+def netProductOrders(db: Session, product: model.Product, venue: schemas.TransactionVenue, window_end: datetime) -> Optional[dict]:
+    """
+    Net one product's pending orders for a dealing window, send the residual to the venue
+    and allocate the fill back to every order. Runs in the caller's transaction.
+    """
+    transactions = db.execute(
+        select(
+            model.VariableTransaction.id,
+            model.VariableTransaction.portfolioId,
+            model.VariableTransaction.type,
+            model.VariableTransaction.units,
+            model.VariableTransaction.amount,
+            model.VariableTransaction.price,
+        )
+        .where(
+            model.VariableTransaction.productId == product.id,
+            model.VariableTransaction.status == schemas.TransactionStatus.PENDING,
+            model.VariableTransaction.nettedOrderId == None,
+            model.VariableTransaction.date < window_end,
+        )
+        .order_by(model.VariableTransaction.id)
+        .with_for_update(skip_locked=True, of=model.PortfolioTransaction)
+    ).mappings().all()
+    if not transactions:
+        return None
+
+    buys = [transaction for transaction in transactions if transaction["type"] in buy_types]
+    sells = [transaction for transaction in transactions if transaction["type"] in sell_types]
+    buy_units = np.array([transaction["units"] for transaction in buys], dtype=np.int64)
+    sell_units = np.array([transaction["units"] for transaction in sells], dtype=np.int64)
+    total_buy = int(buy_units.sum())
+    total_sell = int(sell_units.sum())
+    net_units = total_buy - total_sell
+
+    all_units = np.array([transaction["units"] for transaction in buys + sells], dtype=np.int64)
+    all_prices = np.array([transaction["price"] for transaction in buys + sells], dtype=np.int64)
+    quoted_price = int(round((all_units * all_prices).sum() / all_units.sum())) if all_units.sum() > 0 else int(all_prices.max())
+
+    side = None
+    if net_units > 0:
+        side = schemas.TransactionType.BUY
+    elif net_units < 0:
+        side = schemas.TransactionType.SELL
+
+    filled_units, price = 0, quoted_price
+    if side is not None:
+        filled_units, price = venue_adapters[venue](db, product, side, abs(net_units), quoted_price)
+
+    # the crossed side is filled in full, the residual side shares the venue fill pro rata
+    buy_allocation = allocateFills(buy_units, total_sell + filled_units) if net_units > 0 else buy_units
+    sell_allocation = allocateFills(sell_units, total_buy + filled_units) if net_units < 0 else sell_units
+
+    netted_order = model.NettedOrder(
+        productId=product.id,
+        venue=venue,
+        windowEnd=window_end,
+        buyUnits=total_buy,
+        sellUnits=total_sell,
+        side=side,
+        orderUnits=abs(net_units),
+        filledUnits=filled_units,
+        price=price,
+        status=schemas.TransactionStatus.COMPLETED if filled_units == abs(net_units) else schemas.TransactionStatus.FAILED if filled_units == 0 else schemas.TransactionStatus.PENDING,
+    )
+    db.add(netted_order)
+    db.flush()
+
+    date = datetime.now()
+    ledgers = []
+    filled = []
+    unfilled = []
+    gross = defaultdict(int)
+    for ledger_side, orders, allocation in [(schemas.UserLedgerSide.IN, buys, buy_allocation), (schemas.UserLedgerSide.OUT, sells, sell_allocation)]:
+        for transaction, units in zip(orders, allocation.tolist()):
+            if units == 0:
+                unfilled.append({"id": transaction["id"], "status": schemas.TransactionStatus.FAILED, "nettedOrderId": netted_order.id})
+                continue
+            amount = transaction["amount"] * units // transaction["units"] if transaction["units"] else transaction["amount"]
+            gross[ledger_side] += amount
+            ledgers.append({
+                "portfolioId": transaction["portfolioId"],
+                "transactionId": transaction["id"],
+                "side": ledger_side,
+                "amount": amount,
+                "date": date,
+                "account": schemas.PortfolioAccount.ASSET,
+                "variableId": product.id,
+                "price": price,
+                "units": units,
+            })
+            filled.append({"id": transaction["id"], "status": schemas.TransactionStatus.COMPLETED, "nettedOrderId": netted_order.id, "units": units, "amount": amount, "price": price})
+
+    if ledgers:
+        db.execute(insert(model.VariableLedger), ledgers)
+    if filled:
+        db.execute(update(model.VariableTransaction), filled)
+    if unfilled:
+        db.execute(update(model.PortfolioTransaction), unfilled)
+    # filled purchases are debited what they filled plus fees, the rest of a partly filled hold goes back; unfilled ones get it all back
+    convertHolds(db, [transaction["id"] for transaction in filled], filled={transaction["id"]: transaction["amount"] for transaction in filled})
+    releaseHolds(db, [transaction["id"] for transaction in unfilled])
+    # every sale is settled by this window: the ledger carries the filled units and the rest go back
+    releaseReservations(db, [transaction["id"] for transaction in sells])
+
+    # one journal per product and window instead of one per order
+    if gross:
+        clearing_account_id = 57 if product.currency == schemas.Currency.USD else 12
+        postJournal(db, date, [
+            {"accountId": clearing_account_id, "amount": gross[schemas.UserLedgerSide.IN], "side": schemas.EntrySide.CREDIT, "description": f"{product.title} netted purchases"},
+            {"accountId": product.productGroup.assetAccountId, "amount": gross[schemas.UserLedgerSide.IN], "side": schemas.EntrySide.DEBIT, "description": f"{product.title} netted purchases"},
+            {"accountId": product.productGroup.assetAccountId, "amount": gross[schemas.UserLedgerSide.OUT], "side": schemas.EntrySide.CREDIT, "description": f"{product.title} netted sales"},
+            {"accountId": clearing_account_id, "amount": gross[schemas.UserLedgerSide.OUT], "side": schemas.EntrySide.DEBIT, "description": f"{product.title} netted sales"},
+        ])
+
+    return {
+        "productId": product.id,
+        "nettedOrderId": netted_order.id,
+        "orders": len(transactions),
+        "side": side.value if side else None,
+        "orderUnits": abs(net_units),
+        "filledUnits": filled_units,
+        "unfilledOrders": len(unfilled),
+    }
+
+def netDealingWindow(db: Session, venue: schemas.TransactionVenue, window_end: datetime) -> list[dict]:
+    """
+    Net every product of a venue for the dealing window ending at window_end, one DB transaction per product
+    """
+    product_ids = db.execute(
+        select(model.VariableTransaction.productId)
+        .where(
+            model.VariableTransaction.status == schemas.TransactionStatus.PENDING,
+            model.VariableTransaction.nettedOrderId == None,
+            model.VariableTransaction.date < window_end,
+        )
+        .distinct()
+    ).scalars().all()
+    products = db.execute(
+        select(model.Product).where(model.Product.id.in_(product_ids)).options(selectinload(model.Product.productGroup))
+    ).scalars().all()
+    db.rollback()
+
+    results = []
+    for product in products:
+        if getProductVenue(product) != venue:
+            continue
+        try:
+            result = netProductOrders(db, product, venue, window_end)
+            db.commit()
+            if result is not None:
+                results.append(result)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to net {venue.value} orders for product {product.id}: {str(e)}")
+            results.append({"productId": product.id, "error": str(e)})
+    return results
@@ -0,0 +1,86 @@
+import logging
+import time
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from config import settings
+import model
+
+logger = logging.getLogger(__name__)
+
+def enqueueTask(db: Session, task_name: str, **kwargs) -> model.TaskOutbox:
+    """
+    Record a task for dispatch in the caller's database transaction.
+
+    The task is published by the outbox relay only once the caller commits,
+    so a rolled back request never dispatches work and a broker outage never loses it.
+    """
+    outbox = model.TaskOutbox(taskName=task_name, kwargs=kwargs)
+    db.add(outbox)
+    return outbox
+
+def relayOutbox(batch_size: int = settings.OUTBOX_BATCH_SIZE) -> int:
+    """
+    Publish one batch of unsent outbox rows to RabbitMQ and mark them sent.
+
+    Rows are claimed with SKIP LOCKED so several relays can run side by side.
+    Publishing uses publisher confirms on a single connection for the whole batch;
+    the outbox task id is reused as the Celery task id so a redelivery after a
+    relay crash is recognisable downstream.
+
+    Returns:
+        int: number of rows published
+    """
+    from celery_app import celery_app
+
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(model.TaskOutbox)
+            .where(model.TaskOutbox.sent == False)
+            .order_by(model.TaskOutbox.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not rows:
+            return 0
+
+        sent_ids = []
+        with celery_app.connection_for_write(transport_options={"confirm_publish": True}) as connection:
+            producer = celery_app.amqp.Producer(connection)
+            for row in rows:
+                try:
+                    celery_app.send_task(row.taskName, kwargs=row.kwargs, task_id=str(row.taskId), producer=producer)
+                    sent_ids.append(row.id)
+                except Exception as e:
+                    logger.error(f"Failed to publish outbox row {row.id} ({row.taskName}): {str(e)}")
+                    row.attempts += 1
+                    row.lastError = str(e)
+                    db.add(row)
+                    break
+
+        if sent_ids:
+            db.execute(
+                update(model.TaskOutbox)
+                .where(model.TaskOutbox.id.in_(sent_ids))
+                .values(sent=True, sentAt=func.now(), attempts=model.TaskOutbox.attempts + 1, lastError=None)
+            )
+        db.commit()
+        return len(sent_ids)
+
+def runRelay(batch_size: int = settings.OUTBOX_BATCH_SIZE, poll_seconds: float = settings.OUTBOX_POLL_SECONDS):
+    """
+    Relay loop: drain the outbox in batches, sleeping only when it is empty
+    """
+    logger.info(f"Outbox relay started (batch size {batch_size})")
+    while True:
+        try:
+            relayed = relayOutbox(batch_size)
+        except Exception as e:
+            logger.error(f"Outbox relay error: {str(e)}")
+            relayed = 0
+        if relayed < batch_size:
+            time.sleep(poll_seconds)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    runRelay()
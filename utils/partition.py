@@ -0,0 +1,163 @@
+import logging
+import os
+import tempfile
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, text, table, column, func
+from sqlalchemy.orm import Session
+from config import settings
+import model
+from utils.export import getArrowSchema
+from utils.minio import upload_local_file
+
+logger = logging.getLogger(__name__)
+
+# append-only tables partitioned monthly on date; each also has a DEFAULT partition as a safety net
+partitioned_tables = ["journalentry", "portfolioledger", "wallettransaction"]
+
+def getMonthStart(date: datetime) -> datetime:
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def addMonths(date: datetime, months: int) -> datetime:
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1)
+
+def getPartitionName(table_name: str, month: datetime) -> str:
+    return f"{table_name}_{month:%Y_%m}"
+
+def getPartitions(db: Session, table_name: str) -> dict[str, datetime]:
+    """
+    Monthly partitions currently attached to a table, by name, with the month they hold
+    """
+    names = db.execute(
+        text("SELECT child.relname FROM pg_inherits JOIN pg_class parent ON parent.oid = inhparent JOIN pg_class child ON child.oid = inhrelid WHERE parent.relname = :table_name"),
+        {"table_name": table_name},
+    ).scalars().all()
+    partitions = {}
+    for name in names:
+        suffix = name[len(table_name) + 1:]
+        try:
+            partitions[name] = datetime.strptime(suffix, "%Y_%m")
+        except ValueError:
+            continue  # the default partition
+    return partitions
+
+def createPartition(db: Session, table_name: str, month: datetime) -> str:
+    """
+    Create and attach one monthly partition, moving any rows for that month out of the default partition
+
+    The new table is filled and given a matching CHECK before it is attached, so attaching does not rescan it
+    and the default partition never holds rows that overlap an attached range.
+    """
+    name = getPartitionName(table_name, month)
+    start = month.strftime("%Y-%m-%d")
+    end = addMonths(month, 1).strftime("%Y-%m-%d")
+    db.execute(text(f'CREATE TABLE "{name}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    db.execute(text(f'ALTER TABLE "{name}" ADD CONSTRAINT "{name}_range" CHECK (date >= \'{start}\' AND date < \'{end}\')'))
+    moved = db.execute(text(f'WITH moved AS (DELETE FROM "{table_name}_default" WHERE date >= \'{start}\' AND date < \'{end}\' RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'))
+    db.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{name}" FOR VALUES FROM (\'{start}\') TO (\'{end}\')'))
+    db.execute(text(f'ALTER TABLE "{name}" DROP CONSTRAINT "{name}_range"'))
+    if moved.rowcount:
+        logger.info(f"Moved {moved.rowcount} rows from {table_name}_default into {name}")
+    return name
+
+def ensurePartitions(db: Session, months_ahead: int = settings.PARTITION_MONTHS_AHEAD) -> list[str]:
+    """
+    Make sure every table has partitions up to months_ahead and one for any month parked in its default partition.
+    The caller commits.
+    """
+    created = []
+    current = getMonthStart(datetime.now())
+    for table_name in partitioned_tables:
+        existing = set(getPartitions(db, table_name).values())
+        parked = db.execute(text(f'SELECT DISTINCT date_trunc(\'month\', date) FROM "{table_name}_default"')).scalars().all()
+        months = {addMonths(current, offset) for offset in range(months_ahead + 1)} | set(parked)
+        for month in sorted(months - existing):
+            created.append(createPartition(db, table_name, month))
+    return created
+
+def exportPartition(db: Session, table_name: str, name: str, path: str) -> int:
+    """
+    Stream one partition into a zstd-compressed Parquet file without holding it in memory
+
+    Returns:
+        int: rows written
+    """
+    parent = model.Base.metadata.tables[table_name]
+    partition = table(name, *[column(col.name) for col in parent.columns])
+    result = db.connection().execution_options(stream_results=True, yield_per=settings.ARCHIVE_BATCH_SIZE).execute(
+        select(partition).order_by(partition.c.id)
+    )
+    schema = getArrowSchema(parent.columns)
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in result.mappings().partitions():
+            records = pa.Table.from_pylist([dict(row) for row in batch], schema=schema)
+            writer.write_table(records)
+            rows += records.num_rows
+    return rows
+
+def archivePartition(db: Session, table_name: str, name: str, month: datetime) -> model.ArchivedPartition:
+    """
+    Export one closed partition to MinIO, then detach and drop it. The caller commits.
+    """
+    object_name = f"{table_name}/{month:%Y/%m}/{name}.parquet"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"{name}.parquet")
+        rows = exportPartition(db, table_name, name, path)
+        size = upload_local_file(settings.ARCHIVE_BUCKET, object_name, path, "application/vnd.apache.parquet") if rows else 0
+        if rows and size != os.path.getsize(path):
+            raise Exception(f"Archive upload of {name} is incomplete: {size} of {os.path.getsize(path)} bytes")
+
+    db.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+    db.execute(text(f'DROP TABLE "{name}"'))
+    archive = model.ArchivedPartition(
+        tableName=table_name,
+        partitionName=name,
+        rangeStart=month,
+        rangeEnd=addMonths(month, 1),
+        objectName=object_name if rows else None,
+        rows=rows,
+        bytes=size,
+    )
+    db.add(archive)
+    return archive
+
+def archivePartitions(db: Session, months: int = settings.ARCHIVE_AFTER_MONTHS) -> list[str]:
+    """
+    Archive every partition of the archivable tables that closed more than `months` months ago.
+    Each partition is committed on its own.
+
+    Only journal entries are archived by default: account balances and as-of queries after the
+    archived range are served from AccountBalance and its checkpoints, so a partition is only
+    archived once a checkpoint exists at or after its end. Ledger and wallet balances are still
+    summed from full history, so those tables are partitioned but not archived.
+
+    Once a journal entry partition is archived, reads that sum its history no longer see it:
+    getAccountBalance(s), and with them the trial balance and period close, refuse as-of dates
+    before the first checkpoint covering the archive; rebuildAccountBalances starts from the latest
+    checkpoint instead of the first entry; and account entry listings and exports, sumEntries and
+    the integrity checks only return what is left in the table, so archived months are read from
+    the Parquet objects. Checkpoints must not be deleted and re-run after that.
+    """
+    cutoff = addMonths(getMonthStart(datetime.now()), -months)
+    latest_checkpoint = db.execute(select(func.max(model.AccountBalanceCheckpoint.date))).scalar()
+    archived = []
+    for table_name in settings.ARCHIVE_TABLES:
+        for name, month in sorted(getPartitions(db, table_name).items(), key=lambda item: item[1]):
+            end = addMonths(month, 1)
+            if end > cutoff:
+                continue
+            if table_name == "journalentry" and (latest_checkpoint is None or latest_checkpoint < end):
+                logger.warning(f"Not archiving {name}: no account balance checkpoint after {end.date()}")
+                continue
+            try:
+                archive = archivePartition(db, table_name, name, month)
+                db.commit()
+                archived.append(name)
+                logger.info(f"Archived {name}: {archive.rows} rows, {archive.bytes} bytes")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Failed to archive {name}: {str(e)}")
+    return archived
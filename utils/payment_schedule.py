@@ -13,7 +13,7 @@ def generate_schedule_dates(
     
     Args:
         start_date (datetime): The starting date
-        frequency (str): The frequency type ('daily', 'weekly', 'monthly', 'quarterly', 'semiannually', 'annually')
+        frequency (str): The frequency type ('daily', 'weekly', 'monthly', 'bimonthly', 'quarterly', 'semiannually', 'annually')
         duration (Optional[int]): The number of periods. If None, 0, or negative, will use default_periods
         default_periods (int): Number of periods to generate when duration is not specified (default: 12)
         
@@ -25,6 +25,7 @@ def generate_schedule_dates(
         'daily': lambda d: d + timedelta(days=1),
         'weekly': lambda d: d + timedelta(weeks=1),
         'monthly': lambda d: d + relativedelta(months=1),
+        'bimonthly': lambda d: d + relativedelta(months=2),
         'quarterly': lambda d: d + relativedelta(months=3),
         'semiannually': lambda d: d + relativedelta(months=6),
         'annually': lambda d: d + relativedelta(years=1)
@@ -44,3 +45,9 @@ def generate_schedule_dates(
         dates.append(current_date)
     
     return dates
+
+def next_schedule_date(date: datetime, frequency: str) -> datetime:
+    """
+    The schedule date that follows date for a frequency
+    """
+    return generate_schedule_dates(date, frequency, duration=2)[1]
@@ -0,0 +1,58 @@
+from typing import Optional
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+from utils.cache import getCached, setCached, deleteCached, evictCached
+
+# only the columns a request needs to authorise and identify its user; relationships are left to the handlers that use them
+principal_columns = [getattr(model.User, field) for field in schemas.UserPrincipal.model_fields]
+
+def getPrincipalKey(email: str) -> str:
+    return f"principal:{email}"
+
+async def loadPrincipal(db: AsyncSession, *criteria) -> Optional[schemas.UserPrincipal]:
+    """
+    Read a user's principal in one narrow query and cache it
+    """
+    row = (await db.execute(select(*principal_columns).where(*criteria))).one_or_none()
+    if row is None:
+        return None
+    principal = schemas.UserPrincipal.model_validate(row._asdict())
+    setCached(getPrincipalKey(principal.email), principal.model_dump(mode="json"), settings.PRINCIPAL_CACHE_SECONDS)
+    return principal
+
+async def getPrincipal(db: AsyncSession, email: str) -> Optional[schemas.UserPrincipal]:
+    cached = getCached(getPrincipalKey(email))
+    if cached is not None:
+        return schemas.UserPrincipal.model_validate(cached)
+    return await loadPrincipal(db, model.User.email == email)
+
+def expirePrincipal(session, email: str) -> None:
+    """
+    Drop a user's cached principal once the session commits. Flushed user changes are noticed on their own;
+    this is for statements the flush does not see, such as a bulk update of the user table.
+    """
+    session.info.setdefault("principalsStale", set()).add(email)
+
+@event.listens_for(Session, "after_flush")
+def noteUserWrite(session: Session, flush_context) -> None:
+    for user in list(session.dirty) + list(session.deleted):
+        if isinstance(user, model.User):
+            # read loaded state only; an email that was never loaded falls back to every principal
+            expirePrincipal(session, inspect(user).dict.get("email", "*"))
+
+@event.listens_for(Session, "after_commit")
+def expirePrincipals(session: Session) -> None:
+    stale = session.info.pop("principalsStale", set())
+    if "*" in stale:
+        deleteCached(getPrincipalKey("*"))
+        return
+    for email in stale:
+        evictCached(getPrincipalKey(email))
+
+@event.listens_for(Session, "after_rollback")
+def keepPrincipals(session: Session) -> None:
+    session.info.pop("principalsStale", None)
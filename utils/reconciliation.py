@@ -0,0 +1,299 @@
+import csv
+import io
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import select, insert, func, case, literal
+from sqlalchemy.orm import Session
+from config import settings
+import model
+import schemas
+from utils.anchor import getAnchorStatement
+from utils.minio import open_s3_object
+from utils.wallet import wallet_inflow_types
+
+logger = logging.getLogger(__name__)
+
+# only money that crossed the bank account shows up on its statement
+statement_types = {"credit": schemas.TransactionType.DEPOSIT, "debit": schemas.TransactionType.WITHDRAWAL}
+
+def parseStatementLine(reference: Optional[str], amount: int, date, direction: str) -> dict:
+    """
+    Normalise a statement line: amount in minor units, naive date, direction credit or debit
+    """
+    return {
+        "reference": reference or None,
+        "amount": amount,
+        "date": date if isinstance(date, datetime) else datetime.fromisoformat(str(date).replace("Z", "+00:00")).replace(tzinfo=None),
+        "direction": direction.lower(),
+    }
+
+def readStatementCsv(bucket_name: str, object_name: str) -> Iterator[dict]:
+    """
+    Stream a statement CSV (reference, amount, date, direction) from MinIO, one line at a time
+    """
+    response = open_s3_object(bucket_name, object_name)
+    try:
+        for row in csv.DictReader(io.TextIOWrapper(response, encoding="utf-8-sig", newline="")):
+            yield parseStatementLine(row.get("reference"), int(Decimal(row["amount"]) * 100), row["date"], row["direction"])
+    finally:
+        response.close()
+        response.release_conn()
+
+def readAnchorStatement(account_id: str, start: datetime, end: datetime, page_size: int = 500) -> Iterator[dict]:
+    """
+    Page through an account's statement from the Anchor API (or its local stand-in)
+    """
+    page = 0
+    while True:
+        data = getAnchorStatement(account_id, start.isoformat(), end.isoformat(), page, page_size).get("data", [])
+        for line in data:
+            attributes = line.get("attributes", {})
+            # Anchor amounts are already in minor units
+            yield parseStatementLine(attributes.get("reference"), int(attributes["amount"]), attributes["createdAt"], attributes["direction"])
+        if len(data) < page_size:
+            return
+        page += 1
+
+def getStatementLines(run: model.ReconciliationRun) -> Iterator[dict]:
+    if run.source.startswith("anchor:"):
+        return readAnchorStatement(run.source.split(":", 1)[1], run.start - timedelta(days=settings.RECONCILIATION_WINDOW_DAYS), run.end)
+    return readStatementCsv(settings.RECONCILIATION_BUCKET, run.source)
+
+class WalletWindow:
+    """
+    Unmatched wallet transactions near the statement lines being matched, hashed on reference and on
+    (direction, amount). Transactions enter in date order as the statement advances and leave, as breaks,
+    once they are older than the earliest date a later line could still match.
+
+    Both hashes keep a date-ordered queue per key, since a bank can reuse a reference; taken transactions
+    are skipped when they reach the head of a queue.
+    """
+
+    def __init__(self, rows: Iterator, window: timedelta):
+        self.rows = rows
+        self.window = window
+        self.next = next(self.rows, None)
+        self.open = {}  # id -> transaction, in date order
+        self.by_reference = {}
+        self.by_amount = {}
+
+    def load(self, until: datetime):
+        while self.next is not None and self.next["date"] <= until:
+            transaction = self.next
+            self.open[transaction["id"]] = transaction
+            if transaction["reference"]:
+                self.by_reference.setdefault(transaction["reference"], deque()).append(transaction)
+            self.by_amount.setdefault((transaction["direction"], transaction["amount"]), deque()).append(transaction)
+            self.next = next(self.rows, None)
+
+    def take(self, transaction: dict) -> dict:
+        # the queues are pruned lazily: taken transactions are skipped when they reach their head
+        del self.open[transaction["id"]]
+        return transaction
+
+    def first(self, queue: Optional[deque]) -> Optional[dict]:
+        while queue and queue[0]["id"] not in self.open:
+            queue.popleft()
+        return queue[0] if queue else None
+
+    def match(self, line: dict) -> tuple[Optional[dict], bool]:
+        """
+        The wallet transaction a statement line settles, and whether the amounts agree
+        """
+        if line["reference"]:
+            transaction = self.first(self.by_reference.get(line["reference"]))
+            if transaction is not None:
+                same = transaction["amount"] == line["amount"] and transaction["direction"] == line["direction"]
+                return self.take(transaction), same
+
+        key = (line["direction"], line["amount"])
+        candidates = self.by_amount.get(key)
+        while candidates and candidates[0]["id"] not in self.open:
+            candidates.popleft()
+        for transaction in candidates or ():
+            if transaction["date"] > line["date"] + self.window:
+                break
+            if transaction["id"] in self.open and abs(transaction["date"] - line["date"]) <= self.window and not (line["reference"] and transaction["reference"]):
+                return self.take(transaction), True
+        return None, False
+
+    def evict(self, before: datetime) -> list[dict]:
+        """
+        Remove and return the transactions no later line can match
+        """
+        evicted = []
+        while self.open:
+            transaction = self.open[next(iter(self.open))]
+            if transaction["date"] >= before:
+                break
+            evicted.append(self.take(transaction))
+        if evicted:
+            self.by_reference = {key: queue for key, queue in self.by_reference.items() if any(item["id"] in self.open for item in queue)}
+            self.by_amount = {key: queue for key, queue in self.by_amount.items() if any(item["id"] in self.open for item in queue)}
+        return evicted
+
+    def drain(self, chunk_size: int) -> Iterator[list[dict]]:
+        """
+        Remove and return everything left once the statement is exhausted: the open transactions, then the rest
+        of the stream, in chunks of at most chunk_size so the tail of a long range is never loaded at once
+        """
+        remaining = chain(self.open.values(), [self.next] if self.next is not None else [], self.rows)
+        self.open, self.next = {}, None
+        self.by_reference, self.by_amount = {}, {}
+        while chunk := list(islice(remaining, chunk_size)):
+            yield chunk
+
+def streamWalletTransactions(connection, run: model.ReconciliationRun) -> Iterator[dict]:
+    direction = case((model.WalletTransaction.type == schemas.TransactionType.DEPOSIT, literal("credit")), else_=literal("debit"))
+    result = connection.execution_options(stream_results=True, yield_per=settings.RECONCILIATION_CHUNK_SIZE).execute(
+        select(
+            model.WalletTransaction.id,
+            model.WalletTransaction.reference,
+            model.WalletTransaction.amount,
+            model.WalletTransaction.date,
+            model.WalletTransaction.journalId,
+            direction.label("direction"),
+        )
+        .join(model.Wallet, model.Wallet.id == model.WalletTransaction.walletId)
+        .where(
+            model.Wallet.walletGroupId == run.walletGroupId,
+            model.WalletTransaction.type.in_(list(statement_types.values())),
+            model.WalletTransaction.status == schemas.TransactionStatus.COMPLETED,
+            model.WalletTransaction.date >= run.start,
+            model.WalletTransaction.date < run.end,
+        )
+        .order_by(model.WalletTransaction.date, model.WalletTransaction.id)
+    )
+    for row in result.mappings():
+        yield dict(row)
+
+def getBreak(run_id: int, type: schemas.ReconciliationBreakType, line: Optional[dict] = None, transaction: Optional[dict] = None) -> dict:
+    source = line or transaction
+    return {
+        "runId": run_id,
+        "type": type,
+        "walletTransactionId": transaction["id"] if transaction else None,
+        "journalId": transaction["journalId"] if transaction else None,
+        "reference": source["reference"],
+        "amount": source["amount"],
+        "expectedAmount": transaction["amount"] if line and transaction else None,
+        "date": source["date"],
+    }
+
+def matchStatement(db: Session, run: model.ReconciliationRun, lines: Iterable[dict], chunk_size: int = settings.RECONCILIATION_CHUNK_SIZE) -> dict:
+    """
+    Match statement lines to wallet transactions with a sliding-window hash join and record the breaks.
+
+    Lines are expected in date order, as banks export them. Only one chunk of lines and the wallet transactions
+    within RECONCILIATION_WINDOW_DAYS of it are held in memory; the wallet side is streamed from a server-side
+    cursor on its own connection so each chunk's breaks can be committed as the run advances.
+    """
+    window = timedelta(days=settings.RECONCILIATION_WINDOW_DAYS)
+    counts = {"lines": 0, "matched": 0, "breaks": 0}
+    lines = iter(lines)
+    with db.get_bind().connect() as connection:
+        wallet = WalletWindow(streamWalletTransactions(connection, run), window)
+        while True:
+            chunk = sorted(islice(lines, chunk_size), key=lambda line: line["date"])
+            if not chunk:
+                break
+            wallet.load(chunk[-1]["date"] + window)
+            breaks = []
+            for line in chunk:
+                transaction, same = wallet.match(line)
+                if transaction is None:
+                    breaks.append(getBreak(run.id, schemas.ReconciliationBreakType.STATEMENT_ONLY, line=line))
+                elif not same:
+                    breaks.append(getBreak(run.id, schemas.ReconciliationBreakType.AMOUNT_MISMATCH, line=line, transaction=transaction))
+                else:
+                    counts["matched"] += 1
+            breaks += [
+                getBreak(run.id, schemas.ReconciliationBreakType.WALLET_ONLY, transaction=transaction)
+                for transaction in wallet.evict(chunk[0]["date"] - window)
+            ]
+            counts["lines"] += len(chunk)
+            counts["breaks"] += len(breaks)
+            if breaks:
+                db.execute(insert(model.ReconciliationBreak), breaks)
+            db.commit()
+
+        # wallet transactions no line matched, streamed and committed a chunk at a time
+        for transactions in wallet.drain(chunk_size):
+            breaks = [getBreak(run.id, schemas.ReconciliationBreakType.WALLET_ONLY, transaction=transaction) for transaction in transactions]
+            db.execute(insert(model.ReconciliationBreak), breaks)
+            counts["breaks"] += len(breaks)
+            db.commit()
+    return counts
+
+def matchJournals(db: Session, run: model.ReconciliationRun) -> int:
+    """
+    Record a break for every journal whose wallet transactions in the run's range do not net to its entries on the
+    wallet group's holding account. One INSERT ... SELECT over two grouped sides, left to the database to hash join.
+    """
+    wallet_group = db.get(model.WalletGroup, run.walletGroupId)
+    inflow = model.WalletTransaction.type.in_(wallet_inflow_types)
+    wallet_side = (
+        select(
+            model.WalletTransaction.journalId,
+            func.min(model.WalletTransaction.id).label("walletTransactionId"),
+            func.min(model.WalletTransaction.date).label("date"),
+            func.sum(case((inflow, model.WalletTransaction.amount), else_=-model.WalletTransaction.amount)).label("amount"),
+        )
+        .join(model.Wallet, model.Wallet.id == model.WalletTransaction.walletId)
+        .where(
+            model.Wallet.walletGroupId == run.walletGroupId,
+            model.WalletTransaction.date >= run.start,
+            model.WalletTransaction.date < run.end,
+        )
+        .group_by(model.WalletTransaction.journalId)
+        .subquery()
+    )
+    # holding accounts are liabilities: credits add to wallets, debits take from them
+    entry_side = (
+        select(
+            model.JournalEntry.journalId,
+            func.sum(case((model.JournalEntry.side == schemas.EntrySide.CREDIT, model.JournalEntry.amount), else_=-model.JournalEntry.amount)).label("amount"),
+        )
+        .where(
+            model.JournalEntry.accountId == wallet_group.holdingAccountId,
+            model.JournalEntry.journalId.in_(select(wallet_side.c.journalId)),
+        )
+        .group_by(model.JournalEntry.journalId)
+        .subquery()
+    )
+    mismatches = (
+        select(
+            literal(run.id).label("runId"),
+            literal(schemas.ReconciliationBreakType.JOURNAL_MISMATCH, model.ReconciliationBreak.__table__.c.type.type).label("type"),
+            wallet_side.c.walletTransactionId,
+            wallet_side.c.journalId,
+            wallet_side.c.amount,
+            func.coalesce(entry_side.c.amount, 0).label("expectedAmount"),
+            wallet_side.c.date,
+        )
+        .select_from(wallet_side.outerjoin(entry_side, entry_side.c.journalId == wallet_side.c.journalId))
+        .where(func.coalesce(entry_side.c.amount, 0) != wallet_side.c.amount)
+    )
+    result = db.execute(
+        insert(model.ReconciliationBreak).from_select(["runId", "type", "walletTransactionId", "journalId", "amount", "expectedAmount", "date"], mismatches)
+    )
+    return result.rowcount
+
+def runReconciliation(db: Session, run: model.ReconciliationRun) -> dict:
+    """
+    Reconcile a run's statement against wallet transactions, then wallet transactions against their journals
+    """
+    counts = matchStatement(db, run, getStatementLines(run))
+    counts["breaks"] += matchJournals(db, run)
+    run.lines = counts["lines"]
+    run.matched = counts["matched"]
+    run.breaks = counts["breaks"]
+    run.status = schemas.TransactionStatus.COMPLETED
+    run.completedAt = datetime.now()
+    db.add(run)
+    db.commit()
+    return counts
@@ -0,0 +1,53 @@
+from typing import Optional
+import jwt
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import settings
+from utils.cache import getCached, setCached
+
+def getRequestUser(request: Request) -> Optional[str]:
+    """
+    The username in a request's bearer token, used only to route its reads; scopes are still checked by the auth dependencies
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    return payload.get("username") or payload.get("email")
+
+def getRecentWriteKey(user: str) -> str:
+    return f"recent_write:{user}"
+
+def markRecentWrite(user: str) -> None:
+    setCached(getRecentWriteKey(user), 1, settings.REPLICA_LAG_SECONDS)
+
+def hasRecentWrite(user: Optional[str]) -> bool:
+    """
+    Whether the user committed a write recently enough that a replica may not have replayed it yet
+    """
+    return user is not None and getCached(getRecentWriteKey(user)) is not None
+
+# request sessions carry their user in session.info; a commit that wrote anything sends that user's reads to the primary for a while
+
+@event.listens_for(Session, "do_orm_execute")
+def noteStatementWrite(orm_execute_state) -> None:
+    if orm_execute_state.session.info.get("user") and (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        orm_execute_state.session.info["wrote"] = True
+
+@event.listens_for(Session, "after_flush")
+def noteFlushWrite(session: Session, flush_context) -> None:
+    if session.info.get("user"):
+        session.info["wrote"] = True
+
+@event.listens_for(Session, "after_commit")
+def recordRecentWrite(session: Session) -> None:
+    if session.info.pop("wrote", False):
+        markRecentWrite(session.info["user"])
+
+@event.listens_for(Session, "after_rollback")
+def forgetWrite(session: Session) -> None:
+    session.info.pop("wrote", None)
@@ -0,0 +1,202 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
+from config import settings
+import model
+import schemas
+from utils.execution import getProductVenue
+from utils.ledger import postJournal
+from utils.wallet import applyWalletDeltas
+
+logger = logging.getLogger(__name__)
+
+wallet_stream = "wallet"
+cash_account_id = 15
+
+purchase_types = [schemas.TransactionType.INVESTMENT, schemas.TransactionType.BUY]
+
+def getTradeCutoff(value_date: datetime, stream: str) -> datetime:
+    """
+    Latest trade time (exclusive) that settles on value_date for a stream (T+n calendar days)
+    """
+    midnight = value_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(days=1) - timedelta(days=settings.SETTLEMENT_DAYS.get(stream, 0))
+
+def lockSettlementRun(db: Session, value_date: datetime, stream: str) -> model.SettlementRun:
+    """
+    Get or create the run row for (value date, stream) and lock it.
+    Every chunk holds this lock, so concurrent runners of a stream take turns and never move the high-water mark back.
+    """
+    db.execute(
+        pg_insert(model.SettlementRun)
+        .values(valueDate=value_date, stream=stream, lastId=0, settledCount=0, completed=False)
+        .on_conflict_do_nothing(index_elements=["valueDate", "stream"])
+    )
+    return db.execute(
+        select(model.SettlementRun)
+        .where(model.SettlementRun.valueDate == value_date, model.SettlementRun.stream == stream)
+        .with_for_update()
+    ).scalar_one()
+
+def settleWalletChunk(db: Session, run: model.SettlementRun, cutoff: datetime, chunk_size: int, after_id: int, skip_locked: bool = True) -> list[int]:
+    """
+    Settle one chunk of wallet deposits and liquidations after after_id: clear the wallet group receivable against cash
+    """
+    ids = db.execute(
+        select(model.WalletTransaction.id)
+        .where(
+            model.WalletTransaction.id > after_id,
+            model.WalletTransaction.settled == False,
+            model.WalletTransaction.status == schemas.TransactionStatus.COMPLETED,
+            model.WalletTransaction.type.in_([schemas.TransactionType.DEPOSIT, schemas.TransactionType.LIQUIDATION]),
+            model.WalletTransaction.date < cutoff,
+        )
+        .order_by(model.WalletTransaction.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=skip_locked)
+    ).scalars().all()
+    if not ids:
+        return []
+
+    totals = db.execute(
+        select(model.WalletGroup.receivableAccountId, func.sum(model.WalletTransaction.amount))
+        .join(model.Wallet, model.Wallet.id == model.WalletTransaction.walletId)
+        .join(model.WalletGroup, model.WalletGroup.id == model.Wallet.walletGroupId)
+        .where(model.WalletTransaction.id.in_(ids))
+        .group_by(model.WalletGroup.receivableAccountId)
+    ).all()
+
+    date = datetime.now()
+    entries = []
+    for receivable_account_id, amount in totals:
+        description = f"Wallet settlement {run.valueDate.date()}"
+        entries.append({"accountId": cash_account_id, "amount": int(amount), "side": schemas.EntrySide.DEBIT, "description": description})
+        entries.append({"accountId": receivable_account_id, "amount": int(amount), "side": schemas.EntrySide.CREDIT, "description": description})
+    postJournal(db, date, entries)
+
+    db.execute(
+        update(model.WalletTransaction)
+        .where(model.WalletTransaction.id.in_(ids))
+        .values(settled=True, settledAt=date)
+    )
+    # settled inflows become available
+    cleared = db.execute(
+        select(model.WalletTransaction.walletId, func.sum(model.WalletTransaction.amount))
+        .where(model.WalletTransaction.id.in_(ids))
+        .group_by(model.WalletTransaction.walletId)
+    ).all()
+    applyWalletDeltas(db, {wallet_id: [int(amount), 0, 0] for wallet_id, amount in cleared})
+    return ids
+
+def settlePortfolioChunk(db: Session, run: model.SettlementRun, cutoff: datetime, product_ids: list[int], chunk_size: int, after_id: int, skip_locked: bool = True) -> list[int]:
+    """
+    Settle one chunk of executed portfolio transactions for a venue after after_id: clear the portfolio clearing account against cash
+    """
+    ids = db.execute(
+        select(model.PortfolioTransaction.id)
+        .where(
+            model.PortfolioTransaction.id > after_id,
+            model.PortfolioTransaction.settlement == schemas.TransactionStatus.PENDING,
+            model.PortfolioTransaction.status == schemas.TransactionStatus.COMPLETED,
+            model.PortfolioTransaction.productId.in_(product_ids),
+            model.PortfolioTransaction.date < cutoff,
+        )
+        .order_by(model.PortfolioTransaction.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=skip_locked)
+    ).scalars().all()
+    if not ids:
+        return []
+
+    totals = db.execute(
+        select(model.Product.currency, model.PortfolioTransaction.type, func.sum(model.PortfolioTransaction.amount))
+        .join(model.Product, model.Product.id == model.PortfolioTransaction.productId)
+        .where(model.PortfolioTransaction.id.in_(ids))
+        .group_by(model.Product.currency, model.PortfolioTransaction.type)
+    ).all()
+
+    date = datetime.now()
+    entries = []
+    for currency, type, amount in totals:
+        clearing_account_id = 57 if currency == schemas.Currency.USD else 12
+        description = f"{run.stream} settlement {run.valueDate.date()}"
+        # purchases pay cash out of the clearing account, sales bring it back in
+        purchase = type in purchase_types
+        entries.append({"accountId": clearing_account_id, "amount": int(amount), "side": schemas.EntrySide.DEBIT if purchase else schemas.EntrySide.CREDIT, "description": description})
+        entries.append({"accountId": cash_account_id, "amount": int(amount), "side": schemas.EntrySide.CREDIT if purchase else schemas.EntrySide.DEBIT, "description": description})
+    postJournal(db, date, entries)
+
+    db.execute(
+        update(model.PortfolioTransaction)
+        .where(model.PortfolioTransaction.id.in_(ids))
+        .values(settlement=schemas.TransactionStatus.COMPLETED)
+    )
+    return ids
+
+def settleStream(db: Session, value_date: datetime, stream: str, chunk_size: int = settings.SETTLEMENT_CHUNK_SIZE) -> dict:
+    """
+    Settle everything due on value_date for one stream ("wallet" or a venue), one chunk per database transaction.
+
+    Journals and status flags of a chunk commit together with the run's high-water mark,
+    so a crashed run is simply started again and resumes after the last settled chunk.
+    Chunks skip rows another transaction has locked, so the mark can pass them; before the
+    run is completed a last pass from the start settles whatever is left, waiting on those locks.
+    """
+    cutoff = getTradeCutoff(value_date, stream)
+    product_ids = []
+    if stream != wallet_stream:
+        venue = schemas.TransactionVenue(stream)
+        products = db.execute(select(model.Product).options(selectinload(model.Product.productGroup))).scalars().all()
+        product_ids = [product.id for product in products if getProductVenue(product) == venue]
+
+    settled = 0
+    # None while chunks skip locked rows, then the id the final locking pass has reached
+    sweep_id = None
+    while True:
+        run = lockSettlementRun(db, value_date, stream)
+        if run.completed:
+            db.commit()
+            break
+        after_id = run.lastId if sweep_id is None else sweep_id
+        if stream == wallet_stream:
+            ids = settleWalletChunk(db, run, cutoff, chunk_size, after_id, skip_locked=sweep_id is None)
+        elif product_ids:
+            ids = settlePortfolioChunk(db, run, cutoff, product_ids, chunk_size, after_id, skip_locked=sweep_id is None)
+        else:
+            ids = []
+        if not ids and sweep_id is None:
+            sweep_id = 0
+            db.commit()
+            continue
+        if not ids:
+            run.completed = True
+            run.completedAt = datetime.now()
+            db.commit()
+            break
+        if sweep_id is None:
+            run.lastId = max(run.lastId, ids[-1])
+        else:
+            sweep_id = ids[-1]
+        run.settledCount += len(ids)
+        db.commit()
+        settled += len(ids)
+        logger.info(f"Settlement {stream} {value_date.date()}: {run.settledCount} settled")
+
+    return {"stream": stream, "settled": settled}
+
+def runSettlement(db: Session, value_date: datetime, chunk_size: int = settings.SETTLEMENT_CHUNK_SIZE) -> list[dict]:
+    """
+    End of day settlement for the wallet and every venue
+    """
+    value_date = value_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    results = []
+    for stream in [wallet_stream] + [venue.value for venue in schemas.TransactionVenue]:
+        try:
+            results.append(settleStream(db, value_date, stream, chunk_size))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Settlement {stream} {value_date.date()} failed: {str(e)}")
+            results.append({"stream": stream, "error": str(e)})
+    return results
@@ -0,0 +1,279 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import select, insert, update, func, case, values, column, Integer, BigInteger
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+import model
+import schemas
+from utils.ledger import postJournal
+
+logger = logging.getLogger(__name__)
+
+wallet_inflow_types = [schemas.TransactionType.DEPOSIT, schemas.TransactionType.LIQUIDATION, schemas.TransactionType.DIVIDEND, schemas.TransactionType.REFUND]
+wallet_outflow_types = [schemas.TransactionType.INVESTMENT, schemas.TransactionType.FEE, schemas.TransactionType.TAX, schemas.TransactionType.WITHDRAWAL]
+# inflows that only become available once end-of-day settlement clears them
+wallet_settling_types = [schemas.TransactionType.DEPOSIT, schemas.TransactionType.LIQUIDATION]
+
+def getWalletBalanceRow(db: Session, wallet_id: int) -> Optional[model.WalletBalance]:
+    """
+    The wallet's balance row in a single primary key read
+    """
+    return db.execute(select(model.WalletBalance).where(model.WalletBalance.walletId == wallet_id)).scalar_one_or_none()
+
+def getWalletBalances(db: Session, wallet_ids: list[int], lock: bool = False) -> dict[int, int]:
+    """
+    Available balance per wallet in minor units, optionally locking the rows for the caller's transaction
+    """
+    if not wallet_ids:
+        return {}
+    query = select(model.WalletBalance.walletId, model.WalletBalance.available).where(model.WalletBalance.walletId.in_(wallet_ids))
+    if lock:
+        query = query.order_by(model.WalletBalance.walletId).with_for_update()
+    return {wallet_id: available for wallet_id, available in db.execute(query).all()}
+
+def getBalanceDeltas(transactions: list[dict]) -> dict[int, list[int]]:
+    """
+    Net (available, ledger, hold) movement per wallet for completed wallet transactions
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for transaction in transactions:
+        if transaction.get("status", schemas.TransactionStatus.COMPLETED) != schemas.TransactionStatus.COMPLETED:
+            continue
+        if transaction["type"] in wallet_outflow_types:
+            deltas[transaction["walletId"]][0] -= transaction["amount"]
+            deltas[transaction["walletId"]][1] -= transaction["amount"]
+        elif transaction["type"] in wallet_inflow_types:
+            if transaction.get("settled") or transaction["type"] not in wallet_settling_types:
+                deltas[transaction["walletId"]][0] += transaction["amount"]
+            deltas[transaction["walletId"]][1] += transaction["amount"]
+    return deltas
+
+def applyWalletDeltas(db: Session, deltas: dict[int, list[int]], versions: Optional[dict[int, int]] = None) -> None:
+    """
+    Move balance rows by (available, ledger, hold) deltas in one conditional UPDATE. The caller commits.
+
+    A wallet whose available balance would go negative, or whose version no longer matches the one the
+    caller read, is left untouched and the whole call fails, so concurrent debits can never overdraw.
+    """
+    deltas = {wallet_id: delta for wallet_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    db.execute(
+        pg_insert(model.WalletBalance)
+        .values([{"walletId": wallet_id, "available": 0, "ledger": 0, "hold": 0, "version": 1} for wallet_id in sorted(deltas)])
+        .on_conflict_do_nothing(index_elements=["walletId"])
+    )
+    rows = values(
+        column("walletId", Integer), column("available", BigInteger), column("ledger", BigInteger), column("hold", BigInteger), column("version", Integer),
+        name="deltas",
+    ).data([
+        (wallet_id, available, ledger, hold, (versions or {}).get(wallet_id, 0))
+        for wallet_id, (available, ledger, hold) in sorted(deltas.items())
+    ])
+    updated = db.execute(
+        update(model.WalletBalance)
+        .where(
+            model.WalletBalance.walletId == rows.c.walletId,
+            # credits always apply; debits only while they leave the balance covered
+            (rows.c.available >= 0) | (model.WalletBalance.available + rows.c.available >= 0),
+            (rows.c.version == 0) | (model.WalletBalance.version == rows.c.version),
+        )
+        .values(
+            available=model.WalletBalance.available + rows.c.available,
+            ledger=model.WalletBalance.ledger + rows.c.ledger,
+            hold=model.WalletBalance.hold + rows.c.hold,
+            version=model.WalletBalance.version + 1,
+            updatedAt=func.now(),
+        )
+        .returning(model.WalletBalance.walletId)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    rejected = sorted(set(deltas) - set(updated))
+    if rejected:
+        stale = [wallet_id for wallet_id in rejected if versions and wallet_id in versions]
+        if stale:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Wallet balance changed, please retry: wallets {stale}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Insufficient balance: wallets {rejected}")
+
+def applyWalletTransactions(db: Session, transactions: list[dict], versions: Optional[dict[int, int]] = None) -> None:
+    """
+    Apply newly booked wallet transactions (dicts with walletId, amount, type, status and settled) to the balance rows
+    """
+    applyWalletDeltas(db, getBalanceDeltas(transactions), versions)
+
+def placeHolds(db: Session, holds: list[dict], versions: Optional[dict[int, int]] = None) -> None:
+    """
+    Hold wallet funds for pending purchases (dicts with walletId, portfolioTransactionId and amount). The caller commits.
+
+    The held amount moves from available to hold in the same conditional update that checks it is covered,
+    so parallel purchases cannot all pass against the same balance. The purchase's wallet transactions stay
+    pending until the hold is converted or released.
+    """
+    if not holds:
+        return
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for hold in holds:
+        deltas[hold["walletId"]][0] -= hold["amount"]
+        deltas[hold["walletId"]][2] += hold["amount"]
+    applyWalletDeltas(db, deltas, versions)
+    db.execute(insert(model.WalletHold), holds)
+
+def closeHolds(db: Session, transaction_ids: list[int], converted: bool) -> list:
+    """
+    Close the active holds of a set of portfolio transactions and move their wallet transactions out of pending.
+    Converted holds become ledger debits; released holds return to available. The caller commits.
+
+    Returns:
+        list: the wallet transactions moved, as (id, portfolioTransactionId, type, amount, walletId) rows
+    """
+    if not transaction_ids:
+        return []
+    # closing in the UPDATE itself means a hold is only ever converted or released once
+    holds = db.execute(
+        update(model.WalletHold)
+        .where(model.WalletHold.portfolioTransactionId.in_(transaction_ids), model.WalletHold.released == False)
+        .values(released=True, converted=converted, releasedAt=func.now())
+        .returning(model.WalletHold.walletId, model.WalletHold.portfolioTransactionId, model.WalletHold.amount)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not holds:
+        return []
+
+    associations = (
+        select(model.PortfolioWalletTransactionAssociation.walletTransactionId, model.PortfolioWalletTransactionAssociation.portfolioTransactionId)
+        .where(model.PortfolioWalletTransactionAssociation.portfolioTransactionId.in_([transaction_id for _, transaction_id, _ in holds]))
+        .subquery()
+    )
+    moved = db.execute(
+        update(model.WalletTransaction)
+        .where(model.WalletTransaction.id == associations.c.walletTransactionId, model.WalletTransaction.status == schemas.TransactionStatus.PENDING)
+        .values(status=schemas.TransactionStatus.COMPLETED if converted else schemas.TransactionStatus.FAILED)
+        .returning(model.WalletTransaction.id, associations.c.portfolioTransactionId, model.WalletTransaction.type, model.WalletTransaction.amount, model.WalletTransaction.walletId)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for wallet_id, _, amount in holds:
+        if converted:
+            deltas[wallet_id][1] -= amount
+        else:
+            deltas[wallet_id][0] += amount
+        deltas[wallet_id][2] -= amount
+    applyWalletDeltas(db, deltas)
+    return moved
+
+def reverseHeldAmounts(db: Session, amounts: list[tuple[int, schemas.TransactionType, int]], description: str) -> Optional[int]:
+    """
+    Reverse the purchase journal for amounts given back to wallets, as (portfolioTransactionId, type, amount) in wallet
+    minor units, in one journal. Amounts are converted to accounting minor units the way the purchase booked them.
+
+    Returns:
+        int: the reversal journal's id, or None when there is nothing to reverse
+    """
+    if not amounts:
+        return None
+    accounts = {
+        transaction_id: (product_group, currency)
+        for transaction_id, product_group, currency in db.execute(
+            select(model.PortfolioTransaction.id, model.ProductGroup, model.Product.currency)
+            .join(model.Product, model.Product.id == model.PortfolioTransaction.productId)
+            .join(model.ProductGroup, model.ProductGroup.id == model.Product.productGroupId)
+            .where(model.PortfolioTransaction.id.in_({transaction_id for transaction_id, _, _ in amounts}))
+        ).all()
+    }
+    # the purchase debited the wallet account against the product receivable (consideration) or payable (fees)
+    reversals = defaultdict(int)
+    for transaction_id, type, amount in amounts:
+        product_group, currency = accounts[transaction_id]
+        reversals[product_group.payableAccountId if type == schemas.TransactionType.FEE else product_group.receivableAccountId] += (amount * 1470 if currency == schemas.Currency.USD else amount)
+    return postJournal(db, datetime.now(), [
+        {"accountId": 10, "amount": sum(reversals.values()), "side": schemas.EntrySide.CREDIT, "description": description},
+    ] + [
+        {"accountId": account_id, "amount": amount, "side": schemas.EntrySide.DEBIT, "description": description}
+        for account_id, amount in reversals.items()
+    ])
+
+def convertHolds(db: Session, transaction_ids: list[int], filled: Optional[dict[int, int]] = None) -> None:
+    """
+    Turn the holds of executed purchases into wallet debits. The caller commits.
+
+    filled maps a purchase that was only partly filled to the consideration it actually filled, in the transaction's
+    accounting units. Its wallet transactions are debited in full as booked; the unfilled share of the consideration
+    is refunded to the wallet by its own wallet transaction on a journal reversing that share of the purchase.
+    """
+    moved = closeHolds(db, transaction_ids, converted=True)
+    filled = filled or {}
+    considerations = [row for row in moved if row[2] != schemas.TransactionType.FEE and row[1] in filled]
+    if not considerations:
+        return
+    ordered = dict(db.execute(
+        select(model.PortfolioTransaction.id, model.PortfolioTransaction.amount)
+        .where(model.PortfolioTransaction.id.in_([transaction_id for _, transaction_id, _, _, _ in considerations]))
+    ).all())
+    refunds = [
+        (transaction_id, wallet_id, amount - amount * filled[transaction_id] // ordered[transaction_id])
+        for _, transaction_id, _, amount, wallet_id in considerations
+        if ordered[transaction_id] and filled[transaction_id] < ordered[transaction_id]
+    ]
+    refunds = [refund for refund in refunds if refund[2] > 0]
+    if not refunds:
+        return
+
+    journal_id = reverseHeldAmounts(db, [(transaction_id, schemas.TransactionType.INVESTMENT, amount) for transaction_id, _, amount in refunds], "Partly filled purchase hold release")
+    transactions = [
+        {"walletId": wallet_id, "amount": amount, "type": schemas.TransactionType.REFUND, "status": schemas.TransactionStatus.COMPLETED, "date": datetime.now(), "journalId": journal_id, "settled": True}
+        for _, wallet_id, amount in refunds
+    ]
+    wallet_transaction_ids = db.execute(insert(model.WalletTransaction).returning(model.WalletTransaction.id, sort_by_parameter_order=True), transactions).scalars().all()
+    db.execute(insert(model.PortfolioWalletTransactionAssociation), [
+        {"portfolioTransactionId": transaction_id, "walletTransactionId": wallet_transaction_id}
+        for (transaction_id, _, _), wallet_transaction_id in zip(refunds, wallet_transaction_ids)
+    ])
+    applyWalletTransactions(db, transactions)
+
+def releaseHolds(db: Session, transaction_ids: list[int]) -> None:
+    """
+    Give back the held funds of failed purchases and reverse their purchase journals in one journal. The caller commits.
+    """
+    moved = closeHolds(db, transaction_ids, converted=False)
+    reverseHeldAmounts(db, [(transaction_id, type, amount) for _, transaction_id, type, amount, _ in moved], "Failed purchase hold release")
+
+def rebuildWalletBalances(db: Session) -> int:
+    """
+    Recompute every balance row from the wallet transactions in one grouped query. The caller commits.
+
+    Holds are recounted from the active wallet holds; available is net of them.
+    """
+    completed = model.WalletTransaction.status == schemas.TransactionStatus.COMPLETED
+    outflow = completed & model.WalletTransaction.type.in_(wallet_outflow_types)
+    inflow = completed & model.WalletTransaction.type.in_(wallet_inflow_types)
+    cleared = inflow & (model.WalletTransaction.settled | model.WalletTransaction.type.not_in(wallet_settling_types))
+    totals = (
+        select(
+            model.WalletTransaction.walletId,
+            func.sum(case((cleared, model.WalletTransaction.amount), (outflow, -model.WalletTransaction.amount), else_=0)).label("available"),
+            func.sum(case((inflow, model.WalletTransaction.amount), (outflow, -model.WalletTransaction.amount), else_=0)).label("ledger"),
+        )
+        .group_by(model.WalletTransaction.walletId)
+    )
+    held = (
+        select(func.coalesce(func.sum(model.WalletHold.amount), 0))
+        .where(model.WalletHold.walletId == model.WalletBalance.walletId, model.WalletHold.released == False)
+        .scalar_subquery()
+    )
+    upsert = pg_insert(model.WalletBalance).from_select(["walletId", "available", "ledger"], totals)
+    result = db.execute(upsert.on_conflict_do_update(
+        index_elements=["walletId"],
+        set_={
+            "available": upsert.excluded.available - held,
+            "ledger": upsert.excluded.ledger,
+            "hold": held,
+            "version": model.WalletBalance.version + 1,
+            "updatedAt": func.now(),
+        },
+    ))
+    return result.rowcount